@@ -0,0 +1,127 @@
+"""
+Benchmark for GET /courses progress computation.
+
+Seeds a throwaway database with one student owning/enrolled in N courses and
+compares the old per-course loop against the current `get_courses` route.
+Reports MongoDB round trips (via a command listener) and p50/p95 latency.
+
+Usage:
+    python benchmarks/bench_get_courses.py --courses 40 --iterations 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pymongo import AsyncMongoClient, monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def seed(db, n_courses, chapters_per_course):
+    for name in ["users", "courses", "chapters", "quiz_results", "enrollments", "course_progress"]:
+        await db[name].drop()
+
+    user_id = str((await db.users.insert_one({"username": "bench_student", "role": "student"})).inserted_id)
+    org_id = str((await db.users.insert_one({"username": "bench_org", "role": "organization"})).inserted_id)
+
+    for i in range(n_courses):
+        owner = user_id if i % 2 == 0 else org_id
+        cid = str((await db.courses.insert_one({
+            "topic": f"Course {i}", "grade_level": "10", "user_id": owner, "is_published": owner == org_id
+        })).inserted_id)
+        if owner == org_id:
+            await db.enrollments.insert_one({"user_id": user_id, "course_id": cid, "progress": 0.0})
+        chapter_ids = [str(x) for x in (await db.chapters.insert_many([
+            {"course_id": cid, "title": f"Ch {j}", "chapter_number": j + 1, "order_index": j}
+            for j in range(chapters_per_course)
+        ])).inserted_ids]
+        for ch in chapter_ids[: chapters_per_course // 2]:
+            await db.quiz_results.insert_one({
+                "user_id": user_id, "course_id": cid, "chapter_id": ch, "score": 3, "total_questions": 5
+            })
+
+    from server.core import progress
+    await progress.rebuild(db)
+    return user_id
+
+
+async def legacy_get_courses(db, user_id):
+    """The pre-batching implementation: count/distinct (+ find_one) per course."""
+    courses = []
+    async for c in db.courses.find({"user_id": user_id}):
+        course_id = str(c["_id"])
+        total_chapters = await db.chapters.count_documents({"course_id": course_id})
+        completed = len(await db.quiz_results.distinct("chapter_id", {"course_id": course_id, "user_id": user_id}))
+        courses.append((course_id, (completed / total_chapters) * 100 if total_chapters else 0.0))
+    async for enr in db.enrollments.find({"user_id": user_id}):
+        ec = await db.courses.find_one({"_id": ObjectId(enr["course_id"])})
+        if not ec:
+            continue
+        course_id = str(ec["_id"])
+        total_chapters = await db.chapters.count_documents({"course_id": course_id})
+        completed = len(await db.quiz_results.distinct("chapter_id", {"course_id": course_id, "user_id": user_id}))
+        courses.append((course_id, (completed / total_chapters) * 100 if total_chapters else 0.0))
+    return courses
+
+
+async def measure(label, fn, counter, iterations):
+    await fn()  # warm up
+    counter.count = 0
+    await fn()
+    round_trips = counter.count
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"{label:<10} round_trips={round_trips:<5} p50={statistics.median(timings):.2f}ms p95={p95:.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="educore_bench")
+    parser.add_argument("--courses", type=int, default=40)
+    parser.add_argument("--chapters", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    counter = CommandCounter()
+    client = AsyncMongoClient(args.uri, event_listeners=[counter])
+    db = client[args.db]
+    user_id = await seed(db, args.courses, args.chapters)
+
+    from server import main as server_main
+    from server.models_mongo import UserModel
+    user = UserModel(_id=user_id, username="bench_student", hashed_password="x", role="student")
+
+    print(f"GET /courses with {args.courses} courses x {args.chapters} chapters")
+    await measure("before", lambda: legacy_get_courses(db, user_id), counter, args.iterations)
+    await measure("after", lambda: server_main.get_courses(current_user=user, db=db), counter, args.iterations)
+
+    await client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+Benchmark for the pooled Groq HTTP session in LLMService.
+
+Starts a local OpenAI-compatible stub (optionally over TLS) and compares the
+old per-call `requests.post` against LLMService's Groq provider, which reuses
+keep-alive connections from its pool.
+
+Usage:
+    python benchmarks/bench_llm_http_pool.py --calls 200
+    # with TLS (self-signed cert, e.g. `openssl req -x509 -nodes -newkey rsa:2048 -keyout key.pem -out cert.pem`)
+    python benchmarks/bench_llm_http_pool.py --tls-cert cert.pem --tls-key key.pem
+"""
+import argparse
+import json
+import os
+import ssl
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STUB_BODY = json.dumps({
+    "choices": [{"message": {"role": "assistant", "content": "ok"}}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11}
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(STUB_BODY)))
+        self.end_headers()
+        self.wfile.write(STUB_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(tls_cert, tls_key):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    scheme = "http"
+    if tls_cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(tls_cert, tls_key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def timed(fn, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.mean(timings), statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--tls-cert")
+    parser.add_argument("--tls-key")
+    args = parser.parse_args()
+
+    server, base_url = start_stub(args.tls_cert, args.tls_key)
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ.setdefault("GROQ_API_KEY", "bench-key")
+    os.environ["LLM_CACHE_BACKEND"] = "off"
+
+    import requests
+    from server.core.llm import LLMService
+
+    service = LLMService()
+    verify = not args.tls_cert
+    service.http.verify = verify
+    payload = {"model": "stub", "messages": [{"role": "user", "content": "hi"}]}
+
+    def fresh_connection():
+        requests.post(f"{base_url}/chat/completions", json=payload, timeout=30, verify=verify).json()
+
+    def pooled():
+        service.get_provider("groq").complete("hi", "")
+
+    fresh = timed(fresh_connection, args.calls)
+    pool = timed(pooled, args.calls)
+    print(f"{'':<18}{'mean':>10}{'p50':>10}{'p95':>10}")
+    print(f"{'requests.post':<18}{fresh[0]:>9.2f}ms{fresh[1]:>9.2f}ms{fresh[2]:>9.2f}ms")
+    print(f"{'pooled session':<18}{pool[0]:>9.2f}ms{pool[1]:>9.2f}ms{pool[2]:>9.2f}ms")
+    print(f"saved per call: {fresh[0] - pool[0]:.2f}ms (mean)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark for MediaAgent slide frame rendering.
+
+Compares the previous renderer (per-row `draw.line` gradient in pure Python and
+`ImageFont.truetype` on every frame) with `frames.render_frame` (NumPy gradient
+cached per palette, font loaded once per thread). Reports frames/sec for the
+full frame and for the background alone.
+
+Usage:
+    python benchmarks/bench_media_frames.py --frames 100
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import textwrap
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFont
+
+from server.agents.media_agent import frames
+
+TEXT = ("Photosynthesis converts light energy into chemical energy stored in glucose. "
+        "It takes place in the chloroplasts of plant cells...")
+
+
+def legacy_background(size=(1280, 720)):
+    width, height = size
+    img = Image.new('RGB', size, color='black')
+    draw = ImageDraw.Draw(img)
+    top_color = (random.randint(0, 50), random.randint(0, 50), random.randint(50, 150))
+    bottom_color = (random.randint(0, 30), random.randint(0, 30), random.randint(20, 80))
+    for y in range(height):
+        r = int(top_color[0] + (bottom_color[0] - top_color[0]) * y / height)
+        g = int(top_color[1] + (bottom_color[1] - top_color[1]) * y / height)
+        b = int(top_color[2] + (bottom_color[2] - top_color[2]) * y / height)
+        draw.line([(0, y), (width, y)], fill=(r, g, b))
+    return img, draw
+
+
+def legacy_render_frame(text, output_path, size=(1280, 720)):
+    width, height = size
+    img, draw = legacy_background(size)
+    try:
+        font = ImageFont.truetype("arial.ttf", 40)
+    except OSError:
+        font = ImageFont.load_default()
+    lines = textwrap.wrap(text, width=50)
+    text_height = 0
+    for line in lines:
+        bbox = draw.textbbox((0, 0), line, font=font)
+        text_height += bbox[3] - bbox[1] + 10
+    current_y = (height - text_height) // 2
+    for line in lines:
+        bbox = draw.textbbox((0, 0), line, font=font)
+        x = (width - (bbox[2] - bbox[0])) // 2
+        draw.text((x + 2, current_y + 2), line, font=font, fill='black')
+        draw.text((x, current_y), line, font=font, fill='white')
+        current_y += bbox[3] - bbox[1] + 10
+    img.save(output_path)
+
+
+def new_background(size=(1280, 720)):
+    top, bottom = random.choice(frames.PALETTES)
+    return frames.gradient_background(size, top, bottom).copy()
+
+
+def fps(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "frame.png")
+        # Warm up caches and imports for both variants
+        legacy_render_frame(TEXT, path)
+        frames.render_frame(TEXT, path)
+
+        results = [
+            ("background, legacy loop", fps(legacy_background, args.frames)),
+            ("background, numpy cached", fps(new_background, args.frames)),
+            ("full frame, legacy", fps(lambda: legacy_render_frame(TEXT, path), args.frames)),
+            ("full frame, render_frame", fps(lambda: frames.render_frame(TEXT, path), args.frames)),
+        ]
+
+    print(f"{'variant':<28}{'frames/sec':>12}")
+    for name, value in results:
+        print(f"{name:<28}{value:>12.1f}")
+    print(f"background speed-up: {results[1][1] / results[0][1]:.1f}x, "
+          f"full frame speed-up: {results[3][1] / results[2][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
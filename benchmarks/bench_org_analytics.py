@@ -0,0 +1,102 @@
+"""
+Benchmark for GET /org/analytics.
+
+Seeds one organization with C courses and E enrollments (with course_progress
+docs for most of them) and times the aggregation-based analytics, both cold
+(recomputed) and served from the snapshot cache.
+
+Usage:
+    python benchmarks/bench_org_analytics.py --courses 20 --enrollments 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import AsyncMongoClient
+
+from server.core import analytics, indexes
+
+
+async def seed(db, n_courses, n_enrollments, chapters_per_course):
+    for name in ["users", "courses", "enrollments", "course_progress", "analytics_snapshots"]:
+        await db[name].drop()
+    await indexes.ensure_indexes(db)
+
+    org_id = str((await db.users.insert_one({"username": "bench_org", "role": "organization"})).inserted_id)
+    course_ids = [str(x) for x in (await db.courses.insert_many([
+        {"topic": f"Course {i}", "grade_level": "10", "user_id": org_id, "is_published": True}
+        for i in range(n_courses)
+    ])).inserted_ids]
+
+    n_students = max(1, n_enrollments // 3)
+    student_ids = []
+    for start in range(0, n_students, 10000):
+        batch = [{"username": f"student_{i}", "role": "student"} for i in range(start, min(n_students, start + 10000))]
+        student_ids += [str(x) for x in (await db.users.insert_many(batch)).inserted_ids]
+
+    pairs = set()
+    while len(pairs) < n_enrollments:
+        pairs.add((random.choice(student_ids), random.choice(course_ids)))
+
+    enrollments, progress_docs = [], []
+    for uid, cid in pairs:
+        enrollments.append({"user_id": uid, "course_id": cid, "progress": 0.0})
+        if random.random() < 0.8:
+            done = [f"ch{j}" for j in range(random.randint(0, chapters_per_course))]
+            progress_docs.append({
+                "user_id": uid, "course_id": cid,
+                "completed_chapter_ids": done,
+                "chapter_scores": {ch: random.uniform(20, 100) for ch in done},
+                "total_chapters": chapters_per_course,
+                "exam_attempts": 1 if random.random() < 0.2 else 0,
+                "best_exam_percentage": random.uniform(30, 100),
+                "exam_passed": False
+            })
+    for start in range(0, len(enrollments), 10000):
+        await db.enrollments.insert_many(enrollments[start:start + 10000])
+    for start in range(0, len(progress_docs), 10000):
+        await db.course_progress.insert_many(progress_docs[start:start + 10000])
+    return org_id
+
+
+async def timed(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="educore_bench")
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--enrollments", type=int, default=100000)
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    client = AsyncMongoClient(args.uri)
+    db = client[args.db]
+    print(f"Seeding {args.courses} courses / {args.enrollments} enrollments...")
+    org_id = await seed(db, args.courses, args.enrollments, args.chapters)
+
+    p50, p95 = await timed(lambda: analytics.get_org_analytics(db, org_id, refresh=True), args.iterations)
+    print(f"recompute  p50={p50:.1f}ms p95={p95:.1f}ms")
+    p50, p95 = await timed(lambda: analytics.get_org_analytics(db, org_id), args.iterations)
+    print(f"snapshot   p50={p50:.1f}ms p95={p95:.1f}ms")
+
+    await client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
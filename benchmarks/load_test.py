@@ -0,0 +1,69 @@
+"""
+HTTP load test for authenticated read endpoints.
+
+Logs in once, then fires N requests at a fixed concurrency and reports
+throughput and latency percentiles. Run it against a single uvicorn worker on
+the sync build and on the async build to compare them:
+
+    python -m uvicorn server.main:app --workers 1 --port 8000
+    python benchmarks/load_test.py --username alice --password secret \
+        --endpoints /courses /student/messages /notes --concurrency 200 --requests 5000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def run(args):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        res = await client.post("/auth/token", data={"username": args.username, "password": args.password})
+        res.raise_for_status()
+        headers = {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+        timings = []
+        errors = 0
+        counter = iter(range(args.requests))
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                endpoint = args.endpoints[i % len(args.endpoints)]
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        r = await client.get(endpoint, headers=headers)
+                        if r.status_code != 200:
+                            errors += 1
+                    except httpx.HTTPError:
+                        errors += 1
+                    timings.append((time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+    timings.sort()
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    p99 = timings[max(0, int(len(timings) * 0.99) - 1)]
+    print(f"endpoints={args.endpoints} concurrency={args.concurrency} requests={args.requests}")
+    print(f"throughput={args.requests / elapsed:.1f} req/s errors={errors}")
+    print(f"p50={statistics.median(timings):.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--endpoints", nargs="+", default=["/courses"])
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+Polling for the API's background jobs (GET /jobs/{job_id}).
+
+Shared by the Streamlit pages (through utils.wait_for_job) and the verify_*.py
+scripts. It only needs requests, so the scripts can import it without Streamlit.
+"""
+import time
+
+import requests
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+def wait_for_job(api_url, job_id, headers, timeout=300, interval=2):
+    """Polls until the job finishes and returns the job document; a timeout is reported as a failed job."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        res = requests.get(f"{api_url}/jobs/{job_id}", headers=headers)
+        res.raise_for_status()
+        job = res.json()
+        if job["status"] in FINISHED_STATUSES:
+            return job
+        time.sleep(interval)
+    return {"status": "failed", "error": "timed out"}
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import time
 import utils
 
@@ -156,7 +157,8 @@ elif view_mode == 'new' or not st.session_state['roadmap']:
                     # FIX: Correct endpoint
                     response = requests.post(f"{API_URL}/courses/generate", json=payload, headers=utils.get_auth_headers())
                     response.raise_for_status()
-                    data = response.json()
+                    # Generation runs as a background job; wait for it to produce the course
+                    data = utils.wait_for_job(response.json()['job_id'])
                     
                     # FIX: Fetch full course details to get Chapter IDs
                     course_id = data.get('course_id')
@@ -375,13 +377,29 @@ if st.session_state.get('view_mode') == 'course' and st.session_state['roadmap']
                 cid = st.session_state['course_id']
                 chid = chapter['id']
                 
-                # st.info("DEBUG: Sending request to backend...")
-                response = requests.post(f"{API_URL}/courses/{cid}/chapters/{chid}/generate", json={}, headers=utils.get_auth_headers(), timeout=120)
-                # st.info(f"DEBUG: Response received. Status code: {response.status_code}")
-                # st.info(f"DEBUG: Raw response text: {response.text[:500]}...")
-
+                # Stream the slides (SSE) and show them as they arrive instead of waiting for the whole chapter
+                response = requests.post(f"{API_URL}/courses/{cid}/chapters/{chid}/generate/stream", headers=utils.get_auth_headers(), stream=True, timeout=120)
                 response.raise_for_status()
-                content = response.json()
+
+                content = None
+                preview = st.empty()
+                streamed_md = ""
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        data = json.loads(line[len("data: "):])
+                        if event == "token":
+                            streamed_md += data["text"]
+                            preview.markdown(streamed_md)
+                        elif event == "done":
+                            content = data
+                        elif event == "error":
+                            raise Exception(data["detail"])
+                preview.empty()
+                if content is None:
+                    raise Exception("Stream ended before the chapter was complete")
                 
 
                 
@@ -491,7 +509,8 @@ if st.session_state.get('view_mode') == 'course' and st.session_state['roadmap']
                                  # FIX: We need to pass auth since we updated the endpoint
                                  vid_resp = requests.post(f"{API_URL}/generate/video", json=vid_payload, headers=utils.get_auth_headers())
                                  vid_resp.raise_for_status()
-                                 vid_data = vid_resp.json()
+                                 # Rendering runs as a background job; wait for its video_url
+                                 vid_data = utils.wait_for_job(vid_resp.json()['job_id'], timeout=1800, interval=5)
                                  st.session_state[video_key] = vid_data['video_url']
                                  st.rerun()
                              except Exception as e:
@@ -101,7 +101,8 @@ else:
                                     payload = {"topic": topic, "grade_level": grade}
                                     # Note: Query param for child_id
                                     gen_res = requests.post(f"{API_URL}/courses/generate-for-child", params={"child_id": selected_child_id}, json=payload, headers=utils.get_auth_headers())
-                                    if gen_res.status_code == 200:
+                                    if gen_res.status_code == 202:
+                                        utils.wait_for_job(gen_res.json()["job_id"])
                                         st.success("Course assigned successfully!")
                                     else:
                                         st.error("Failed to assign course")
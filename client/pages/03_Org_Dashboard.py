@@ -203,10 +203,15 @@ with tab_courses:
                         
                         # Use the new endpoint that updates the DB directly
                         plan_res = requests.post(f"{API_URL}/org/courses/{cid}/plan", json=ai_payload, headers=utils.get_auth_headers())
-                        if plan_res.status_code == 200:
-                            new_roadmap = plan_res.json()
-                            st.success("AI Plan Generated & Saved!")
-                            st.rerun() # Rerun to show the new modules
+                        if plan_res.status_code == 202:
+                            try:
+                                new_roadmap = utils.wait_for_job(plan_res.json()["job_id"])["roadmap"]
+                            except Exception as e:
+                                new_roadmap = None
+                                st.error(f"AI Planning failed: {e}")
+                            if new_roadmap is not None:
+                                st.success("AI Plan Generated & Saved!")
+                                st.rerun() # Rerun to show the new modules
                         else:
                             st.error(f"AI Planning failed: {plan_res.text}")
 
@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 import time
 import extra_streamlit_components as stx
+import job_polling
 
 # Cookie Manager (Singleton-ish)
 @st.cache_resource
@@ -59,6 +60,13 @@ def get_auth_headers():
         return {"Authorization": f"Bearer {st.session_state['token']}"}
     return {}
 
+def wait_for_job(job_id, timeout=300, interval=2):
+    """Polls GET /jobs/{job_id} until the background job finishes. Returns its result or raises."""
+    job = job_polling.wait_for_job(API_URL, job_id, get_auth_headers(), timeout, interval)
+    if job["status"] != "succeeded":
+        raise Exception(job.get("error") or f"Job {job['status']}")
+    return job["result"]
+
 def logout():
     # Clear cookies
     cookie_manager.delete("token", key="del_token")
@@ -1,46 +1,168 @@
-import json
-from server.core.llm import LLMService
+import asyncio
+import logging
+from pydantic import BaseModel
+from server.core import json_repair
+from server.core.llm import get_llm_service
 from server.shared.schemas import Chapter, ChapterContent, QuizQuestion
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple, Union
 
-class ContentAgent:
-    def __init__(self):
-        self.llm = LLMService()
+# Separates the streamed slides from the trailing quiz JSON
+QUIZ_DELIMITER = "===QUIZ==="
 
-    def generate_chapter_content(self, chapter: Chapter) -> Optional[ChapterContent]:
-        system_prompt = (
-            "You are an expert world-class educator. Write a HIGHLY EXHAUSTIVE, deeply detailed, and "
-            "comprehensive lecture for the provided chapter. The content must be formatted as a SERIES OF SLIDES "
-            "found in a presentation, containing 6-10 slides total. Each slide MUST have at least 150-250 words of rich content. "
-            "Structure it using '## ' for each Slide Title. "
-            "CRITICAL FORMATTING RULES: "
-            "1. You MUST use standard Markdown syntax (bolding `**`, lists `-`, etc.). "
-            "2. If mathematics, formulas, or equations are relevant, you MUST use LaTeX math formatting enclosed in "
-            "dollar signs. Use inline math like `$E=mc^2$` and block math like `$$E=mc^2$$`. Since this is returned "
-            "in JSON, BE SURE to properly escape your backslashes (e.g. `\\\\frac`). "
-            "3. Embed 1-2 highly relevant, dynamic images within each slide where appropriate. To do this, use standard "
-            "markdown image syntax with a public placeholder API (e.g., `![Visual Representation](https://loremflickr.com/800/400/education,keyword)` "
-            "Replace 'keyword' with 1 or 2 specific topic words). "
-            "4. Make the content incredibly dense, professional, visually engaging, and thoroughly explanatory. "
+logger = logging.getLogger(__name__)
+
+class _QuizResponse(BaseModel):
+    quiz: List[QuizQuestion]
+
+
+def _lecture_system_prompt(json_output: bool) -> str:
+    """The lecture prompt shared by generate_chapter_content (JSON) and stream_chapter_content (markdown + quiz)."""
+    if json_output:
+        escape_note = " Since this is returned in JSON, BE SURE to properly escape your backslashes (e.g. `\\\\frac`)."
+        output_format = (
             "Return ONLY perfectly valid JSON. Do not return markdown wrappers. "
             "Format: { \"chapter_title\": String, \"content_markdown\": String (joined with \\n\\n), "
             "\"quiz\": [{ \"question\": String, \"options\": [String], \"correct_answer\": Int }] }"
         )
-        user_prompt = f"Write deeply comprehensive content for Chapter {chapter.chapter_number}: {chapter.title}. Description: {chapter.description}"
+    else:
+        escape_note = ""
+        output_format = (
+            "OUTPUT FORMAT: Write the slides as raw Markdown (no code fences, no JSON). "
+            f"After the last slide, write a line containing only {QUIZ_DELIMITER} followed by the chapter quiz as a "
+            "JSON array: [{ \"question\": String, \"options\": [String], \"correct_answer\": Int }]"
+        )
+    return (
+        "You are an expert world-class educator. Write a HIGHLY EXHAUSTIVE, deeply detailed, and "
+        "comprehensive lecture for the provided chapter. The content must be formatted as a SERIES OF SLIDES "
+        "found in a presentation, containing 6-10 slides total. Each slide MUST have at least 150-250 words of rich content. "
+        "Structure it using '## ' for each Slide Title. "
+        "CRITICAL FORMATTING RULES: "
+        "1. You MUST use standard Markdown syntax (bolding `**`, lists `-`, etc.). "
+        "2. If mathematics, formulas, or equations are relevant, you MUST use LaTeX math formatting enclosed in "
+        f"dollar signs. Use inline math like `$E=mc^2$` and block math like `$$E=mc^2$$`.{escape_note} "
+        "3. Embed 1-2 highly relevant, dynamic images within each slide where appropriate. To do this, use standard "
+        "markdown image syntax with a public placeholder API (e.g., `![Visual Representation](https://loremflickr.com/800/400/education,keyword)` "
+        "Replace 'keyword' with 1 or 2 specific topic words). "
+        "4. Make the content incredibly dense, professional, visually engaging, and thoroughly explanatory. "
+        + output_format
+    )
+
+
+def _lecture_user_prompt(chapter: Chapter) -> str:
+    return (f"Write deeply comprehensive content for Chapter {chapter.chapter_number}: {chapter.title}. "
+            f"Description: {chapter.description}")
+
+
+class ContentAgent:
+    def __init__(self):
+        self.llm = get_llm_service()
+
+    def generate_chapter_content(self, chapter: Chapter, bypass_cache: bool = False) -> Optional[ChapterContent]:
+        system_prompt = _lecture_system_prompt(json_output=True)
+        user_prompt = _lecture_user_prompt(chapter)
         
-        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True)
+        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True, bypass_cache=bypass_cache,
+                                          agent="content")
         
         if not response_text:
             return None
 
-        cleaned_text = response_text.replace("```json", "").replace("```", "").strip()
+        result = json_repair.parse(response_text, ChapterContent, context=f"chapter:{chapter.title}")
+        if result.ok:
+            return result.value
 
-        try:
-            data = json.loads(cleaned_text)
-            return ChapterContent(**data)
-        except json.JSONDecodeError:
-            print(f"Failed to parse JSON content: {cleaned_text}")
+        # Keep whatever part of the (expensive) response is usable and only ask again for the rest
+        data = result.data if isinstance(result.data, dict) else {}
+        markdown = data.get("content_markdown")
+        if "*" in result.invalid_fields or not isinstance(markdown, str) or not markdown.strip():
+            logger.error("Chapter content unusable", extra={"invalid_fields": result.invalid_fields})
             return None
+
+        quiz = data.get("quiz") if "quiz" not in result.invalid_fields else None
+        if not quiz:
+            quiz = self.generate_quiz(chapter, markdown, bypass_cache=bypass_cache)
+            if quiz is None:
+                return None
+        try:
+            return ChapterContent(chapter_title=chapter.title, content_markdown=markdown, quiz=quiz)
         except Exception as e:
-            print(f"Validation error: {e}")
+            logger.error("Chapter content validation error: %s", e)
+            return None
+
+    def generate_quiz(self, chapter: Chapter, content_markdown: str,
+                      bypass_cache: bool = False) -> Optional[List[QuizQuestion]]:
+        """Generates only the quiz for already generated chapter content."""
+        system_prompt = (
+            "You are an expert educator writing a short multiple-choice quiz for a lecture. "
+            "Write 3-5 questions that test the key ideas of the lecture. "
+            "Return ONLY valid JSON. Format: "
+            "{ \"quiz\": [{ \"question\": String, \"options\": [String], \"correct_answer\": Int }] }"
+        )
+        user_prompt = (
+            f"Chapter {chapter.chapter_number}: {chapter.title}\n\n"
+            f"Lecture:\n{content_markdown[:6000]}"
+        )
+        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True, bypass_cache=bypass_cache,
+                                          agent="content")
+        result = json_repair.parse(response_text, _QuizResponse, context=f"quiz:{chapter.title}")
+        if not result.ok or not result.value.quiz:
+            logger.error("Quiz generation failed", extra={"chapter": chapter.title})
             return None
+        return result.value.quiz
+
+    async def stream_chapter_content(self, chapter: Chapter, bypass_cache: bool = False
+                                     ) -> AsyncIterator[Tuple[str, Union[str, ChapterContent, None]]]:
+        """
+        Streams a chapter as ("token", markdown_delta) events followed by one
+        ("done", ChapterContent) event, or ("done", None) if no quiz could be produced.
+
+        JSON cannot be rendered until it is complete, so the streaming prompt asks for
+        plain markdown slides first and the quiz as a JSON array after QUIZ_DELIMITER.
+        """
+        system_prompt = _lecture_system_prompt(json_output=False)
+        user_prompt = _lecture_user_prompt(chapter)
+
+        buffer = ""
+        markdown_parts = []
+        in_quiz = False
+        async for chunk in self.llm.astream(user_prompt, system_prompt, bypass_cache=bypass_cache, agent="content"):
+            buffer += chunk
+            if in_quiz:
+                continue
+            if QUIZ_DELIMITER in buffer:
+                markdown, buffer = buffer.split(QUIZ_DELIMITER, 1)
+                in_quiz = True
+            else:
+                # Hold back a delimiter-sized tail in case the delimiter is split across chunks
+                cut = max(0, len(buffer) - len(QUIZ_DELIMITER))
+                markdown, buffer = buffer[:cut], buffer[cut:]
+            if markdown:
+                markdown_parts.append(markdown)
+                yield "token", markdown
+
+        quiz = None
+        if not in_quiz:
+            # No quiz section: whatever is left is still slide content
+            if buffer:
+                markdown_parts.append(buffer)
+                yield "token", buffer
+            logger.warning("Streamed content had no quiz section", extra={"chapter": chapter.title})
+        else:
+            quiz = json_repair.parse(buffer, List[QuizQuestion], context=f"stream_quiz:{chapter.title}").value
+
+        content_markdown = "".join(markdown_parts).strip()
+        if not content_markdown:
+            yield "done", None
+            return
+        if not quiz:
+            # The slides have already been streamed; only the quiz is requested again
+            quiz = await asyncio.to_thread(self.generate_quiz, chapter, content_markdown, bypass_cache)
+            if quiz is None:
+                yield "done", None
+                return
+
+        yield "done", ChapterContent(
+            chapter_title=chapter.title,
+            content_markdown=content_markdown,
+            quiz=quiz
+        )
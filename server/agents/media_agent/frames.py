@@ -0,0 +1,93 @@
+"""
+Slide frame rendering for MediaAgent.
+
+Kept free of moviepy/edge-tts imports so the benchmarks can load it on its own.
+`render_frame` runs in a thread pool per render. Gradient backgrounds are
+cached per process and copied before drawing; fonts are cached per thread,
+because a FreeType face must not be used from several threads at once.
+"""
+import random
+import textwrap
+import threading
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+Color = Tuple[int, int, int]
+
+# Gradient palettes (top, bottom), drawn once from the same ranges the per-frame
+# random colours used to come from, so backgrounds can be cached and reused
+_palette_rng = random.Random(20240601)
+PALETTES = [
+    (
+        (_palette_rng.randint(0, 50), _palette_rng.randint(0, 50), _palette_rng.randint(50, 150)),
+        (_palette_rng.randint(0, 30), _palette_rng.randint(0, 30), _palette_rng.randint(20, 80))
+    )
+    for _ in range(8)
+]
+
+
+@lru_cache(maxsize=len(PALETTES) * 2)
+def gradient_background(size: Tuple[int, int], top_color: Color, bottom_color: Color) -> Image.Image:
+    """Vertical gradient built with NumPy broadcasting. Cached; callers must copy() before drawing."""
+    width, height = size
+    top = np.array(top_color, dtype=np.float64)
+    bottom = np.array(bottom_color, dtype=np.float64)
+    # One RGB row per y, identical across the width
+    rows = (top + (bottom - top) * (np.arange(height)[:, None] / height)).astype(np.uint8)
+    pixels = np.ascontiguousarray(np.broadcast_to(rows[:, None, :], (height, width, 3)))
+    return Image.fromarray(pixels, "RGB")
+
+
+_fonts = threading.local()
+
+
+def load_font(size: int = 40):
+    # Loaded once per thread instead of once per frame
+    cache = getattr(_fonts, "by_size", None)
+    if cache is None:
+        cache = _fonts.by_size = {}
+    if size not in cache:
+        try:
+            # Try to load a nice font, fallback to default
+            cache[size] = ImageFont.truetype("arial.ttf", size)
+        except OSError:
+            cache[size] = ImageFont.load_default()
+    return cache[size]
+
+
+def render_frame(text: str, output_path: str, size=(1280, 720)) -> str:
+    width, height = size
+    top_color, bottom_color = random.choice(PALETTES)
+    img = gradient_background(tuple(size), top_color, bottom_color).copy()
+    draw = ImageDraw.Draw(img)
+
+    # Draw text
+    font = load_font(40)
+
+    # Wrap text
+    lines = textwrap.wrap(text, width=50) # Adjust width based on font size roughly
+
+    # Calculate text height to center it
+    line_spacing = 10
+    boxes = [draw.textbbox((0, 0), line, font=font) for line in lines]
+    text_height = sum(bbox[3] - bbox[1] + line_spacing for bbox in boxes)
+
+    current_y = (height - text_height) // 2
+
+    for line, bbox in zip(lines, boxes):
+        line_width = bbox[2] - bbox[0]
+        x = (width - line_width) // 2
+
+        # Draw shadow/outline for readability
+        shadow_offset = 2
+        draw.text((x+shadow_offset, current_y+shadow_offset), line, font=font, fill='black')
+        draw.text((x, current_y), line, font=font, fill='white')
+
+        current_y += bbox[3] - bbox[1] + line_spacing
+
+    # Frames are intermediate files read back once by moviepy: favour speed over size
+    img.save(output_path, compress_level=1)
+    return output_path
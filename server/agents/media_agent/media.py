@@ -1,195 +1,340 @@
 
 import os
 import asyncio
-import nest_asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 import edge_tts
 from moviepy.editor import TextClip, AudioFileClip, CompositeVideoClip, ColorClip, concatenate_videoclips, ImageClip
-from server.core.llm import LLMService
-from PIL import Image, ImageDraw, ImageFont
-import textwrap
-import random
+from proglog import ProgressBarLogger
+from server.agents.media_agent.frames import render_frame
+from server.core import json_repair, log, media_cache, metrics, scratch
+from server.core.llm import get_llm_service
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TTS_CONCURRENCY = int(os.getenv("MEDIA_TTS_CONCURRENCY", "6"))
+MEDIA_RENDER_WORKERS = int(os.getenv("MEDIA_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+MEDIA_VOICE = os.getenv("MEDIA_VOICE", "en-US-AriaNeural")
+
+# Part of the video cache key: bump "version" whenever frames or assembly change
+RENDER_SETTINGS = {"size": [1280, 720], "fps": 24, "codec": "libx264", "audio_codec": "aac", "version": 1}
+
+# Wall-clock seconds per pipeline stage, summed over all videos
+_stage_stats: Dict[str, float] = {}
+_video_stats = {"videos": 0, "failed": 0, "segments": 0}
+
+
+def _media_metrics() -> dict:
+    videos = max(1, _video_stats["videos"])
+    return {
+        **_video_stats,
+        "avg_stage_seconds": {stage: round(total / videos, 2) for stage, total in _stage_stats.items()}
+    }
+
+
+metrics.register("media_pipeline", _media_metrics)
+
+
+def record_video(succeeded: bool, segments: int = 0, timings: Optional[Dict[str, float]] = None,
+                 tts_cached: int = 0):
+    """Adds one finished video to the media_pipeline and media_cache metrics (kept by the API process)."""
+    if not succeeded:
+        _video_stats["failed"] += 1
+        return
+    _video_stats["videos"] += 1
+    _video_stats["segments"] += segments
+    media_cache.count_tts(tts_cached, segments - tts_cached)
+    for name, seconds in (timings or {}).items():
+        _stage_stats[name] = _stage_stats.get(name, 0.0) + seconds
+
+
+def _segment_texts(script) -> List[str]:
+    """Normalises the script the LLM returned into a list of narration texts."""
+    # Ensure script is a list
+    if isinstance(script, dict):
+         # Handle case where LLM returns {"script": [...]} or similar
+         if "script" in script and isinstance(script["script"], list):
+             script = script["script"]
+         elif "segments" in script and isinstance(script["segments"], list):
+             script = script["segments"]
+         else:
+             # Try to find any list value
+             found_list = False
+             for key, val in script.items():
+                 if isinstance(val, list):
+                     script = val
+                     found_list = True
+                     break
+             if not found_list:
+                 logger.debug("Script dictionary has no list value; wrapping in list")
+                 script = [script]
+
+    if not isinstance(script, list):
+        logger.debug("Script is not a list; wrapping in list")
+        script = [script]
+
+    texts = []
+    for idx, segment in enumerate(script):
+        text = ""
+        if isinstance(segment, str):
+            text = segment
+        elif isinstance(segment, dict):
+            text = segment.get('text', '')
+            if not text:
+                 # Try other common keys
+                 text = segment.get('content', '') or segment.get('narration', '') or segment.get('script', '')
+        else:
+            logger.warning("Skipping segment %d of unknown type %s", idx, type(segment).__name__)
+            continue
+
+        if not text:
+            logger.debug("Skipping empty segment %d", idx)
+            continue
+        texts.append(text)
+    return texts
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class _StageTimer:
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    def add(self, stage: str, started: float):
+        self.timings[stage] = round(time.monotonic() - started, 2)
+
+
+class _EncodeLogger(ProgressBarLogger):
+    """Forwards moviepy's encoding progress and stops the encode once cancelled."""
+
+    def __init__(self, on_progress: Callable[[float], None], cancel=None):
+        super().__init__()
+        self.on_progress = on_progress
+        self.cancel = cancel
+        self._last = -1
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if self.cancel is not None and self.cancel.is_set():
+            raise RenderCancelled()
+        if bar != "t" or attr != "index":
+            return
+        total = self.bars[bar].get("total") or 0
+        if total:
+            percent = int(100 * value / total)
+            # One report per percent; moviepy calls this once per frame
+            if percent != self._last:
+                self._last = percent
+                self.on_progress(percent / 100)
+
+
+async def _synthesize(semaphore: asyncio.Semaphore, text: str, audio_path: str) -> bool:
+    """Writes the narration of `text` to the TTS cache at `audio_path`. Returns True on a cache hit."""
+    if media_cache.touch(audio_path):
+        return True
+    async with semaphore:
+        communicate = edge_tts.Communicate(text, MEDIA_VOICE)
+        # Write aside and rename, so a concurrent render never reads a half-written clip
+        partial = f"{audio_path}.{os.getpid()}.part"
+        try:
+            await communicate.save(partial)
+            os.replace(partial, audio_path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    return False
+
+
+async def _render(pool: ThreadPoolExecutor, text: str, img_path: str) -> Optional[str]:
+    # Increase text length limit for visuals since segments might be longer
+    display_text = text[:150] + "..." if len(text) > 150 else text
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, render_frame, display_text, img_path)
+    except Exception as e:
+        logger.warning("Error rendering frame %s: %s. Falling back to black.", img_path, e)
+        return None
+
+
+def _assemble(audio_paths: List[str], frame_paths: List[Optional[str]], output_path: str, work_dir: str,
+              encode_logger=None):
+    # Every clip holds an ffmpeg reader (a subprocess and its pipes) until closed
+    opened = []
+    try:
+        clips = []
+        for audio_path, img_path in zip(audio_paths, frame_paths):
+            audio_clip = AudioFileClip(audio_path)
+            opened.append(audio_clip)
+            duration = audio_clip.duration + 0.5 # Add small pause
+
+            # Visual (Pillow Image with Text)
+            if img_path:
+                video_clip = ImageClip(img_path).set_duration(duration)
+            else:
+                video_clip = ColorClip(size=tuple(RENDER_SETTINGS["size"]), color=(0,0,0), duration=duration)
+            opened.append(video_clip)
+
+            video_clip = video_clip.set_audio(audio_clip)
+            clips.append(video_clip)
+
+        final_video = concatenate_videoclips(clips)
+        opened.append(final_video)
+        final_video.write_videofile(output_path, fps=RENDER_SETTINGS["fps"], codec=RENDER_SETTINGS["codec"],
+                                    audio_codec=RENDER_SETTINGS["audio_codec"],
+                                    # moviepy puts the intermediate audio track in the working directory otherwise
+                                    temp_audiofile=os.path.join(work_dir, "audio.m4a"),
+                                    logger=encode_logger or "bar")
+    finally:
+        for clip in reversed(opened):
+            try:
+                clip.close()
+            except Exception as e:
+                logger.debug("Closing clip failed: %s", e)
+
+
+def render_video(topic: str, texts: List[str], output_dir: str, progress=None, cancel=None,
+                 filename: Optional[str] = None, request_id: Optional[str] = None) -> dict:
+    """
+    Turns narration texts into an mp4 in `output_dir` (as `filename` if given).
+    Returns its /static/videos/ URL as "video_url", the per-stage wall-clock
+    seconds as "stage_seconds" and the number of segments whose narration came
+    from the TTS cache as "tts_cached". Synchronous and picklable, so it can
+    run in a process pool: `progress` is an optional queue receiving (stage,
+    fraction) tuples and `cancel` an optional event; once it is set, rendering
+    stops with RenderCancelled at the next stage boundary or encoded frame.
+    `request_id` tags the log lines written by the render (e.g. "job:<id>").
+
+    Stages: TTS for every segment not in the TTS cache (at most
+    MEDIA_TTS_CONCURRENCY at once) in parallel with frame rendering in the
+    frame threads, then clip assembly and encoding once all segments are ready.
+    """
+    if not texts:
+        raise ValueError("No clips were generated! Check script content.")
+    if request_id:
+        log.set_request_id(request_id)
+
+    def report(stage: str, fraction: float):
+        if progress is not None:
+            progress.put((stage, fraction))
+
+    def check_cancelled():
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+
+    timer = _StageTimer()
+    started = time.monotonic()
+    audio_paths = [media_cache.tts_path(text, MEDIA_VOICE) for text in texts]
+
+    async def prepare_segments(frame_paths: List[str]):
+        semaphore = asyncio.Semaphore(MEDIA_TTS_CONCURRENCY)
+        done = 0
+
+        async def tts(text, path):
+            nonlocal done
+            check_cancelled()
+            hit = await _synthesize(semaphore, text, path)
+            done += 1
+            report("tts", done / len(texts))
+            return hit
+
+        async def tts_stage():
+            stage = time.monotonic()
+            hits = await asyncio.gather(*(tts(text, path) for text, path in zip(texts, audio_paths)))
+            timer.add("tts", stage)
+            return sum(hits)
+
+        async def frame_stage():
+            stage = time.monotonic()
+            # Threads of this render only: PIL releases the GIL while it encodes, and
+            # the pool cannot outlive the render (render_video already runs in a worker process)
+            with ThreadPoolExecutor(max_workers=MEDIA_RENDER_WORKERS, thread_name_prefix="frames") as pool:
+                rendered = await asyncio.gather(*(_render(pool, text, path)
+                                                  for text, path in zip(texts, frame_paths)))
+            timer.add("frames", stage)
+            return rendered
+
+        return await asyncio.gather(tts_stage(), frame_stage())
+
+    filename = filename or f"video_{topic.replace(' ', '_')}_{int(time.time())}.mp4"
+    output_path = os.path.join(output_dir, filename)
+    # Hidden until complete, so a cached name never points at a half-encoded file. It stays
+    # next to the output rather than in the scratch directory so the final rename is atomic.
+    partial_path = os.path.join(output_dir, f".{int(time.time() * 1000)}_{os.getpid()}_{filename}")
+    # Frames and moviepy's temporary audio go to a directory of this render only
+    with scratch.job_dir() as work_dir:
+        try:
+            frame_paths = [os.path.join(work_dir, f"frame_{idx}.png") for idx in range(len(texts))]
+
+            # 1. Generate Audio and Frames, concurrently
+            tts_cached, rendered = asyncio.run(prepare_segments(frame_paths))
+            check_cancelled()
+
+            # 2. Concatenate and Write
+            stage = time.monotonic()
+            _assemble(audio_paths, rendered, partial_path, work_dir,
+                      _EncodeLogger(lambda fraction: report("encode", fraction), cancel))
+            os.replace(partial_path, output_path)
+            timer.add("assemble", stage)
+            timer.add("total", started)
+            logger.info("Video rendered", extra={
+                "topic": topic, "segments": len(texts), "tts_cached": tts_cached, "stage_seconds": timer.timings
+            })
+            return {"video_url": f"/static/videos/{filename}", "stage_seconds": timer.timings,
+                    "tts_cached": tts_cached}
+        except RenderCancelled:
+            logger.info("Video rendering cancelled", extra={"topic": topic})
+            raise
+        finally:
+            # The scratch directory goes with the context manager; narration stays in the TTS cache
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
 
-# Patch for nested asyncio loops (needed for edge-tts in some envs)
-nest_asyncio.apply()
 
 class MediaAgent:
     def __init__(self):
-        self.llm = LLMService()
-        self.output_dir = os.path.join(os.getcwd(), "client", "static", "videos")
+        self.llm = get_llm_service()
+        self.output_dir = media_cache.VIDEO_DIR
         os.makedirs(self.output_dir, exist_ok=True)
         
     def _create_text_image(self, text, output_path, size=(1280, 720)):
-        # Create gradient background
-        width, height = size
-        img = Image.new('RGB', size, color='black')
-        draw = ImageDraw.Draw(img)
-        
-        # Simple gradient effect (vertical)
-        top_color = (random.randint(0, 50), random.randint(0, 50), random.randint(50, 150))
-        bottom_color = (random.randint(0, 30), random.randint(0, 30), random.randint(20, 80))
-        
-        for y in range(height):
-            r = int(top_color[0] + (bottom_color[0] - top_color[0]) * y / height)
-            g = int(top_color[1] + (bottom_color[1] - top_color[1]) * y / height)
-            b = int(top_color[2] + (bottom_color[2] - top_color[2]) * y / height)
-            draw.line([(0, y), (width, y)], fill=(r, g, b))
-            
-        # Draw text
-        try:
-            # Try to load a nice font, fallback to default
-            font = ImageFont.truetype("arial.ttf", 40)
-        except:
-            font = ImageFont.load_default()
-            
-        # Wrap text
-        lines = textwrap.wrap(text, width=50) # Adjust width based on font size roughly
-        
-        # Calculate text height to center it
-        text_height = 0
-        line_spacing = 10
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            text_height += bbox[3] - bbox[1] + line_spacing
-            
-        current_y = (height - text_height) // 2
-        
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            line_width = bbox[2] - bbox[0]
-            x = (width - line_width) // 2
-            
-            # Draw shadow/outline for readability
-            shadow_offset = 2
-            draw.text((x+shadow_offset, current_y+shadow_offset), line, font=font, fill='black')
-            draw.text((x, current_y), line, font=font, fill='white')
-            
-            current_y += bbox[3] - bbox[1] + line_spacing
-            
-        img.save(output_path)
+        return render_frame(text, output_path, size)
 
+    def generate_segments(self, content_markdown: str) -> List[str]:
+        """Writes the lecture script (LLM) and returns its narration texts; raises if there is none."""
+        script = self._generate_script(content_markdown)
+        if not script:
+            raise Exception("Failed to generate video script")
+        texts = _segment_texts(script)
+        logger.info("Processing script segments", extra={"segments": len(texts)})
+        return texts
 
     async def generate_video(self, topic: str, content_markdown: str) -> str:
         """
-        Generates a video summary for the given content.
-        Returns the relative path to the generated video.
+        Generates a video summary for the given content in this process.
+        Returns the relative path to the generated video, or None on failure.
+
+        The API renders videos through the "media.video" job instead (see
+        server.core.videos), which runs `render_video` in a process pool.
         """
-        print(f"DEBUG: Starting video generation for {topic}")
-        
-        # 1. Generate Script
-        script = self._generate_script(content_markdown)
-        if not script:
-            raise Exception("Failed to generate video script")
-            
-        print(f"DEBUG: Script generated. Type: {type(script)}")
-        import json
+        logger.info("Starting video generation", extra={"topic": topic})
         try:
-            print(f"DEBUG: Script preview: {json.dumps(script)[:500]}")
-        except:
-             print(f"DEBUG: Script preview (raw): {script}")
-
-        # Ensure script is a list
-        if isinstance(script, dict):
-             # Handle case where LLM returns {"script": [...]} or similar
-             if "script" in script and isinstance(script["script"], list):
-                 script = script["script"]
-             elif "segments" in script and isinstance(script["segments"], list):
-                 script = script["segments"]
-             else:
-                 # Try to find any list value
-                 found_list = False
-                 for key, val in script.items():
-                     if isinstance(val, list):
-                         script = val
-                         found_list = True
-                         break
-                 if not found_list:
-                     print("DEBUG: Dictionary returned but no list found. Wrapping in list.")
-                     script = [script]
-
-        if not isinstance(script, list):
-            print("DEBUG: Script is not a list. Wrapping in list.")
-            script = [script]
-            
-        print(f"DEBUG: Processing {len(script)} segments")
-        
-        # 2. Generate Audio and Clips
-        clips = []
-        try:
-            for idx, segment in enumerate(script):
-                print(f"DEBUG: Processing segment {idx+1}/{len(script)}")
-                text = ""
-                if isinstance(segment, str):
-                    text = segment
-                elif isinstance(segment, dict):
-                    text = segment.get('text', '')
-                    if not text:
-                         # Try other common keys
-                         text = segment.get('content', '') or segment.get('narration', '') or segment.get('script', '')
-                else:
-                    print(f"DEBUG: Unknown segment type: {type(segment)}")
-                    continue
-                
-                if not text:
-                    print(f"DEBUG: Empty text for segment {idx}")
-                    continue
-
-                print(f"DEBUG: Segment text length: {len(text)}")
-                
-                # Increase text length limit for visuals since segments might be longer
-                display_text = text[:150] + "..." if len(text) > 150 else text
-                
-                # Audio
-                audio_path = os.path.join(self.output_dir, f"temp_{idx}.mp3")
-                communicate = edge_tts.Communicate(text, "en-US-AriaNeural")
-                await communicate.save(audio_path)
-                
-                audio_clip = AudioFileClip(audio_path)
-                duration = audio_clip.duration + 0.5 # Add small pause
-                
-                # Visual (Pillow Image with Text)
-                try:
-                    # Create image using PIL
-                    img_path = os.path.join(self.output_dir, f"frame_{idx}.png")
-                    self._create_text_image(display_text, img_path)
-                    
-                    # Create ImageClip
-                    video_clip = ImageClip(img_path).set_duration(duration)
-                except Exception as e:
-                    print(f"Error creating image clip: {e}. Fallback to black.")
-                    video_clip = ColorClip(size=(1280, 720), color=(0,0,0), duration=duration)
-
-                video_clip = video_clip.set_audio(audio_clip)
-                clips.append(video_clip)
-            
-            if not clips:
-                raise Exception("No clips were generated! Check script content.")
-
-            # 3. Concatenate and Write
-            final_video = concatenate_videoclips(clips)
-            filename = f"video_{topic.replace(' ', '_')}_{int(asyncio.get_event_loop().time())}.mp4"
-            output_path = os.path.join(self.output_dir, filename)
-            
-            final_video.write_videofile(output_path, fps=24, codec="libx264", audio_codec="aac")
-            
-            # Cleanup temp files
-            for idx in range(len(script)):
-                try:
-                    os.remove(os.path.join(self.output_dir, f"temp_{idx}.mp3"))
-                    os.remove(os.path.join(self.output_dir, f"frame_{idx}.png"))
-                except:
-                    pass
-                    
-            # Return relative path for frontend
-            return f"/static/videos/{filename}"
-
-        except Exception as e:
-            error_msg = f"Error in video generation: {e}"
-            print(error_msg)
-            with open("debug_media.txt", "a") as f:
-                f.write(error_msg + "\n")
-                import traceback
-                f.write(traceback.format_exc() + "\n")
+            texts = await asyncio.to_thread(self.generate_segments, content_markdown)
+            render_id = media_cache.begin_render()
+            try:
+                rendered = await asyncio.to_thread(render_video, topic, texts, self.output_dir)
+            finally:
+                await asyncio.to_thread(media_cache.finish_render, render_id)
+        except Exception:
+            record_video(False)
+            logger.exception("Error in video generation", extra={"topic": topic})
             return None
+        record_video(True, len(texts), rendered["stage_seconds"], rendered["tts_cached"])
+        return rendered["video_url"]
 
     def _generate_script(self, content: str):
         prompt = (
@@ -199,22 +344,16 @@ class MediaAgent:
             "Return ONLY a JSON array of objects, where each object has a 'text' field.\n"
             "Example: [{'text': 'Welcome to this in-depth lecture on...'}, {'text': 'To truly understand this, we must look at...'}]\n"
         )
-        response = self.llm.generate(content[:6000], prompt, json_mode=True)
+        response = self.llm.generate(content[:6000], prompt, json_mode=True, agent="media")
         if response:
-            print(f"DEBUG: LLM Response (first 200 chars): {response[:200]}")
-            import json
+            logger.debug("Script response", extra={"response_preview": response[:200]})
             try:
-                clean_json = response.replace("```json", "").replace("```", "").strip()
-                # Find the first '[' and last ']' to handle potential extra text
-                start = clean_json.find('[')
-                end = clean_json.rfind(']')
-                if start != -1 and end != -1:
-                     clean_json = clean_json[start:end+1]
-                elif clean_json.startswith('{'):
-                     # Might be a single object or wrapped in { "script": ... }
-                     pass 
-                
-                return json.loads(clean_json)
-            except Exception as e:
-                print(f"Failed to parse script JSON: {response[:500]}... Error: {e}")
+                # Handles fences, prose around the array, LaTeX escapes and a script cut off mid-segment
+                script, repaired, truncated = json_repair.loads(response)
+            except ValueError as e:
+                logger.error("Failed to parse script JSON: %s", e, extra={"response_preview": response[:500]})
+                return None
+            if repaired:
+                logger.warning("Repaired script JSON", extra={"truncated": truncated})
+            return script
         return None
@@ -1,11 +1,18 @@
-import json
-from server.core.llm import LLMService
+import logging
+from pydantic import BaseModel
+from server.core import json_repair
+from server.core.llm import get_llm_service
 from server.shared.schemas import CourseRoadmap, Chapter
-from typing import Optional
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+class _ChaptersResponse(BaseModel):
+    chapters: List[Chapter]
 
 class PlannerAgent:
     def __init__(self):
-        self.llm = LLMService()
+        self.llm = get_llm_service()
 
     def generate_roadmap(self, topic: str, grade_level: str, structure_type: str = "week") -> Optional[CourseRoadmap]:
         prompt_structure = "chapters"
@@ -23,47 +30,70 @@ class PlannerAgent:
         )
         user_prompt = f"Create a {structure_type}-based course roadmap for '{topic}' at a '{grade_level}' level."
         
-        with open("debug_planner.txt", "a", encoding="utf-8") as f:
-            f.write(f"DEBUG: Generating roadmap for {topic}\n")
+        logger.info("Generating roadmap", extra={"topic": topic, "structure_type": structure_type})
         
-        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True)
+        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True, agent="planner")
         
-        with open("debug_planner.txt", "a", encoding="utf-8") as f:
-            f.write(f"DEBUG: Roadmap response: {response_text}\n")
+        logger.debug("Roadmap response", extra={"response_preview": (response_text or "")[:500]})
         
         if not response_text:
             return None
 
-        # Clean markdown code blocks if present
-        cleaned_text = response_text.replace("```json", "").replace("```", "").strip()
-
-        try:
-            data = json.loads(cleaned_text)
-            
+        def prepare(data):
+            if not isinstance(data, dict):
+                return data
             # Post-Process: Fix potential nesting like [{"0": {...}}, {"1": {...}}]
-            if "chapters" in data and isinstance(data["chapters"], list):
-                cleaned_chapters = []
-                for item in data["chapters"]:
-                    keys = list(item.keys())
-                    if len(keys) == 1 and keys[0].isdigit():
-                        # Unwrap
-                        cleaned_chapters.append(item[keys[0]])
-                    else:
-                        cleaned_chapters.append(item)
-                data["chapters"] = cleaned_chapters
+            data = _unwrap_chapters(data)
+            if not isinstance(data.get("topic"), str):
+                data["topic"] = topic
+            return data
 
-            # Validate with Pydantic
-            roadmap = CourseRoadmap(**data)
-            return roadmap
-        except json.JSONDecodeError:
-            msg = f"Failed to parse JSON: {cleaned_text}"
-            print(msg)
-            with open("debug_planner.txt", "a", encoding="utf-8") as f:
-                f.write(msg + "\n")
-            return None
-        except Exception as e:
-            msg = f"Validation error: {e}"
-            print(msg)
-            with open("debug_planner.txt", "a", encoding="utf-8") as f:
-                f.write(msg + "\n")
+        result = json_repair.parse(response_text, CourseRoadmap, context=f"roadmap:{topic}", prepare=prepare)
+        if not result.ok:
+            logger.error("Roadmap unusable", extra={"invalid_fields": result.invalid_fields})
             return None
+
+        roadmap = result.value
+        if result.truncated and roadmap.chapters:
+            # The response was cut off: keep the chapters we have and ask only for the rest
+            roadmap.chapters += self._continue_roadmap(topic, grade_level, prompt_structure, roadmap.chapters)
+            for number, chapter in enumerate(roadmap.chapters, start=1):
+                chapter.chapter_number = number
+        return roadmap
+
+    def _continue_roadmap(self, topic: str, grade_level: str, prompt_structure: str,
+                          chapters: List[Chapter]) -> List[Chapter]:
+        system_prompt = (
+            "You are an expert curriculum planner completing a partially written course roadmap. "
+            f"The roadmap is organized by {prompt_structure}. "
+            "Return ONLY valid JSON with the REMAINING entries, continuing the numbering: "
+            f"{{ \"chapters\": [{{ \"chapter_number\": Int, \"title\": String, \"description\": String }}] }}. "
+            "Return an empty 'chapters' array if the roadmap is already complete."
+        )
+        outline = "\n".join(f"{c.chapter_number}. {c.title}" for c in chapters)
+        user_prompt = (
+            f"Course: '{topic}' at a '{grade_level}' level.\n"
+            f"Entries written so far:\n{outline}"
+        )
+        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True, agent="planner")
+        result = json_repair.parse(response_text, _ChaptersResponse, context=f"roadmap_continuation:{topic}",
+                                   prepare=_unwrap_chapters)
+        if not result.ok:
+            logger.warning("Roadmap continuation failed; keeping the truncated roadmap", extra={"topic": topic})
+            return []
+        known = {c.title.strip().lower() for c in chapters}
+        return [c for c in result.value.chapters if c.title.strip().lower() not in known]
+
+
+def _unwrap_chapters(data):
+    if isinstance(data, dict) and isinstance(data.get("chapters"), list):
+        cleaned_chapters = []
+        for item in data["chapters"]:
+            keys = list(item.keys()) if isinstance(item, dict) else []
+            if len(keys) == 1 and keys[0].isdigit():
+                # Unwrap
+                cleaned_chapters.append(item[keys[0]])
+            else:
+                cleaned_chapters.append(item)
+        data["chapters"] = cleaned_chapters
+    return data
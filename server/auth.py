@@ -1,12 +1,18 @@
 
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from cachetools import TTLCache
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from server import database_mongo
 from server.models_mongo import UserModel
+from server.core import metrics, usage
 from bson import ObjectId
 
 # Secret key (In production, load from .env)
@@ -14,26 +20,115 @@ SECRET_KEY = "supersecretkey_educore_dev_change_me"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300 # Long expiry for MVP
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost. Hashes below it are flagged by needs_update and re-hashed on next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# --- Authenticated user cache ---
+# Bounded LRU with TTL, keyed by (username, token iat). Writes to a user must call
+# invalidate_user(); other workers/processes converge within USER_CACHE_TTL seconds.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def invalidate_user(username: str):
+    with _user_cache_lock:
+        for key in [k for k in _user_cache.keys() if k[0] == username]:
+            _user_cache.pop(key, None)
+            _user_cache_stats["invalidations"] += 1
+
+def user_cache_stats() -> dict:
+    with _user_cache_lock:
+        return {
+            **_user_cache_stats,
+            "db_reads_saved": _user_cache_stats["hits"],
+            "size": len(_user_cache),
+            "maxsize": USER_CACHE_SIZE,
+            "ttl_seconds": USER_CACHE_TTL
+        }
+
+metrics.register("user_cache", user_cache_stats)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# --- Password hashing pool ---
+# bcrypt is CPU bound (and releases the GIL), so it gets its own small pool instead of
+# competing with request handling. PASSWORD_HASH_MAX_QUEUE bounds the backlog (0 = unbounded).
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "500"))
+
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_lock = threading.Lock()
+_hash_stats = {"queued": 0, "running": 0, "completed": 0, "rejected": 0, "upgraded": 0}
+
+async def _run_in_hash_pool(fn, *args):
+    with _hash_lock:
+        if PASSWORD_HASH_MAX_QUEUE and _hash_stats["queued"] >= PASSWORD_HASH_MAX_QUEUE:
+            _hash_stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Server busy, please retry")
+        _hash_stats["queued"] += 1
+
+    def task():
+        with _hash_lock:
+            _hash_stats["queued"] -= 1
+            _hash_stats["running"] += 1
+        try:
+            return fn(*args)
+        finally:
+            with _hash_lock:
+                _hash_stats["running"] -= 1
+                _hash_stats["completed"] += 1
+
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, task)
+
+async def hash_password(password: str) -> str:
+    return await _run_in_hash_pool(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Returns (is_valid, new_hash). new_hash is set when the stored hash uses an outdated cost."""
+    valid, new_hash = await _run_in_hash_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+    if new_hash:
+        with _hash_lock:
+            _hash_stats["upgraded"] += 1
+    return valid, new_hash
+
+def password_hash_stats() -> dict:
+    with _hash_lock:
+        return {
+            **_hash_stats,
+            "queue_depth": _hash_stats["queued"],
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_queue": PASSWORD_HASH_MAX_QUEUE,
+            "bcrypt_rounds": BCRYPT_ROUNDS
+        }
+
+metrics.register("password_hashing", password_hash_stats)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(database_mongo.get_database)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(database_mongo.get_database)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -46,16 +141,34 @@ def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(database_
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    
+    cache_key = (username, payload.get("iat"))
+    with _user_cache_lock:
+        cached = _user_cache.get(cache_key)
+        _user_cache_stats["hits" if cached else "misses"] += 1
+    if cached:
+        # Routes may mutate the model, so hand out a copy
+        return cached.model_copy()
         
-    user_data = db.users.find_one({"username": username})
+    user_data = await db.users.find_one({"username": username})
     if user_data is None:
         raise credentials_exception
     
     # Convert _id to string id for Pydantic model
     user_data["_id"] = str(user_data["_id"])
-    return UserModel(**user_data)
+    user = UserModel(**user_data)
+    with _user_cache_lock:
+        _user_cache[cache_key] = user
+    return user.model_copy()
 
-def get_current_active_user(current_user: UserModel = Depends(get_current_user)):
+async def get_current_active_user(request: Request, current_user: UserModel = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
+    # Attribute LLM usage of this request to the user and the route template (not the raw path)
+    route = request.scope.get("route")
+    usage.bind(
+        user_id=current_user.id,
+        organization_id=current_user.organization_id,
+        route=f"{request.method} {route.path}" if route else None
+    )
     return current_user
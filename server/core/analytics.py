@@ -0,0 +1,154 @@
+"""
+Organization analytics computed server-side in MongoDB.
+
+Per-enrollment progress and score come from the materialized course_progress
+collection (see server.core.progress); two aggregation pipelines then group
+them per course and per student. Results are cached in `analytics_snapshots`
+for ORG_ANALYTICS_SNAPSHOT_TTL seconds (0 disables the cache).
+"""
+import os
+from datetime import datetime, timedelta
+from typing import List
+
+SNAPSHOT_TTL_SECONDS = int(os.getenv("ORG_ANALYTICS_SNAPSHOT_TTL", "300"))
+
+
+def _enrollment_stages(course_ids: List[str]) -> list:
+    """Stages yielding one {user_id, course_id, progress, score, scored} doc per enrollment."""
+    return [
+        {"$match": {"course_id": {"$in": course_ids}}},
+        {"$lookup": {
+            "from": "course_progress",
+            "let": {"uid": "$user_id", "cid": "$course_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$user_id", "$$uid"]},
+                    {"$eq": ["$course_id", "$$cid"]}
+                ]}}},
+                {"$project": {
+                    "completed_chapter_ids": 1, "chapter_scores": 1, "total_chapters": 1,
+                    "exam_attempts": 1, "best_exam_percentage": 1
+                }}
+            ],
+            "as": "progress_docs"
+        }},
+        {"$addFields": {"p": {"$arrayElemAt": ["$progress_docs", 0]}}},
+        {"$addFields": {
+            "completed": {"$size": {"$ifNull": ["$p.completed_chapter_ids", []]}},
+            "total": {"$ifNull": ["$p.total_chapters", 0]},
+            "has_exam": {"$gt": [{"$ifNull": ["$p.exam_attempts", 0]}, 0]},
+            "quiz_avg": {"$ifNull": [{"$avg": {"$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$p.chapter_scores", {}]}},
+                "as": "s",
+                "in": "$$s.v"
+            }}}, 0]}
+        }},
+        {"$project": {
+            "user_id": 1,
+            "course_id": 1,
+            "progress": {"$cond": [
+                {"$gt": ["$total", 0]},
+                {"$min": [100, {"$multiply": [{"$divide": ["$completed", "$total"]}, 100]}]},
+                0
+            ]},
+            "score": {"$cond": [
+                "$has_exam",
+                {"$toDouble": {"$ifNull": ["$p.best_exam_percentage", 0]}},
+                "$quiz_avg"
+            ]},
+            "has_exam": 1,
+            "completed": 1
+        }},
+        {"$addFields": {"scored": {"$or": [{"$gt": ["$score", 0]}, "$has_exam", {"$gt": ["$completed", 0]}]}}}
+    ]
+
+
+def _group_stage(key: str) -> dict:
+    return {"$group": {
+        "_id": key,
+        "enrolled": {"$sum": 1},
+        "progress_sum": {"$sum": "$progress"},
+        "score_sum": {"$sum": {"$cond": ["$scored", "$score", 0]}},
+        "score_count": {"$sum": {"$cond": ["$scored", 1, 0]}}
+    }}
+
+
+async def compute_org_analytics(db, org_user_id: str) -> dict:
+    courses = await db.courses.find({"user_id": org_user_id}, {"topic": 1, "is_published": 1}).to_list(None)
+    course_ids = [str(c["_id"]) for c in courses]
+    active_courses = len([c for c in courses if c.get("is_published", False)])
+
+    course_rows = {}
+    if course_ids:
+        pipeline = _enrollment_stages(course_ids) + [_group_stage("$course_id")]
+        course_rows = {row["_id"]: row async for row in await db.enrollments.aggregate(pipeline, allowDiskUse=True)}
+
+    course_stats = []
+    overall_progress_sum = 0
+    overall_progress_count = 0
+    for c in courses:
+        cid = str(c["_id"])
+        row = course_rows.get(cid, {})
+        enrolled = row.get("enrolled", 0)
+        overall_progress_sum += row.get("progress_sum", 0)
+        overall_progress_count += enrolled
+        course_stats.append({
+            "course_id": cid,
+            "topic": c["topic"],
+            "enrolled_students": enrolled,
+            "avg_progress": row["progress_sum"] / enrolled if enrolled else 0,
+            "avg_score": row["score_sum"] / row["score_count"] if row.get("score_count") else 0
+        })
+
+    student_stats = []
+    if course_ids:
+        pipeline = _enrollment_stages(course_ids) + [
+            _group_stage("$user_id"),
+            {"$lookup": {
+                "from": "users",
+                "let": {"uid": {"$convert": {"input": "$_id", "to": "objectId", "onError": None, "onNull": None}}},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$uid"]}}},
+                    {"$project": {"username": 1}}
+                ],
+                "as": "user"
+            }},
+            {"$project": {
+                "enrolled": 1, "progress_sum": 1, "score_sum": 1, "score_count": 1,
+                "student_name": {"$ifNull": [{"$arrayElemAt": ["$user.username", 0]}, "Unknown"]}
+            }}
+        ]
+        async for row in await db.enrollments.aggregate(pipeline, allowDiskUse=True):
+            student_stats.append({
+                "student_id": str(row["_id"]),
+                "student_name": row["student_name"],
+                "enrolled_courses": row["enrolled"],
+                "avg_progress": row["progress_sum"] / row["enrolled"] if row["enrolled"] else 0,
+                "avg_score": row["score_sum"] / row["score_count"] if row["score_count"] else 0
+            })
+
+    return {
+        "total_students": len(student_stats),
+        "active_courses": active_courses,
+        "avg_completion": overall_progress_sum / overall_progress_count if overall_progress_count > 0 else 0,
+        "course_stats": course_stats,
+        "student_stats": student_stats
+    }
+
+
+async def get_org_analytics(db, org_user_id: str, refresh: bool = False) -> dict:
+    """Returns the cached snapshot if it is younger than the TTL, otherwise recomputes it."""
+    if SNAPSHOT_TTL_SECONDS > 0 and not refresh:
+        snapshot = await db.analytics_snapshots.find_one({"_id": org_user_id})
+        if snapshot and snapshot["created_at"] > datetime.utcnow() - timedelta(seconds=SNAPSHOT_TTL_SECONDS):
+            return snapshot["data"]
+
+    data = await compute_org_analytics(db, org_user_id)
+
+    if SNAPSHOT_TTL_SECONDS > 0:
+        await db.analytics_snapshots.update_one(
+            {"_id": org_user_id},
+            {"$set": {"data": data, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    return data
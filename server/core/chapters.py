@@ -0,0 +1,196 @@
+"""
+Chapter content generation shared by the API routes and background jobs.
+
+`generate_chapter` runs ContentAgent for one chapter document and saves the
+result; `pregenerate_course` fans it out over every empty chapter of a course
+with at most CHAPTER_PREGENERATE_CONCURRENCY generations in flight, writing each
+chapter as soon as it finishes.
+
+Generation is single-flight per chapter. Within a process, concurrent callers
+share one in-flight future. Across processes, the generating worker holds a
+lease in `chapter_leases` ({_id: chapter_id, token, expires_at}), renewed every
+CHAPTER_LEASE_SECONDS / 3 while it generates, and the others wait for it to be
+released and then read the saved chapter.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from server.core import metrics
+from server.shared import schemas
+
+logger = logging.getLogger(__name__)
+
+CHAPTER_PREGENERATE_CONCURRENCY = int(os.getenv("CHAPTER_PREGENERATE_CONCURRENCY", "4"))
+# Renewed while the generation runs; a lease left to expire (dead worker) is taken over by the next caller
+CHAPTER_LEASE_SECONDS = int(os.getenv("CHAPTER_LEASE_SECONDS", "300"))
+CHAPTER_LEASE_POLL_INTERVAL = float(os.getenv("CHAPTER_LEASE_POLL_INTERVAL", "1"))
+
+_inflight: Dict[str, asyncio.Future] = {}
+_stats = {"generations": 0, "deduplicated_local": 0, "deduplicated_remote": 0}
+metrics.register("chapter_generation", lambda: {**_stats, "in_flight": len(_inflight)})
+
+
+def to_schema(chapter: dict) -> schemas.Chapter:
+    return schemas.Chapter(
+        chapter_number=chapter["chapter_number"],
+        title=chapter["title"],
+        description=chapter.get("description", f"Chapter {chapter['chapter_number']}")
+    )
+
+
+async def save_content(db, chapter_id, content: schemas.ChapterContent) -> dict:
+    quiz_data = [q.dict() for q in content.quiz]
+    await db.chapters.update_one(
+        {"_id": ObjectId(chapter_id)},
+        {"$set": {
+            "content_markdown": content.content_markdown,
+            "quiz_json": quiz_data
+        }}
+    )
+    return {"content_markdown": content.content_markdown, "quiz": quiz_data}
+
+
+async def _acquire_lease(db, chapter_id: str, token: str) -> bool:
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=CHAPTER_LEASE_SECONDS)
+    try:
+        await db.chapter_leases.insert_one({"_id": chapter_id, "token": token, "expires_at": expires_at})
+        return True
+    except DuplicateKeyError:
+        # Held by someone else; take it over only if their lease has expired
+        result = await db.chapter_leases.update_one(
+            {"_id": chapter_id, "expires_at": {"$lt": now}},
+            {"$set": {"token": token, "expires_at": expires_at}}
+        )
+        return result.modified_count == 1
+
+
+async def _keep_lease(db, chapter_id: str, token: str):
+    while True:
+        await asyncio.sleep(CHAPTER_LEASE_SECONDS / 3)
+        await db.chapter_leases.update_one(
+            {"_id": chapter_id, "token": token},
+            {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=CHAPTER_LEASE_SECONDS)}}
+        )
+
+
+async def _wait_for_release(db, chapter_id: str):
+    while await db.chapter_leases.find_one({"_id": chapter_id, "expires_at": {"$gte": datetime.utcnow()}}):
+        await asyncio.sleep(CHAPTER_LEASE_POLL_INTERVAL)
+
+
+def _existing_content(chapter: Optional[dict]) -> Optional[dict]:
+    if not chapter or not chapter.get("content_markdown"):
+        return None
+    return {"content_markdown": chapter["content_markdown"], "quiz": chapter.get("quiz_json", [])}
+
+
+async def _run_with_lease(db, chapter: dict, force: bool, produce: Callable[[], Awaitable[Optional[dict]]]):
+    chapter_id = str(chapter["_id"])
+    seen_content = chapter.get("content_markdown")
+    counted = False
+    while True:
+        token = uuid.uuid4().hex
+        if await _acquire_lease(db, chapter_id, token):
+            heartbeat = asyncio.create_task(_keep_lease(db, chapter_id, token))
+            try:
+                if not force:
+                    # Another worker may have finished between our read and the lease
+                    existing = _existing_content(await db.chapters.find_one({"_id": chapter["_id"]}))
+                    if existing:
+                        return existing
+                _stats["generations"] += 1
+                return await produce()
+            finally:
+                heartbeat.cancel()
+                await db.chapter_leases.delete_one({"_id": chapter_id, "token": token})
+
+        if not counted:
+            _stats["deduplicated_remote"] += 1
+            counted = True
+        await _wait_for_release(db, chapter_id)
+        current = await db.chapters.find_one({"_id": chapter["_id"]})
+        existing = _existing_content(current)
+        # With force, only fresh content (different from what we started with) counts
+        if existing and (not force or existing["content_markdown"] != seen_content):
+            return existing
+        # The other worker failed; try to generate ourselves
+
+
+async def single_flight(db, chapter: dict, force: bool,
+                        produce: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+    """
+    Runs `produce` (which must generate and save the chapter) unless a generation of
+    the same chapter is already in flight, in which case its result is shared.
+    """
+    chapter_id = str(chapter["_id"])
+    inflight = _inflight.get(chapter_id)
+    if inflight is not None:
+        _stats["deduplicated_local"] += 1
+        # shield: a cancelled waiter (e.g. a disconnected client) must not cancel the generation
+        return await asyncio.shield(inflight)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[chapter_id] = future
+    try:
+        result = await _run_with_lease(db, chapter, force, produce)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e if isinstance(e, Exception) else RuntimeError("Chapter generation cancelled"))
+        # Mark the exception as retrieved even if nobody else was waiting
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(chapter_id, None)
+
+
+async def generate_chapter(db, chapter: dict, force: bool = False) -> Optional[dict]:
+    """
+    Generates and stores the content of one chapter document.
+    Returns {"content_markdown", "quiz"} or None if generation failed.
+    """
+    async def produce():
+        from server.agents.content_agent.content import ContentAgent
+        # ContentAgent is synchronous; force=True also bypasses the LLM response cache
+        content = await asyncio.to_thread(ContentAgent().generate_chapter_content, to_schema(chapter), force)
+        if not content:
+            return None
+        return await save_content(db, chapter["_id"], content)
+
+    return await single_flight(db, chapter, force, produce)
+
+
+async def pregenerate_course(db, course_id: str,
+                             report: Optional[Callable[[int], Awaitable[None]]] = None) -> dict:
+    """Generates every chapter of a course that has no content yet."""
+    pending = await db.chapters.find(
+        {"course_id": course_id, "content_markdown": {"$in": ["", None]}}
+    ).sort("order_index", 1).to_list(None)
+
+    # Never take the whole LLM connection pool away from interactive requests
+    from server.core.llm import LLM_HTTP_POOL_SIZE
+    semaphore = asyncio.Semaphore(max(1, min(CHAPTER_PREGENERATE_CONCURRENCY, LLM_HTTP_POOL_SIZE - 1)))
+    counts = {"generated": 0, "failed": 0}
+
+    async def run(chapter: dict):
+        async with semaphore:
+            try:
+                ok = await generate_chapter(db, chapter) is not None
+            except Exception as e:
+                logger.error(f"Pregeneration of chapter {chapter['_id']} failed: {e}")
+                ok = False
+        counts["generated" if ok else "failed"] += 1
+        if report:
+            await report(int((counts["generated"] + counts["failed"]) / len(pending) * 100))
+
+    # Chapters are started in order, so the first ones are ready first
+    await asyncio.gather(*(run(ch) for ch in pending))
+    return {"course_id": course_id, "chapters": len(pending), **counts}
@@ -0,0 +1,134 @@
+"""
+Writes a course and its roadmap chapters.
+
+- `create_course` inserts the course document and all of its chapters.
+- `replan_course` applies a new roadmap to an existing course. Chapters are
+  matched to the new roadmap by title: matched chapters keep their generated
+  content, quiz and video and only get their number, position and description
+  updated. New roadmap entries are inserted, and chapters that are no longer in
+  the roadmap are deleted. All chapter writes go out as one unordered bulk_write.
+
+When MongoDB runs as a replica set (or behind mongos), the course and chapter
+writes run in one transaction. A standalone server does not support
+transactions, so there the writes are applied without one.
+"""
+import logging
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteMany, InsertOne, UpdateOne
+
+from server.core import progress
+
+logger = logging.getLogger(__name__)
+
+_transactions_supported: Optional[bool] = None
+
+
+async def supports_transactions(db) -> bool:
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await db.client.admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            logger.warning(f"Could not detect MongoDB topology, writing without transactions: {e}")
+            _transactions_supported = False
+    return _transactions_supported
+
+
+async def _run_atomic(db, callback):
+    """Runs `await callback(session)` in a transaction when available, else with session=None."""
+    if not await supports_transactions(db):
+        return await callback(None)
+    async with db.client.start_session() as session:
+        # with_transaction retries the callback on transient transaction errors
+        return await session.with_transaction(callback)
+
+
+def _normalize(title: str) -> str:
+    return " ".join((title or "").lower().split())
+
+
+def _chapter_fields(chapter, index: int) -> dict:
+    return {
+        "chapter_number": chapter.chapter_number,
+        "order_index": index,
+        "title": chapter.title,
+        "description": getattr(chapter, "description", f"Chapter {chapter.chapter_number}: {chapter.title}")
+    }
+
+
+def chapter_docs(course_id: str, roadmap) -> List[dict]:
+    return [
+        {**_chapter_fields(chapter, i), "content_markdown": "", "quiz_json": [], "course_id": course_id}
+        for i, chapter in enumerate(roadmap.chapters)
+    ]
+
+
+async def create_course(db, course_doc: dict, roadmap) -> str:
+    """Inserts `course_doc` with `roadmap` as its roadmap_json and one chapter per roadmap entry."""
+    course_doc = {**course_doc, "roadmap_json": roadmap.dict()}
+
+    async def write(session):
+        result = await db.courses.insert_one(course_doc, session=session)
+        course_id = str(result.inserted_id)
+        docs = chapter_docs(course_id, roadmap)
+        if docs:
+            await db.chapters.insert_many(docs, ordered=False, session=session)
+        return course_id
+
+    return await _run_atomic(db, write)
+
+
+def _diff(course_id: str, existing: List[dict], roadmap) -> Tuple[list, List[str], dict]:
+    by_title = {}
+    for chapter in existing:
+        by_title.setdefault(_normalize(chapter.get("title")), []).append(chapter)
+
+    operations = []
+    kept_ids = set()
+    counts = {"kept": 0, "added": 0, "removed": 0}
+    for i, chapter in enumerate(roadmap.chapters):
+        matches = by_title.get(_normalize(chapter.title))
+        if matches:
+            old = matches.pop(0)
+            kept_ids.add(old["_id"])
+            operations.append(UpdateOne({"_id": old["_id"]}, {"$set": _chapter_fields(chapter, i)}))
+            counts["kept"] += 1
+        else:
+            operations.append(InsertOne({
+                **_chapter_fields(chapter, i), "content_markdown": "", "quiz_json": [], "course_id": course_id
+            }))
+            counts["added"] += 1
+
+    removed = [c["_id"] for c in existing if c["_id"] not in kept_ids]
+    if removed:
+        operations.append(DeleteMany({"_id": {"$in": removed}, "course_id": course_id}))
+        counts["removed"] = len(removed)
+    return operations, [str(r) for r in removed], counts
+
+
+async def replan_course(db, course_id: str, roadmap) -> dict:
+    """Replaces the roadmap of an existing course, keeping the content of chapters that are still in it."""
+    async def write(session):
+        existing = await db.chapters.find(
+            {"course_id": course_id}, {"title": 1}, session=session
+        ).sort("order_index", 1).to_list(None)
+        operations, removed_ids, counts = _diff(course_id, existing, roadmap)
+        await db.courses.update_one(
+            {"_id": ObjectId(course_id)},
+            {"$set": {"roadmap_json": roadmap.dict()}},
+            session=session
+        )
+        if operations:
+            await db.chapters.bulk_write(operations, ordered=False, session=session)
+        return removed_ids, counts
+
+    removed_ids, counts = await _run_atomic(db, write)
+    # Completions of deleted chapters no longer count; totals change when chapters are added too
+    if removed_ids:
+        await progress.remove_chapters(db, course_id, removed_ids)
+    elif counts["added"]:
+        await progress.sync_chapter_total(db, course_id)
+    return counts
@@ -0,0 +1,149 @@
+"""
+Course generation run as background jobs (see server.core.jobs).
+
+The routes validate the request and enqueue one of these job types; the planner
+LLM call then happens in a job worker instead of inside the HTTP request.
+
+- "course.generate": plan a new course for payload["user_id"]
+  (used by /courses/generate and /courses/generate-for-child)
+- "course.plan": re-plan the chapters of an existing org course
+- "course.pregenerate": generate the content of every empty chapter of a course;
+  background priority, at most PREGENERATE_JOB_CONCURRENCY at a time per process
+- "course.plan_batch": plan many org courses created by /org/courses/batch, at
+  most ORG_BATCH_PLAN_CONCURRENCY at a time; per-course status is published as
+  the job result while it runs. Background priority, at most
+  ORG_BATCH_JOB_CONCURRENCY batch jobs at a time per process
+
+With payload["pregenerate"] set, the first two enqueue "course.pregenerate" as
+soon as the chapters exist and return its job id as `pregenerate_job_id`.
+"""
+import asyncio
+import logging
+import os
+
+from bson import ObjectId
+
+from server.core import chapters, courses, jobs
+from server.core.jobs import Report
+
+logger = logging.getLogger(__name__)
+
+ORG_BATCH_MAX_COURSES = int(os.getenv("ORG_BATCH_MAX_COURSES", "200"))
+ORG_BATCH_PLAN_CONCURRENCY = int(os.getenv("ORG_BATCH_PLAN_CONCURRENCY", "8"))
+# Pregeneration runs at background priority and holds at most this many job workers per process
+PREGENERATE_JOB_CONCURRENCY = int(os.getenv("PREGENERATE_JOB_CONCURRENCY", "1"))
+# Batch jobs from every organization share this many job workers per process
+ORG_BATCH_JOB_CONCURRENCY = int(os.getenv("ORG_BATCH_JOB_CONCURRENCY", "1"))
+
+
+async def _generate_roadmap(topic: str, grade_level: str, structure_type: str):
+    from server.agents.planner_agent.planner import PlannerAgent
+    # PlannerAgent is synchronous; keep it off the event loop
+    roadmap = await asyncio.to_thread(PlannerAgent().generate_roadmap, topic, grade_level, structure_type)
+    if not roadmap:
+        raise RuntimeError("Failed to generate roadmap")
+    return roadmap
+
+
+async def _maybe_pregenerate(db, payload: dict, course_id: str, result: dict) -> dict:
+    if payload.get("pregenerate"):
+        result["pregenerate_job_id"] = await jobs.enqueue(
+            db, "course.pregenerate", {"course_id": course_id}, user_id=payload["requested_by"]
+        )
+    return result
+
+
+@jobs.handler("course.generate")
+async def generate_course(db, payload: dict, report: Report) -> dict:
+    roadmap = await _generate_roadmap(payload["topic"], payload["grade_level"], payload["structure_type"])
+    await report(70)
+
+    course_doc = {
+        "topic": payload["topic"],
+        "grade_level": payload["grade_level"],
+        "structure_type": payload["structure_type"],
+        "is_published": False,
+        "user_id": payload["user_id"],
+        "organization_id": payload.get("organization_id")
+    }
+    course_id = await courses.create_course(db, course_doc, roadmap)
+    return await _maybe_pregenerate(db, payload, course_id, {"course_id": course_id})
+
+
+@jobs.handler("course.plan")
+async def plan_course(db, payload: dict, report: Report) -> dict:
+    course_id = payload["course_id"]
+    roadmap = await _generate_roadmap(payload["topic"], payload["grade_level"], payload["structure_type"])
+    await report(70)
+
+    # Chapters still in the new roadmap keep their generated content
+    changes = await courses.replan_course(db, course_id, roadmap)
+    return await _maybe_pregenerate(db, payload, course_id, {
+        "course_id": course_id, "roadmap": roadmap.dict(), "chapters": changes
+    })
+
+
+@jobs.handler("course.pregenerate", max_concurrent=PREGENERATE_JOB_CONCURRENCY,
+              priority=jobs.PRIORITY_BACKGROUND)
+async def pregenerate_course(db, payload: dict, report: Report) -> dict:
+    return await chapters.pregenerate_course(db, payload["course_id"], report)
+
+
+@jobs.handler("course.plan_batch", max_concurrent=ORG_BATCH_JOB_CONCURRENCY,
+              priority=jobs.PRIORITY_BACKGROUND)
+async def plan_courses(db, payload: dict, report: Report) -> dict:
+    specs = payload["courses"]
+    statuses = {c["course_id"]: {"course_id": c["course_id"], "topic": c["topic"], "status": "queued"}
+                for c in specs}
+
+    # Courses planned by an earlier, interrupted attempt of this job are not planned again
+    done = await db.courses.find(
+        {"_id": {"$in": [ObjectId(cid) for cid in statuses]}, "planning_status": "planned"},
+        {"_id": 1}
+    ).to_list(None)
+    for course in done:
+        statuses[str(course["_id"])]["status"] = "planned"
+
+    # Same cap as chapter pregeneration: leave LLM connections for interactive requests.
+    # The provider rate limiter still paces the calls that are let through.
+    from server.core.llm import LLM_HTTP_POOL_SIZE
+    semaphore = asyncio.Semaphore(max(1, min(ORG_BATCH_PLAN_CONCURRENCY, LLM_HTTP_POOL_SIZE - 1)))
+    finished = {"count": sum(1 for s in statuses.values() if s["status"] == "planned")}
+
+    def snapshot() -> dict:
+        counts = {}
+        for s in statuses.values():
+            counts[s["status"]] = counts.get(s["status"], 0) + 1
+        return {"total": len(statuses), **counts, "courses": list(statuses.values())}
+
+    async def run(spec: dict):
+        status = statuses[spec["course_id"]]
+        if status["status"] == "planned":
+            return
+        async with semaphore:
+            status["status"] = "planning"
+            try:
+                roadmap = await _generate_roadmap(spec["topic"], spec["grade_level"], spec["structure_type"])
+                await courses.replan_course(db, spec["course_id"], roadmap)
+                await db.courses.update_one(
+                    {"_id": ObjectId(spec["course_id"])},
+                    {"$set": {"planning_status": "planned"}, "$unset": {"planning_error": ""}}
+                )
+                status.update(status="planned", chapters=len(roadmap.chapters))
+                if payload.get("pregenerate"):
+                    status["pregenerate_job_id"] = await jobs.enqueue(
+                        db, "course.pregenerate", {"course_id": spec["course_id"]}, user_id=payload["requested_by"]
+                    )
+            except Exception as e:
+                logger.error(f"Batch planning of course {spec['course_id']} failed: {e}")
+                status.update(status="failed", error=str(e))
+                await db.courses.update_one(
+                    {"_id": ObjectId(spec["course_id"])},
+                    {"$set": {"planning_status": "failed", "planning_error": str(e)}}
+                )
+        finished["count"] += 1
+        await report(int(finished["count"] / len(statuses) * 100), snapshot())
+
+    await report(0, snapshot())
+    await asyncio.gather(*(run(spec) for spec in specs))
+    return snapshot()
@@ -0,0 +1,202 @@
+"""
+Index bootstrap for every query path in server/main.py.
+
+`ensure_indexes` is idempotent (create_index is a no-op when the index already
+exists) and runs at API startup. A TTL index whose expireAfterSeconds changed
+(e.g. LLM_CACHE_TTL) is updated in place with collMod. It can also be run by hand:
+
+    python -m server.core.indexes            # create/verify indexes
+    python -m server.core.indexes --explain  # ...and report queries still doing COLLSCAN
+"""
+import logging
+from typing import List, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from server.core import llm_cache, usage
+
+logger = logging.getLogger(__name__)
+
+_STRING = {"$type": "string"}
+
+# An index with the same keys exists with different options
+_INDEX_OPTIONS_CONFLICT = 85
+
+# (collection, keys, options)
+INDEXES = [
+    # users
+    ("users", [("username", ASCENDING)], {"unique": True}),
+    # Legacy users may have no email / secret_id, so uniqueness only applies to real values
+    ("users", [("email", ASCENDING)], {"unique": True, "partialFilterExpression": {"email": _STRING}}),
+    ("users", [("secret_id", ASCENDING)], {"unique": True, "partialFilterExpression": {"secret_id": _STRING}}),
+    ("users", [("parent_id", ASCENDING)], {}),
+    ("users", [("role", ASCENDING), ("organization_id", ASCENDING)], {}),
+
+    # courses / chapters
+    ("courses", [("user_id", ASCENDING)], {}),
+    ("courses", [("is_published", ASCENDING)], {}),
+    ("chapters", [("course_id", ASCENDING), ("order_index", ASCENDING)], {}),
+
+    # quizzes / exams / progress
+    # One attempt per chapter is enforced by submit_quiz; the index makes it hold under races
+    ("quiz_results", [("user_id", ASCENDING), ("chapter_id", ASCENDING)], {"unique": True}),
+    ("quiz_results", [("course_id", ASCENDING), ("user_id", ASCENDING)], {}),
+    ("quiz_results", [("user_id", ASCENDING), ("timestamp", DESCENDING)], {}),
+    ("exams", [("course_id", ASCENDING)], {"unique": True}),
+    ("exam_results", [("course_id", ASCENDING), ("user_id", ASCENDING), ("timestamp", DESCENDING)], {}),
+    ("course_progress", [("user_id", ASCENDING), ("course_id", ASCENDING)], {"unique": True}),
+    ("course_progress", [("course_id", ASCENDING)], {}),
+    # Stale org snapshots are garbage-collected after a day
+    ("analytics_snapshots", [("created_at", ASCENDING)], {"expireAfterSeconds": 86400}),
+
+    # single-flight chapter generation leases; crashed holders are cleaned up on expiry
+    ("chapter_leases", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+
+    # background jobs: claim order, lease recovery, finished jobs kept for a week
+    ("jobs", [("status", ASCENDING), ("priority", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("jobs", [("status", ASCENDING), ("lease_expires_at", ASCENDING)], {}),
+    ("jobs", [("finished_at", ASCENDING)], {"expireAfterSeconds": 7 * 86400}),
+
+    # LLM token usage: per-org/per-user reports, raw records expire after LLM_USAGE_TTL_DAYS
+    ("llm_usage", [("organization_id", ASCENDING), ("ts", DESCENDING)], {}),
+    ("llm_usage", [("user_id", ASCENDING), ("ts", DESCENDING)], {}),
+    ("llm_usage", [("ts", ASCENDING)], {"expireAfterSeconds": usage.LLM_USAGE_TTL_DAYS * 86400}),
+
+    # Lecture video cache (_id is the content hash); evictions delete by URL
+    ("video_cache", [("video_url", ASCENDING)], {}),
+
+    # LLM response cache (mongo backend)
+    ("llm_cache", [("created_at", ASCENDING)], {"expireAfterSeconds": llm_cache.LLM_CACHE_TTL}),
+    ("llm_cache", [("last_access", ASCENDING)], {}),
+
+    # marketplace
+    ("enrollments", [("user_id", ASCENDING), ("course_id", ASCENDING)], {"unique": True}),
+    ("enrollments", [("course_id", ASCENDING), ("user_id", ASCENDING)], {}),
+    ("course_keys", [("course_id", ASCENDING), ("key", ASCENDING)], {"unique": True}),
+    ("orders", [("payment_session_id", ASCENDING)], {"unique": True}),
+    ("orders", [("order_id", ASCENDING)], {"unique": True}),
+    ("orders", [("course_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    ("enrollment_tokens", [("token_value", ASCENDING)], {"unique": True}),
+    ("enrollment_tokens", [("user_id", ASCENDING), ("is_used", ASCENDING), ("expiry_date", ASCENDING)], {}),
+
+    # certificates
+    ("certificates", [("certificate_id", ASCENDING)], {"unique": True}),
+    ("certificates", [("course_id", ASCENDING), ("user_id", ASCENDING)], {}),
+    ("certificate_templates", [("course_id", ASCENDING)], {"unique": True}),
+
+    # notes / messages
+    ("notes", [("user_id", ASCENDING), ("updated_at", DESCENDING)], {}),
+    ("messages", [("receiver_id", ASCENDING), ("timestamp", DESCENDING)], {}),
+]
+
+# Representative (collection, filter, sort) shapes of the hot queries in main.py
+QUERY_SHAPES = [
+    ("users", {"username": "x"}, None),
+    ("users", {"email": "x"}, None),
+    ("users", {"secret_id": "x", "role": "student"}, None),
+    ("users", {"parent_id": "x"}, None),
+    ("courses", {"user_id": "x"}, None),
+    ("courses", {"is_published": True}, None),
+    ("chapters", {"course_id": "x"}, [("order_index", ASCENDING)]),
+    ("quiz_results", {"user_id": "x", "chapter_id": "x"}, None),
+    ("quiz_results", {"course_id": "x", "user_id": "x"}, None),
+    ("quiz_results", {"user_id": "x"}, [("timestamp", DESCENDING)]),
+    ("exams", {"course_id": "x"}, None),
+    ("exam_results", {"course_id": "x", "user_id": "x", "passed": True}, [("timestamp", DESCENDING)]),
+    ("course_progress", {"user_id": "x", "course_id": {"$in": ["x"]}}, None),
+    ("course_progress", {"course_id": "x"}, None),
+    ("jobs", {"status": "queued"}, [("priority", ASCENDING), ("created_at", ASCENDING)]),
+    ("jobs", {"status": "running", "lease_expires_at": {"$lt": "x"}}, None),
+    ("enrollments", {"user_id": "x", "course_id": "x"}, None),
+    ("enrollments", {"course_id": {"$in": ["x"]}}, None),
+    ("course_keys", {"course_id": "x", "key": "x"}, None),
+    ("orders", {"payment_session_id": "x", "user_id": "x"}, None),
+    ("orders", {"order_id": "x"}, None),
+    ("orders", {"course_id": {"$in": ["x"]}}, [("created_at", DESCENDING)]),
+    ("certificates", {"certificate_id": "x"}, None),
+    ("certificates", {"course_id": "x", "user_id": "x"}, None),
+    ("certificate_templates", {"course_id": "x"}, None),
+    ("enrollment_tokens", {"token_value": "x", "signature": "x", "user_id": "x"}, None),
+    ("enrollment_tokens", {"user_id": "x", "is_used": False, "expiry_date": {"$gt": "x"}}, None),
+    ("notes", {"user_id": "x"}, [("updated_at", DESCENDING)]),
+    ("messages", {"receiver_id": "x"}, [("timestamp", DESCENDING)]),
+    ("video_cache", {"video_url": {"$in": ["x"]}}, None),
+]
+
+
+def _index_name(keys) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+async def ensure_indexes(db) -> List[Tuple[str, str, str]]:
+    """Creates every index in INDEXES. Returns [(collection, index_name, status)]."""
+    report = []
+    for collection, keys, options in INDEXES:
+        name = _index_name(keys)
+        try:
+            await db[collection].create_index(keys, name=name, **options)
+            report.append((collection, name, "ok"))
+        except OperationFailure as e:
+            if e.code == _INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in options:
+                try:
+                    await _update_ttl(db, collection, keys, options["expireAfterSeconds"])
+                    report.append((collection, name, "ok"))
+                    continue
+                except OperationFailure as collmod_error:
+                    e = collmod_error
+            # e.g. duplicate values blocking a unique index, or an existing index with other options
+            logger.error(f"Could not create index {collection}.{name}: {e}")
+            report.append((collection, name, f"error: {e.details.get('errmsg', e) if e.details else e}"))
+    return report
+
+
+async def _update_ttl(db, collection: str, keys, expire_after_seconds: int):
+    await db.command("collMod", collection,
+                     index={"keyPattern": dict(keys), "expireAfterSeconds": expire_after_seconds})
+    logger.info(f"Updated TTL of {collection}.{_index_name(keys)} to {expire_after_seconds}s")
+
+
+def _has_collscan(plan: dict) -> bool:
+    if plan.get("stage") == "COLLSCAN":
+        return True
+    children = []
+    if "inputStage" in plan:
+        children.append(plan["inputStage"])
+    children.extend(plan.get("inputStages", []))
+    return any(_has_collscan(child) for child in children)
+
+
+async def find_collection_scans(db) -> List[Tuple[str, dict]]:
+    """Runs explain() on every QUERY_SHAPES entry and returns those whose winning plan is a COLLSCAN."""
+    scans = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = (await cursor.explain()).get("queryPlanner", {}).get("winningPlan", {})
+        # Newer servers wrap the classic plan in queryPlan
+        plan = plan.get("queryPlan", plan)
+        if _has_collscan(plan):
+            scans.append((collection, query))
+    return scans
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    from server import database_mongo
+
+    async def main():
+        database = database_mongo.get_database()
+        for collection, name, status in await ensure_indexes(database):
+            print(f"{collection:<22} {name:<50} {status}")
+
+        if "--explain" in sys.argv:
+            scans = await find_collection_scans(database)
+            if not scans:
+                print("No collection scans found")
+            for collection, query in scans:
+                print(f"COLLSCAN: {collection} {query}")
+
+    asyncio.run(main())
@@ -0,0 +1,332 @@
+"""
+Durable background jobs backed by the `jobs` collection.
+
+A job document looks like:
+
+    {
+        "_id": ObjectId,
+        "type": str,                 # key into HANDLERS
+        "user_id": str,              # owner, the only non-admin allowed to read it
+        "payload": dict,
+        "status": "queued" | "running" | "succeeded" | "failed" | "cancelled",
+        "progress": int,             # 0-100, reported by the handler
+        "result": dict | None,
+        "error": str | None,
+        "attempts": int,
+        "priority": int,             # lower is claimed first, see PRIORITY_*
+        "cancel_requested": bool,    # set by cancel() while the job runs
+        "lease_expires_at": datetime | None,
+        "created_at", "started_at", "finished_at", "updated_at": datetime
+    }
+
+`enqueue` only inserts the document, so queued jobs survive a restart. JOB_WORKERS
+asyncio tasks per API process claim jobs with an atomic find_one_and_update and
+hold a lease that is renewed while the handler runs. If a process dies mid-job,
+the lease expires and another worker (or the restarted process) picks the job up
+again, up to JOB_MAX_ATTEMPTS times. On a clean shutdown in-flight jobs are put
+back in the queue straight away.
+
+`cancel` marks a queued job cancelled straight away. For a running job it sets
+`cancel_requested`; the worker running it checks the flag every
+JOB_CANCEL_POLL_INTERVAL seconds and cancels the handler task, so handlers
+holding external resources should clean up on asyncio.CancelledError.
+
+Handlers are registered with @handler("type") and called as
+`await fn(db, payload, report)`, where `await report(percent)` updates progress
+and `await report(percent, partial_result)` also publishes an interim result.
+Their return value is stored as the job result. `@handler("type", max_concurrent=n)`
+caps how many jobs of that type one process runs at once; further jobs of the
+type stay queued for other workers or processes. Workers claim jobs by
+priority, then oldest first: `@handler("type", priority=PRIORITY_BACKGROUND)`
+keeps bulk work such as pregeneration behind jobs a user is waiting on.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from server.core import log, metrics, usage
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_CANCEL_POLL_INTERVAL = float(os.getenv("JOB_CANCEL_POLL_INTERVAL", "2"))
+
+Report = Callable[..., Awaitable[None]]
+HANDLERS: Dict[str, Callable] = {}
+HANDLER_LIMITS: Dict[str, int] = {}
+HANDLER_PRIORITIES: Dict[str, int] = {}
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_workers: List[asyncio.Task] = []
+_running: set = set()
+_running_types: Dict[str, int] = {}
+_wakeup: Optional[asyncio.Event] = None
+_stats = {"enqueued": 0, "succeeded": 0, "failed": 0, "retried": 0, "cancelled": 0}
+
+
+def handler(job_type: str, max_concurrent: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE):
+    def register(fn):
+        HANDLERS[job_type] = fn
+        HANDLER_PRIORITIES[job_type] = priority
+        if max_concurrent:
+            HANDLER_LIMITS[job_type] = max_concurrent
+        return fn
+    return register
+
+
+async def enqueue(db, job_type: str, payload: dict, user_id: str) -> str:
+    if job_type not in HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    now = datetime.utcnow()
+    result = await db.jobs.insert_one({
+        "type": job_type,
+        "user_id": user_id,
+        "payload": payload,
+        "status": "queued",
+        "progress": 0,
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "priority": HANDLER_PRIORITIES[job_type],
+        "lease_expires_at": None,
+        "created_at": now,
+        "updated_at": now
+    })
+    _stats["enqueued"] += 1
+    if _wakeup is not None:
+        _wakeup.set()
+    return str(result.inserted_id)
+
+
+async def get_job(db, job_id: str) -> Optional[dict]:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await db.jobs.find_one({"_id": ObjectId(job_id)})
+
+
+def serialize(job: dict) -> dict:
+    return {
+        "job_id": str(job["_id"]),
+        "type": job["type"],
+        "status": job["status"],
+        "progress": job.get("progress", 0),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "attempts": job.get("attempts", 0),
+        "cancel_requested": job.get("cancel_requested", False),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at")
+    }
+
+
+async def cancel(db, job_id: str) -> Optional[dict]:
+    """Cancels a queued job, or asks the worker running it to stop. Returns the updated job."""
+    if not ObjectId.is_valid(job_id):
+        return None
+    now = datetime.utcnow()
+    job = await db.jobs.find_one_and_update(
+        {"_id": ObjectId(job_id), "status": "queued"},
+        {"$set": {"status": "cancelled", "error": "Cancelled", "finished_at": now, "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is not None:
+        _stats["cancelled"] += 1
+        return job
+    return await db.jobs.find_one_and_update(
+        {"_id": ObjectId(job_id), "status": "running"},
+        {"$set": {"cancel_requested": True, "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    ) or await get_job(db, job_id)
+
+
+async def _claim(db) -> Optional[dict]:
+    """Atomically takes the most urgent, then oldest, queued job, or a running one whose lease has expired."""
+    now = datetime.utcnow()
+    query = {
+        "$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_expires_at": {"$lt": now}}
+        ],
+        "attempts": {"$lt": JOB_MAX_ATTEMPTS},
+        "cancel_requested": {"$ne": True}
+    }
+    saturated = [t for t, limit in HANDLER_LIMITS.items() if _running_types.get(t, 0) >= limit]
+    if saturated:
+        query["type"] = {"$nin": saturated}
+    return await db.jobs.find_one_and_update(
+        query,
+        {
+            "$set": {
+                "status": "running",
+                "started_at": now,
+                "updated_at": now,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS)
+            },
+            "$inc": {"attempts": 1}
+        },
+        # Jobs queued before priorities existed have none and sort first
+        sort=[("priority", 1), ("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _fail_exhausted(db):
+    """Jobs whose worker died on their last attempt (or while being cancelled) will never be claimed again."""
+    await db.jobs.update_many(
+        {
+            "status": "running",
+            "lease_expires_at": {"$lt": datetime.utcnow()},
+            "cancel_requested": True
+        },
+        {"$set": {"status": "cancelled", "error": "Cancelled", "finished_at": datetime.utcnow()}}
+    )
+    await db.jobs.update_many(
+        {
+            "status": "running",
+            "lease_expires_at": {"$lt": datetime.utcnow()},
+            "attempts": {"$gte": JOB_MAX_ATTEMPTS}
+        },
+        {"$set": {
+            "status": "failed",
+            "error": "Worker lost too many times",
+            "finished_at": datetime.utcnow()
+        }}
+    )
+
+
+async def _keep_lease(db, job_id, task: asyncio.Task, cancelled: dict):
+    """Renews the lease while the handler runs and cancels the handler once a cancel is requested."""
+    renew_at = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(JOB_CANCEL_POLL_INTERVAL)
+        job = await db.jobs.find_one({"_id": job_id}, {"cancel_requested": 1})
+        if job and job.get("cancel_requested"):
+            cancelled["requested"] = True
+            task.cancel()
+            return
+        if loop.time() >= renew_at:
+            renew_at = loop.time() + JOB_LEASE_SECONDS / 3
+            await db.jobs.update_one(
+                {"_id": job_id, "status": "running"},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}}
+            )
+
+
+async def _run(db, job: dict):
+    job_id = job["_id"]
+    if job["attempts"] > 1:
+        _stats["retried"] += 1
+
+    async def report(percent: int, partial_result: Optional[dict] = None):
+        update = {"progress": max(0, min(100, int(percent))), "updated_at": datetime.utcnow()}
+        if partial_result is not None:
+            update["result"] = partial_result
+        await db.jobs.update_one({"_id": job_id}, {"$set": update})
+
+    _running.add(job_id)
+    _running_types[job["type"]] = _running_types.get(job["type"], 0) + 1
+    # Log lines written by the handler carry the job id in place of a request id
+    request_token = log.set_request_id(f"job:{job_id}")
+    usage_token = usage.begin(route=f"job:{job['type']}", user_id=job.get("user_id"))
+    cancelled = {"requested": False}
+    lease = None
+    try:
+        fn = HANDLERS.get(job["type"])
+        if fn is None:
+            raise ValueError(f"Unknown job type: {job['type']}")
+        task = asyncio.create_task(fn(db, job["payload"], report))
+        lease = asyncio.create_task(_keep_lease(db, job_id, task, cancelled))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not cancelled["requested"]:
+                # The worker itself is being stopped
+                raise
+            update = {"status": "cancelled", "error": "Cancelled"}
+            _stats["cancelled"] += 1
+        else:
+            update = {"status": "succeeded", "progress": 100, "result": result, "error": None}
+            _stats["succeeded"] += 1
+    except Exception as e:
+        logger.exception(f"Job {job_id} ({job['type']}) failed")
+        update = {"status": "failed", "error": str(e)}
+        _stats["failed"] += 1
+    finally:
+        usage.end(usage_token)
+        log.reset_request_id(request_token)
+        if lease is not None:
+            lease.cancel()
+        _running.discard(job_id)
+        _running_types[job["type"]] -= 1
+
+    now = datetime.utcnow()
+    update.update({"finished_at": now, "updated_at": now, "lease_expires_at": None})
+    await db.jobs.update_one({"_id": job_id}, {"$set": update})
+
+
+async def _worker(db, index: int):
+    while True:
+        try:
+            job = await _claim(db)
+            if job is None:
+                if index == 0:
+                    await _fail_exhausted(db)
+                _wakeup.clear()
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await _run(db, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # e.g. Mongo unreachable: back off and keep the worker alive
+            logger.error(f"Job worker {index} error: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+def start_workers(db, count: int = JOB_WORKERS):
+    global _wakeup
+    if _workers:
+        return
+    _wakeup = asyncio.Event()
+    for i in range(count):
+        _workers.append(asyncio.create_task(_worker(db, i)))
+    metrics.register("jobs", stats)
+
+
+async def stop_workers(db):
+    """Cancels the workers and puts their in-flight jobs back in the queue."""
+    interrupted = list(_running)
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    if interrupted:
+        # A shutdown is not the job's fault, so the attempt is not counted
+        await db.jobs.update_many(
+            {"_id": {"$in": interrupted}, "status": "running", "cancel_requested": True},
+            {"$set": {"status": "cancelled", "error": "Cancelled", "finished_at": datetime.utcnow(),
+                      "lease_expires_at": None}}
+        )
+        await db.jobs.update_many(
+            {"_id": {"$in": interrupted}, "status": "running"},
+            {"$set": {"status": "queued", "lease_expires_at": None}, "$inc": {"attempts": -1}}
+        )
+
+
+def stats() -> dict:
+    return {**_stats, "workers": len(_workers)}
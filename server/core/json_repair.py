@@ -0,0 +1,301 @@
+"""
+Lenient JSON parsing for LLM output.
+
+Models wrap JSON in code fences and prose, write LaTeX with single backslashes
+(`\\frac`, `\\theta`) and get cut off at the output token limit. Rather than
+failing the whole generation on `json.loads`, `loads` repairs what it can:
+
+- everything before the first `{`/`[` and after its matching bracket is dropped
+- the text is parsed as is first, and valid JSON is returned as written. Only
+  if that fails is the source repaired:
+  - inside math spans (`$...$`, `$$...$$`, `\\(...\\)`, `\\[...\\]`) of its
+    strings, LaTeX commands that JSON would read as an escape (`\\frac` as a
+    form feed and "rac", `\\nabla` as a newline and "abla") get their backslash
+    doubled. Escapes outside math spans are left alone, so `\\n` stays a line break
+  - backslashes that do not start a valid JSON escape are doubled and raw
+    newlines inside strings escaped
+- a truncated document is cut back to its last complete value and closed
+
+`parse` then validates against a pydantic type. Invalid items of list fields
+(e.g. one half-written quiz question) are dropped instead of failing the whole
+object, and the top-level fields that are still missing or invalid are
+reported, so the caller can re-request just those instead of regenerating
+everything.
+"""
+import json
+import logging
+import re
+from typing import Any, Callable, List, Optional, Tuple, get_args, get_origin
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+logger = logging.getLogger(__name__)
+
+_VALID_ESCAPES = set('"\\/bfnrtu')
+# LaTeX commands that start with a valid JSON escape (\b, \f, \n, \r, \t), keyed by that
+# escape's letter. Commands starting with \u are invalid escapes and doubled anyway; \ne, \nu
+# and \ni are left out because they read just as well as a line break before "e", "u" or "i".
+_LATEX_TAILS = {
+    "b": "eta|egin|ar|inom|ig|oxed|f|m|ullet|ot|ackslash",
+    "f": "rac|orall|lat",
+    "n": "abla|eq|ot|ewline|ormalsize|eg|leq|geq|parallel",
+    "r": "ho|ight|angle|ceil|floor|m|Rightarrow|ightarrow",
+    "t": "heta|imes|au|ext|an|o|op|ilde|riangle|frac|extbf|extit|herefore",
+}
+# An escaped backslash is consumed first, so only a backslash that starts an escape can match
+_LATEX_ESCAPE = re.compile(
+    r"\\\\|\\(?:" + "|".join(f"{letter}(?:{tails})" for letter, tails in _LATEX_TAILS.items()) + r")(?![A-Za-z])"
+)
+# A string literal, or the unterminated last one of a truncated document
+_STRING_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?:"|\Z)', re.DOTALL)
+_MATH_SPAN = re.compile(r"\$\$.+?\$\$|\$[^$]+\$|\\\(.+?\\\)|\\\[.+?\\\]", re.DOTALL)
+_MAX_TRUNCATION_CUTS = 200
+
+
+class ParseResult:
+    def __init__(self):
+        self.value: Any = None
+        self.data: Any = None
+        self.repaired = False
+        self.truncated = False
+        self.dropped_items = 0
+        self.invalid_fields: List[str] = []
+
+    @property
+    def ok(self) -> bool:
+        return self.value is not None
+
+
+def _strip_fences(text: str) -> str:
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def _scan(text: str, start: int) -> Tuple[Optional[int], List[str], bool, List[int]]:
+    """
+    Walks one JSON value from `start`. Returns (end index or None if the value is
+    unterminated, open brackets at the end, whether it ended inside a string, and
+    the positions of top-level-of-container commas usable as truncation cuts).
+    """
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    commas: List[int] = []
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+            if not stack:
+                return i + 1, [], False, commas
+        elif ch == ",":
+            commas.append(i)
+    return None, stack, in_string, commas
+
+
+def extract(text: str) -> Tuple[str, bool]:
+    """Cuts the outermost JSON value out of surrounding prose. Returns (json_text, complete)."""
+    text = _strip_fences(text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return text, True
+    start = min(starts)
+    end, _, _, _ = _scan(text, start)
+    if end is None:
+        return text[start:], False
+    return text[start:end], True
+
+
+def fix_escapes(text: str) -> str:
+    """Doubles backslashes inside strings that are not valid JSON escapes and escapes raw newlines."""
+    out = []
+    in_string = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if not in_string:
+            if ch == '"':
+                in_string = True
+            out.append(ch)
+            i += 1
+            continue
+        if ch == '"':
+            in_string = False
+        elif ch == "\\":
+            nxt = text[i + 1] if i + 1 < len(text) else ""
+            if nxt == "\\" or nxt == '"':
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            bad_unicode = nxt == "u" and not re.match(r"[0-9a-fA-F]{4}", text[i + 2:i + 6])
+            if bad_unicode or nxt not in _VALID_ESCAPES:
+                out.append("\\\\")
+                i += 1
+                continue
+            out.append(text[i:i + 2])
+            i += 2
+            continue
+        elif ch == "\n":
+            # Raw newlines are not allowed inside JSON strings
+            out.append("\\n")
+            i += 1
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _close(prefix: str) -> str:
+    _, stack, in_string, _ = _scan(prefix, 0)
+    if in_string:
+        # Drop a dangling backslash so the added quote is not escaped
+        if prefix.endswith("\\") and not prefix.endswith("\\\\"):
+            prefix = prefix[:-1]
+        prefix += '"'
+    return prefix.rstrip().rstrip(",") + "".join(reversed(stack))
+
+
+def complete_truncated(text: str) -> Any:
+    """
+    Parses a document cut off mid-way: first closes it where it stops, then cuts
+    back one comma at a time until the remainder parses. Raises ValueError if
+    nothing parses.
+    """
+    _, _, _, commas = _scan(text, 0)
+    cuts = [len(text)] + list(reversed(commas))[:_MAX_TRUNCATION_CUTS]
+    for cut in cuts:
+        try:
+            return json.loads(_close(text[:cut]))
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("Truncated JSON could not be completed")
+
+
+def _double(escape: re.Match) -> str:
+    return escape.group(0) if escape.group(0) == "\\\\" else "\\" + escape.group(0)
+
+
+def escape_latex(text: str) -> str:
+    """
+    Doubles the backslash of LaTeX commands that would parse as valid JSON escapes,
+    within the math spans of the string literals in `text` (raw JSON source).
+    """
+    def in_math(span: re.Match) -> str:
+        return _LATEX_ESCAPE.sub(_double, span.group(0))
+
+    return _STRING_TOKEN.sub(lambda token: _MATH_SPAN.sub(in_math, token.group(0)), text)
+
+
+def loads(text: str) -> Tuple[Any, bool, bool]:
+    """
+    Parses LLM output leniently. Returns (data, repaired, truncated); raises
+    ValueError if no JSON could be recovered.
+    """
+    candidate, complete = extract(text)
+    data, repaired, truncated = None, False, False
+    parsed = False
+    if complete:
+        # Valid JSON is taken as written: escape repairs could change what valid escapes mean
+        try:
+            data, parsed = json.loads(candidate), True
+        except json.JSONDecodeError:
+            pass
+    if not parsed:
+        fixed = fix_escapes(escape_latex(candidate))
+        repaired = True
+        try:
+            if not complete:
+                raise json.JSONDecodeError("truncated", fixed, len(fixed))
+            data = json.loads(fixed)
+        except json.JSONDecodeError:
+            # Either cut off or broken somewhere in the middle; keep the longest parseable prefix
+            data, truncated = complete_truncated(fixed), True
+    return data, repaired, truncated
+
+
+def _list_item_type(annotation) -> Optional[Any]:
+    if get_origin(annotation) in (list, List):
+        args = get_args(annotation)
+        return args[0] if args else None
+    return None
+
+
+def _prune_list(items: list, item_type) -> Tuple[list, int]:
+    adapter = TypeAdapter(item_type)
+    kept = []
+    for item in items:
+        try:
+            adapter.validate_python(item)
+            kept.append(item)
+        except ValidationError:
+            pass
+    return kept, len(items) - len(kept)
+
+
+def _salvage(data: Any, schema) -> Tuple[Any, int]:
+    """Drops invalid elements of list fields (or of a top-level list)."""
+    item_type = _list_item_type(schema)
+    if item_type is not None and isinstance(data, list):
+        return _prune_list(data, item_type)
+    if isinstance(schema, type) and issubclass(schema, BaseModel) and isinstance(data, dict):
+        dropped = 0
+        data = dict(data)
+        for name, info in schema.model_fields.items():
+            item_type = _list_item_type(info.annotation)
+            if item_type is not None and isinstance(data.get(name), list):
+                data[name], count = _prune_list(data[name], item_type)
+                dropped += count
+        return data, dropped
+    return data, 0
+
+
+def parse(text: str, schema, context: str = "", prepare: Optional[Callable[[Any], Any]] = None) -> ParseResult:
+    """
+    Parses and validates `text` against `schema` (a pydantic model or a type such
+    as List[QuizQuestion]). `prepare`, if given, can normalise the decoded data
+    before validation (e.g. unwrap an unexpected nesting). On failure, `result.data` holds whatever was
+    recovered and `result.invalid_fields` the top-level fields that need to be
+    requested again.
+    """
+    result = ParseResult()
+    if not text:
+        result.invalid_fields = ["*"]
+        return result
+    try:
+        result.data, result.repaired, result.truncated = loads(text)
+    except ValueError:
+        logger.error("Unrecoverable JSON from LLM", extra={"context": context, "response_preview": text[:500]})
+        result.invalid_fields = ["*"]
+        return result
+    if prepare is not None:
+        result.data = prepare(result.data)
+
+    adapter = TypeAdapter(schema)
+    try:
+        result.value = adapter.validate_python(result.data)
+    except ValidationError:
+        result.data, result.dropped_items = _salvage(result.data, schema)
+        try:
+            result.value = adapter.validate_python(result.data)
+        except ValidationError as e:
+            result.invalid_fields = sorted({str(err["loc"][0]) if err["loc"] else "*" for err in e.errors()})
+
+    if result.repaired or result.dropped_items or result.invalid_fields:
+        logger.warning("Repaired LLM JSON", extra={
+            "context": context,
+            "truncated": result.truncated,
+            "dropped_items": result.dropped_items,
+            "invalid_fields": result.invalid_fields
+        })
+    return result
@@ -1,124 +1,258 @@
+import asyncio
+import logging
 import os
-import sys
-print(f"DEBUG: sys.stdout.encoding = {sys.stdout.encoding}")
+import random
+import threading
 import time
-from typing import Optional
+from typing import AsyncIterator, Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from groq import Groq
-import google.generativeai as genai
+from server.core import llm_cache, llm_router, ratelimit, usage
+from server.core.providers import GeminiProvider, LLMProvider, LLMProviderError, OpenAICompatibleProvider
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+
+# Optional OpenAI-compatible endpoint, e.g. `python -m server.core.llm_stub` for tests
+LLM_STUB_BASE_URL = os.getenv("LLM_STUB_BASE_URL", "")
+LLM_STUB_MODEL = os.getenv("LLM_STUB_MODEL", "stub")
+
+# Preference order between configured providers; the router reorders by measured latency
+LLM_PROVIDERS = [p.strip() for p in os.getenv("LLM_PROVIDERS", "groq,gemini,stub").split(",") if p.strip()]
+
+# HTTP connection pool shared by every OpenAI-compatible call in the process
+LLM_HTTP_POOL_SIZE = int(os.getenv("LLM_HTTP_POOL_SIZE", "10"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "30"))
+
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter keeps many queued callers from retrying in lockstep
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
 class LLMService:
     def __init__(self, provider: str = "groq"):
         self.provider = provider
         self.groq_api_key = os.getenv("GROQ_API_KEY", "").strip()
         self.gemini_api_key = os.getenv("GEMINI_API_KEY", "").strip()
 
-        with open("debug_init.txt", "a") as f:
-             f.write(f"Init LLMService. Provider: {provider}\n")
-             mask_groq = self.groq_api_key[:4] + "..." + self.groq_api_key[-4:] if self.groq_api_key else "None"
-             mask_gemini = self.gemini_api_key[:4] + "..." + self.gemini_api_key[-4:] if self.gemini_api_key else "None"
-             f.write(f"GROQ_KEY: '{mask_groq}'\n")
-             f.write(f"GEMINI_KEY: '{mask_gemini}'\n")
-             f.write(f"CWD: {os.getcwd()}\n")
+        # Keep-alive session: the TCP/TLS handshake is paid once per pooled connection, not per call
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LLM_HTTP_POOL_SIZE, pool_block=True)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.http.headers.update({"Content-Type": "application/json"})
 
-        self.groq_client = None
+        self.providers: Dict[str, LLMProvider] = {}
         if self.groq_api_key:
-            try:
-                self.groq_client = Groq(api_key=self.groq_api_key)
-            except Exception as e:
-                print(f"Failed to init Groq client: {e}")
-
+            self.providers["groq"] = OpenAICompatibleProvider(
+                "groq", GROQ_BASE_URL, self.groq_api_key, GROQ_MODEL, self.http,
+                LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_HTTP_POOL_SIZE
+            )
         if self.gemini_api_key:
             try:
-                genai.configure(api_key=self.gemini_api_key)
-                self.gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+                self.providers["gemini"] = GeminiProvider(self.gemini_api_key, GEMINI_MODEL)
             except Exception as e:
-                print(f"Failed to init Gemini client: {e}")
+                logger.error("Failed to init Gemini client: %s", e)
+        if LLM_STUB_BASE_URL:
+            self.providers["stub"] = OpenAICompatibleProvider(
+                "stub", LLM_STUB_BASE_URL, "stub", LLM_STUB_MODEL, self.http,
+                LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_HTTP_POOL_SIZE
+            )
+
+        # The requested provider goes first, then the rest of LLM_PROVIDERS
+        order = [provider] + [p for p in LLM_PROVIDERS if p != provider]
+        self.router = llm_router.Router([p for p in order if p in self.providers])
+        logger.info("LLMService initialised", extra={"providers": self.router.order})
+
+    def get_provider(self, name: str) -> Optional[LLMProvider]:
+        return self.providers.get(name)
 
-    def generate(self, prompt: str, system_instruction: str = "", retries: int = 3, json_mode: bool = False) -> Optional[str]:
-        print(f"DEBUG: LLM Generate. Provider: {self.provider}")
-        print(f"DEBUG: GEMINI_KEY present: {bool(self.gemini_api_key)}")
+    def generate(self, prompt: str, system_instruction: str = "", retries: int = 3, json_mode: bool = False,
+                 bypass_cache: bool = False, agent: Optional[str] = None) -> Optional[str]:
+        """`agent` names the caller (planner/content/media) in the llm_usage records."""
+        cache = llm_cache.get_cache()
+        cache_key = self._cache_key(prompt, system_instruction, json_mode)
+        if not bypass_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        # Try primary provider first
-        try:
-            if self.provider == "groq" and self.groq_client:
-                return self._call_groq(prompt, system_instruction, json_mode)
-            elif self.provider == "gemini" and self.gemini_api_key:
-                return self._call_gemini(prompt, system_instruction)
-        except Exception as e:
-             error_msg = f"Primary provider ({self.provider}) failed: {e}"
-             print(error_msg)
-             with open("debug_log.txt", "a") as f:
-                 f.write(error_msg + "\n")
-
-             # Fallback to Gemini if Groq fails
-             if self.provider == "groq" and self.gemini_api_key:
-                 print("Attempting fallback to Gemini...")
-                 with open("debug_log.txt", "a") as f:
-                     f.write("Attempting fallback to Gemini...\n")
-                 try:
-                     return self._call_gemini(prompt, system_instruction)
-                 except Exception as e2:
-                     print(f"Fallback to Gemini failed: {e2}")
-                     with open("debug_log.txt", "a") as f:
-                         f.write(f"Fallback to Gemini failed: {e2}\n")
+        response = self._generate_uncached(prompt, system_instruction, json_mode, retries, agent)
+        if response:
+            cache.set(cache_key, response)
+        return response
 
+    def _cache_key(self, prompt: str, system_instruction: str, json_mode: bool) -> str:
+        # Any configured model may serve the call, so all of them are part of the key
+        models = [(name, self.providers[name].model) for name in self.router.order]
+        return llm_cache.make_key(models, system_instruction, prompt, json_mode)
+
+    def _generate_uncached(self, prompt: str, system_instruction: str, json_mode: bool,
+                           retries: int = 3, agent: Optional[str] = None) -> Optional[str]:
+        # Fastest healthy provider first, the others as fallbacks
+        for name in self.router.candidates():
+            try:
+                return self._call_with_retries(self.providers[name], prompt, system_instruction, json_mode, retries,
+                                               agent)
+            except Exception as e:
+                logger.warning("Provider %s failed: %s", name, e, extra={"provider": name})
+        logger.error("All LLM providers failed")
         return None
 
-    def _call_groq(self, prompt: str, system_instruction: str, json_mode: bool = False) -> str:
-        import requests
-        import json
-        
-        url = "https://api.groq.com/openai/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.groq_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "messages": [
-                {
-                    "role": "system",
-                    "content": system_instruction,
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            "model": "llama-3.1-8b-instant",
-        }
-        if json_mode:
-            payload["response_format"] = {"type": "json_object"}
-
-        try:
-            print(f"DEBUG: Sending RAW request to Groq. Key len: {len(self.groq_api_key)}")
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            
-            if response.status_code != 200:
-                error_msg = f"Groq RAW Error: {response.status_code} - {response.text}"
-                print(error_msg)
-                with open("debug_log.txt", "a") as f:
-                    f.write(error_msg + "\n")
-                raise Exception(error_msg)
-                
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
-            
-        except Exception as e:
-            error_msg = f"Groq RAW Exception: {e}"
-            print(error_msg)
-            with open("debug_log.txt", "a") as f:
-                f.write(error_msg + "\n")
-            raise e
-
-    def _call_gemini(self, prompt: str, system_instruction: str) -> str:
-        try:
-            full_prompt = f"System: {system_instruction}\n\nUser: {prompt}"
-            response = self.gemini_model.generate_content(full_prompt)
-            return response.text
-        except Exception as e:
-             print(f"Gemini SDK Error: {e}")
-             raise e
+    def _call_with_retries(self, provider: LLMProvider, prompt: str, system_instruction: str, json_mode: bool,
+                           retries: int, agent: Optional[str] = None) -> str:
+        """
+        Runs one provider call under its rate limiter. Retryable failures (429, 5xx,
+        timeouts) are retried up to `retries` times with exponential backoff; a
+        retry-after from the provider is enforced by the limiter itself. Every
+        attempt is reported to the router, and retrying stops once its breaker opens.
+        """
+        limiter = ratelimit.get_limiter(provider.name, provider.model)
+        estimate = ratelimit.estimate_tokens(prompt, system_instruction)
+        attempts = max(1, retries)
+        for attempt in range(attempts):
+            limiter.acquire(estimate)
+            if not self.router.begin(provider.name):
+                # Never sent: not a success the AIMD limit should grow on
+                limiter.abandon(estimate, actual_tokens=0)
+                raise LLMProviderError(f"{provider.name} circuit is open", 503)
+            start = time.monotonic()
+            try:
+                text, used = provider.complete(prompt, system_instruction, json_mode)
+            except LLMProviderError as e:
+                self.router.record(provider.name, False)
+                limiter.release(estimate, status=e.status, retry_after=e.retry_after)
+                usage.record(provider.name, provider.model, agent, time.monotonic() - start,
+                             success=False, status=e.status)
+                if not e.retryable or attempt == attempts - 1:
+                    raise
+                if not e.retry_after:
+                    time.sleep(_backoff(attempt))
+                continue
+            except Exception:
+                self.router.record(provider.name, False)
+                limiter.release(estimate, status=500)
+                usage.record(provider.name, provider.model, agent, time.monotonic() - start,
+                             success=False, status=500)
+                raise
+            latency = time.monotonic() - start
+            self.router.record(provider.name, True, latency=latency)
+            if used:
+                usage.record(provider.name, provider.model, agent, latency, **used)
+            else:
+                usage.record(provider.name, provider.model, agent, latency,
+                             prompt_tokens=(len(prompt) + len(system_instruction)) // 4,
+                             completion_tokens=len(text or "") // 4, estimated=True)
+            limiter.release(estimate, actual_tokens=used["total_tokens"] if used else None)
+            return text
+
+    async def astream(self, prompt: str, system_instruction: str = "", json_mode: bool = False,
+                      bypass_cache: bool = False, retries: int = 3, agent: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Async variant of generate() that yields the response text chunk by chunk.
+
+        Providers are tried in router order, with retries, only until the first
+        chunk has been produced: once text has reached the caller we cannot retry
+        or switch providers. Streams share the providers' rate limiters and
+        circuit breakers with generate(). A cache hit is yielded as a single chunk,
+        and the full text is written back to the cache when the stream completes.
+        Streamed responses carry no usage block, so their llm_usage records are estimates.
+        """
+        cache = llm_cache.get_cache()
+        cache_key = self._cache_key(prompt, system_instruction, json_mode)
+        if not bypass_cache:
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        estimate = ratelimit.estimate_tokens(prompt, system_instruction)
+        parts = []
+        last_error = None
+        for name in self.router.candidates():
+            provider = self.providers[name]
+            limiter = ratelimit.get_limiter(provider.name, provider.model)
+            attempts = max(1, retries)
+            for attempt in range(attempts):
+                try:
+                    await limiter.aacquire(estimate)
+                except ratelimit.RateLimitTimeout as e:
+                    last_error = e
+                    logger.warning("Provider %s has no capacity: %s", name, e, extra={"provider": name})
+                    break
+                if not self.router.begin(name):
+                    limiter.abandon(estimate, actual_tokens=0)
+                    break
+                status, retry_after = None, None
+                cancelled = False
+                start = time.monotonic()
+                first_chunk_at = None
+                try:
+                    async for chunk in provider.stream(prompt, system_instruction, json_mode):
+                        if first_chunk_at is None:
+                            first_chunk_at = time.monotonic()
+                        parts.append(chunk)
+                        yield chunk
+                except (GeneratorExit, asyncio.CancelledError):
+                    # The consumer went away mid-stream: says nothing about the provider
+                    cancelled = True
+                    raise
+                except Exception as e:
+                    status = e.status if isinstance(e, LLMProviderError) else 500
+                    retry_after = getattr(e, "retry_after", None)
+                    last_error = e
+                    logger.warning("Provider %s stream failed: %s", name, e, extra={"provider": name})
+                    if parts:
+                        raise
+                finally:
+                    if cancelled:
+                        self.router.abandon(name)
+                        limiter.abandon(estimate)
+                    else:
+                        self.router.record(
+                            name, status is None,
+                            first_chunk_latency=first_chunk_at - start if first_chunk_at else None
+                        )
+                        limiter.release(estimate, status=status, retry_after=retry_after)
+                    usage.record(provider.name, provider.model, agent, time.monotonic() - start,
+                                 prompt_tokens=(len(prompt) + len(system_instruction)) // 4,
+                                 completion_tokens=sum(len(p) for p in parts) // 4,
+                                 estimated=True, stream=True, success=status is None and not cancelled,
+                                 status=status)
+
+                if status is None:
+                    await asyncio.to_thread(cache.set, cache_key, "".join(parts))
+                    return
+                if not (isinstance(last_error, LLMProviderError) and last_error.retryable):
+                    break
+                if attempt < attempts - 1 and not retry_after:
+                    await asyncio.sleep(_backoff(attempt))
+
+        if last_error is not None:
+            raise last_error
+        # Every provider was skipped (breaker open) or none is configured
+        raise LLMProviderError("No LLM provider available", 503)
+
+
+_llm_service: Optional[LLMService] = None
+_llm_service_lock = threading.Lock()
+
+def get_llm_service() -> LLMService:
+    """Process-wide LLMService shared by all agents (one client setup, one connection pool)."""
+    global _llm_service
+    with _llm_service_lock:
+        if _llm_service is None:
+            _llm_service = LLMService()
+            llm_router.register_metrics(_llm_service.router)
+        return _llm_service
@@ -0,0 +1,175 @@
+"""
+Content-addressed cache for LLMService.generate responses.
+
+The key is a SHA-256 of (models, system_instruction, prompt, json_mode), where
+`models` is the sorted list of configured (provider, model) pairs. The router
+picks whichever of them is fastest and healthy at the time, so an answer from
+any configured model is a hit, but changing a model (e.g. GROQ_MODEL) or the set
+of providers starts over with fresh entries.
+Two backends are available, selected by LLM_CACHE_BACKEND:
+
+- "file"  (default): one JSON file per entry under LLM_CACHE_DIR
+- "mongo": documents in the `llm_cache` collection
+- "off":   disabled
+
+Entries expire after LLM_CACHE_TTL seconds and the least recently used ones are
+evicted once more than LLM_CACHE_MAX_ENTRIES are stored.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo import ASCENDING
+
+from server.core import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "file")
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+
+def make_key(models: List[Tuple[str, str]], system_instruction: str, prompt: str, json_mode: bool) -> str:
+    raw = json.dumps([sorted(models), system_instruction, prompt, json_mode], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class FileCacheBackend:
+    def __init__(self, directory: str, ttl: int, max_entries: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["created_at"] > self.ttl:
+            self._remove(path)
+            return None
+        # Touch for LRU ordering
+        os.utime(path, None)
+        return entry["value"]
+
+    def set(self, key: str, value: str):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+            excess = len(entries) - self.max_entries
+            if excess <= 0:
+                return
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:excess]:
+                self._remove(entry.path)
+
+
+class MongoCacheBackend:
+    def __init__(self, collection, ttl: int, max_entries: int):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> Optional[str]:
+        doc = self.collection.find_one_and_update(
+            {"_id": key, "created_at": {"$gt": datetime.utcnow() - timedelta(seconds=self.ttl)}},
+            {"$set": {"last_access": datetime.utcnow()}},
+            projection={"value": 1}
+        )
+        return doc["value"] if doc else None
+
+    def set(self, key: str, value: str):
+        now = datetime.utcnow()
+        self.collection.replace_one(
+            {"_id": key},
+            {"value": value, "created_at": now, "last_access": now},
+            upsert=True
+        )
+        excess = self.collection.estimated_document_count() - self.max_entries
+        if excess > 0:
+            stale = [d["_id"] for d in self.collection.find({}, {"_id": 1}).sort("last_access", ASCENDING).limit(excess)]
+            self.collection.delete_many({"_id": {"$in": stale}})
+
+
+class LLMCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            # A broken cache must never break generation
+            logger.warning(f"LLM cache read failed: {e}")
+            self._count("errors")
+            return None
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: str, value: str):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value)
+            self._count("writes")
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+            self._count("errors")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "backend": LLM_CACHE_BACKEND, "ttl_seconds": LLM_CACHE_TTL, "max_entries": LLM_CACHE_MAX_ENTRIES}
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> LLMCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            backend = None
+            if LLM_CACHE_BACKEND == "file":
+                backend = FileCacheBackend(LLM_CACHE_DIR, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
+            elif LLM_CACHE_BACKEND == "mongo":
+                from server import database_mongo
+                backend = MongoCacheBackend(database_mongo.get_sync_database().llm_cache, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
+            _cache = LLMCache(backend)
+            metrics.register("llm_cache", _cache.snapshot)
+        return _cache
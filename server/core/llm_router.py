@@ -0,0 +1,170 @@
+"""
+Latency-aware provider selection with per-provider circuit breakers.
+
+For every provider the router keeps a rolling window of call outcomes and
+latencies. `candidates()` returns the providers to try, in order:
+
+- providers whose breaker is open are skipped until LLM_BREAKER_COOLDOWN has
+  passed, after which a single half-open probe is let through
+- providers with enough samples are ranked by p50 latency; the others keep the
+  configured preference order after them, and with probability
+  LLM_ROUTER_EXPLORE one of them is tried first so its latency gets measured
+
+A breaker opens after LLM_BREAKER_FAILURES consecutive failures, or when the
+error rate over the window reaches LLM_BREAKER_ERROR_RATE.
+"""
+import os
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from server.core import metrics
+
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "50"))
+LLM_ROUTER_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "5"))
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.02"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(pct) - 1]
+
+
+class ProviderHealth:
+    """Rolling stats and breaker state for one provider. Guarded by the router's lock."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.outcomes = deque(maxlen=LLM_ROUTER_WINDOW)
+        self.latencies = deque(maxlen=LLM_ROUTER_WINDOW)
+        self.first_chunk_latencies = deque(maxlen=LLM_ROUTER_WINDOW)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return now - self.opened_at >= LLM_BREAKER_COOLDOWN
+        return not self.probe_in_flight
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def p50(self) -> Optional[float]:
+        return _percentile(list(self.latencies), 50)
+
+    def open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.probe_in_flight = False
+
+
+class Router:
+    def __init__(self, names: List[str]):
+        self.order = list(names)
+        self.health: Dict[str, ProviderHealth] = {name: ProviderHealth(name) for name in names}
+        self._lock = threading.Lock()
+
+    def candidates(self) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            healthy = [n for n in self.order if self.health[n].available(now)]
+            measured = [n for n in healthy if len(self.health[n].latencies) >= LLM_ROUTER_MIN_SAMPLES]
+            unmeasured = [n for n in healthy if n not in measured]
+            ranked = sorted(measured, key=lambda n: self.health[n].p50()) + unmeasured
+            if unmeasured and measured and random.random() < LLM_ROUTER_EXPLORE:
+                explore = random.choice(unmeasured)
+                ranked.remove(explore)
+                ranked.insert(0, explore)
+            return ranked
+
+    def begin(self, name: str) -> bool:
+        """Claims the call slot. False if the breaker is open or another half-open probe is running."""
+        now = time.monotonic()
+        with self._lock:
+            health = self.health[name]
+            if not health.available(now):
+                return False
+            if health.state == OPEN:
+                health.state = HALF_OPEN
+            if health.state == HALF_OPEN:
+                health.probe_in_flight = True
+            return True
+
+    def abandon(self, name: str):
+        """Ends a call begun with begin() without an outcome, e.g. a stream whose consumer went away."""
+        with self._lock:
+            self.health[name].probe_in_flight = False
+
+    def record(self, name: str, success: bool, latency: Optional[float] = None,
+               first_chunk_latency: Optional[float] = None):
+        now = time.monotonic()
+        with self._lock:
+            health = self.health[name]
+            health.calls += 1
+            health.outcomes.append(success)
+            if success:
+                health.consecutive_failures = 0
+                if latency is not None:
+                    health.latencies.append(latency)
+                if first_chunk_latency is not None:
+                    health.first_chunk_latencies.append(first_chunk_latency)
+                if health.state == HALF_OPEN:
+                    # Probe succeeded: start over with a clean window
+                    health.state = CLOSED
+                    health.probe_in_flight = False
+                    health.outcomes.clear()
+                return
+
+            health.failures += 1
+            health.consecutive_failures += 1
+            if health.state == HALF_OPEN:
+                health.open(now)
+            elif health.state == CLOSED and (
+                health.consecutive_failures >= LLM_BREAKER_FAILURES
+                or (len(health.outcomes) >= LLM_ROUTER_MIN_SAMPLES and health.error_rate() >= LLM_BREAKER_ERROR_RATE)
+            ):
+                health.open(now)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for name in self.order:
+                health = self.health[name]
+                latencies = list(health.latencies)
+                first_chunk = list(health.first_chunk_latencies)
+                result[name] = {
+                    "state": health.state,
+                    "calls": health.calls,
+                    "failures": health.failures,
+                    "error_rate": round(health.error_rate(), 3),
+                    "p50_ms": _ms(_percentile(latencies, 50)),
+                    "p95_ms": _ms(_percentile(latencies, 95)),
+                    "first_chunk_p50_ms": _ms(_percentile(first_chunk, 50)),
+                    "first_chunk_p95_ms": _ms(_percentile(first_chunk, 95))
+                }
+            return result
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def register_metrics(router: Router):
+    metrics.register("llm_providers", router.snapshot)
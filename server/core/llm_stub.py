@@ -0,0 +1,86 @@
+"""
+Local OpenAI-compatible /chat/completions stub for tests and benchmarks.
+
+Answers both plain and `"stream": true` (SSE) requests, with configurable
+latency and failure rate, so routing, breakers and retries can be exercised
+without real provider keys:
+
+    python -m server.core.llm_stub --port 9100 --latency 0.2 --fail-rate 0.1
+    LLM_STUB_BASE_URL=http://127.0.0.1:9100/v1 LLM_PROVIDERS=stub python server/main.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    reply = "ok"
+    latency = 0.0
+    fail_rate = 0.0
+    fail_status = 503
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            self._send(self.fail_status, json.dumps({"error": {"message": "stub failure"}}).encode())
+            return
+
+        usage = {"prompt_tokens": 10, "completion_tokens": len(self.reply) // 4 + 1}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not request.get("stream"):
+            self._send(200, json.dumps({
+                "choices": [{"message": {"role": "assistant", "content": self.reply}}],
+                "usage": usage
+            }).encode())
+            return
+
+        events = [
+            {"choices": [{"delta": {"content": word}}]}
+            for word in self.reply.split(" ")
+        ]
+        for i in range(len(events) - 1):
+            events[i]["choices"][0]["delta"]["content"] += " "
+        body = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+        self._send(200, body.encode(), "text/event-stream")
+
+    def log_message(self, *args):
+        pass
+
+
+def start(port: int = 0, reply: str = "ok", latency: float = 0.0, fail_rate: float = 0.0):
+    """Starts the stub in a background thread. Returns (server, base_url)."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "reply": reply, "latency": latency, "fail_rate": fail_rate
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--reply", default="ok")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, base_url = start(args.port, args.reply, args.latency, args.fail_rate)
+    print(f"LLM stub listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
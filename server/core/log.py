@@ -0,0 +1,153 @@
+"""
+Process-wide logging setup.
+
+`configure_logging()` installs a single QueueHandler on the root logger, so a
+log call only enqueues the record; a QueueListener thread formats it and writes
+it to stderr and (unless LOG_FILE is empty) a size-rotated file. Every record
+carries the current request id, set per HTTP request by the middleware in
+server/main.py and per background job by server.core.jobs. The id propagates
+into asyncio.to_thread / run_in_threadpool workers through contextvars.
+
+Process pool workers (video rendering) would otherwise write into the copy of
+the queue they inherited, which no thread reads in the child. Their pools pass
+`configure_worker_logging` as initializer with `worker_queue()`, a
+multiprocessing queue that a second listener in the API process drains into
+the same handlers.
+
+Settings: LOG_LEVEL (INFO), LOG_FORMAT ("json" or "text"), LOG_FILE
+(logs/server.log), LOG_MAX_BYTES (10 MB), LOG_BACKUP_COUNT (5).
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+from datetime import datetime, timezone
+from typing import List, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_FILE = os.getenv("LOG_FILE", os.path.join("logs", "server.log"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handlers: List[logging.Handler] = []
+_worker_queue = None
+_worker_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def set_request_id(value: str) -> contextvars.Token:
+    return request_id_var.set(value)
+
+
+def reset_request_id(token: contextvars.Token):
+    request_id_var.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve message and traceback in the calling thread, but keep them apart for the formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _formatter() -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+
+def configure_logging():
+    """Idempotent; safe to call from every entry point."""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = _formatter()
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        os.makedirs(os.path.dirname(LOG_FILE) or ".", exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    _handlers[:] = handlers
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    # Filters run in the calling thread, where the request id context is still current
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def worker_queue():
+    """The queue child processes log into; created, with its listener, on first use."""
+    global _worker_queue, _worker_listener
+    if _worker_queue is None:
+        configure_logging()
+        _worker_queue = multiprocessing.Queue()
+        _worker_listener = logging.handlers.QueueListener(_worker_queue, *_handlers, respect_handler_level=True)
+        _worker_listener.start()
+        atexit.register(_worker_listener.stop)
+    return _worker_queue
+
+
+def configure_worker_logging(log_queue):
+    """Process pool initializer: sends the child's records to `log_queue` (see worker_queue)."""
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
@@ -0,0 +1,176 @@
+"""
+Content-addressed cache for generated lecture videos and narration audio.
+
+- Videos are keyed by a SHA-256 of (content_markdown, voice, render settings).
+  The `video_cache` collection maps that key to the video URL:
+
+      {"_id": key, "video_url": str, "segments": int,
+       "created_at": datetime, "last_access": datetime, "hits": int}
+
+  The mp4 files themselves live in client/static/videos, named after the key.
+  Once they take more than MEDIA_VIDEO_CACHE_MAX_BYTES, the least recently used
+  ones are deleted together with their index entries, never those written or
+  used since the render being stored started.
+- Narration is cached per script segment under MEDIA_CACHE_DIR/tts, keyed by a
+  SHA-256 of (voice, text), so a script that only changed in one segment only
+  synthesises that segment again. Bounded by MEDIA_TTS_CACHE_MAX_BYTES; evicted
+  by the API process after each render (begin_render/finish_render), never
+  while another render may still read the files it found in the cache.
+
+File modification times serve as the LRU clock: cache hits touch the file.
+Nothing here imports moviepy or pymongo, so the render processes can use it.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from server.core import metrics
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", ".media_cache")
+MEDIA_VIDEO_CACHE_MAX_BYTES = int(os.getenv("MEDIA_VIDEO_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+MEDIA_TTS_CACHE_MAX_BYTES = int(os.getenv("MEDIA_TTS_CACHE_MAX_BYTES", str(1024 ** 3)))
+
+VIDEO_DIR = os.path.join(os.getcwd(), "client", "static", "videos")
+TTS_DIR = os.path.join(MEDIA_CACHE_DIR, "tts")
+
+_lock = threading.Lock()
+_stats = {"video_hits": 0, "video_misses": 0, "tts_hits": 0, "tts_misses": 0, "evicted_videos": 0}
+metrics.register("media_cache", lambda: dict(_stats))
+
+# Start times of the renders in progress, which narration eviction must not disturb
+_active_renders: Dict[int, float] = {}
+_render_ids = itertools.count()
+
+
+def _hash(*parts) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def video_key(content_markdown: str, voice: str, settings: dict) -> str:
+    return _hash("video", content_markdown, voice, settings)
+
+
+def video_filename(key: str) -> str:
+    return f"video_{key[:32]}.mp4"
+
+
+def _video_path(video_url: str) -> str:
+    return os.path.join(VIDEO_DIR, os.path.basename(video_url))
+
+
+def tts_path(text: str, voice: str) -> str:
+    """Where the narration of `text` is (or will be) cached. Creates the cache directory."""
+    os.makedirs(TTS_DIR, exist_ok=True)
+    return os.path.join(TTS_DIR, f"{_hash('tts', voice, text)}.mp3")
+
+
+def touch(path: str) -> bool:
+    """Marks a cached file as recently used. Returns False if it no longer exists."""
+    try:
+        os.utime(path, None)
+        return True
+    except OSError:
+        return False
+
+
+def count_tts(hits: int, misses: int):
+    with _lock:
+        _stats["tts_hits"] += hits
+        _stats["tts_misses"] += misses
+
+
+def evict(directory: str, max_bytes: int, prefix: str = "", suffix: str = "",
+          keep_after: Optional[float] = None) -> List[str]:
+    """
+    Deletes the least recently used matching files until the rest fit in
+    max_bytes, never touching files used at or after the `keep_after` timestamp.
+    Returns the names of the deleted files.
+    """
+    try:
+        entries = [e for e in os.scandir(directory)
+                   if e.is_file() and e.name.startswith(prefix) and e.name.endswith(suffix)]
+    except FileNotFoundError:
+        return []
+    stats = {e.path: e.stat() for e in entries}
+    total = sum(s.st_size for s in stats.values())
+    removed = []
+    for path in sorted(stats, key=lambda p: stats[p].st_mtime):
+        if total <= max_bytes or (keep_after is not None and stats[path].st_mtime >= keep_after):
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= stats[path].st_size
+        removed.append(os.path.basename(path))
+    return removed
+
+
+def begin_render() -> int:
+    """Registers a render about to start (in this API process). Pass the id to finish_render."""
+    with _lock:
+        render_id = next(_render_ids)
+        _active_renders[render_id] = time.time()
+    return render_id
+
+
+def finish_render(render_id: int):
+    """
+    Forgets a finished render, then evicts narration over MEDIA_TTS_CACHE_MAX_BYTES.
+    Every file a running render counted as a hit was touched after that render
+    started, so nothing used at or after the oldest running render's start is evicted.
+    """
+    with _lock:
+        started = _active_renders.pop(render_id)
+        keep_after = min([started, *_active_renders.values()])
+    removed = evict(TTS_DIR, MEDIA_TTS_CACHE_MAX_BYTES, suffix=".mp3", keep_after=keep_after)
+    if removed:
+        logger.info("Evicted cached narration", extra={"files": len(removed)})
+
+
+async def lookup(db, key: str) -> Optional[str]:
+    """Returns the URL of the cached video for `key`, or None (dropping entries whose file is gone)."""
+    doc = await db.video_cache.find_one({"_id": key})
+    if doc is None or not touch(_video_path(doc["video_url"])):
+        if doc is not None:
+            await db.video_cache.delete_one({"_id": key})
+        with _lock:
+            _stats["video_misses"] += 1
+        return None
+    await db.video_cache.update_one(
+        {"_id": key}, {"$set": {"last_access": datetime.utcnow()}, "$inc": {"hits": 1}}
+    )
+    with _lock:
+        _stats["video_hits"] += 1
+    return doc["video_url"]
+
+
+async def store(db, key: str, video_url: str, segments: int, render_started: float):
+    """
+    Indexes a freshly rendered video, then evicts the least recently used videos
+    over the size bound. Videos written or used since `render_started` (a
+    time.time() timestamp), the new one included, are kept even over the bound.
+    """
+    now = datetime.utcnow()
+    await db.video_cache.replace_one(
+        {"_id": key},
+        {"video_url": video_url, "segments": segments, "created_at": now, "last_access": now, "hits": 0},
+        upsert=True
+    )
+    removed = await asyncio.to_thread(evict, VIDEO_DIR, MEDIA_VIDEO_CACHE_MAX_BYTES, "video_", ".mp4",
+                                      render_started)
+    if removed:
+        await db.video_cache.delete_many({"video_url": {"$in": [f"/static/videos/{name}" for name in removed]}})
+        with _lock:
+            _stats["evicted_videos"] += len(removed)
+        logger.info("Evicted cached videos", extra={"files": len(removed)})
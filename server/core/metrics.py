@@ -0,0 +1,17 @@
+"""
+Process-wide registry of runtime counters.
+
+Subsystems register a zero-argument callable returning a dict; GET /metrics
+returns {name: callable()} for every registered section.
+"""
+from typing import Callable, Dict
+
+_sections: Dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, provider: Callable[[], dict]):
+    _sections[name] = provider
+
+
+def snapshot() -> dict:
+    return {name: provider() for name, provider in _sections.items()}
@@ -0,0 +1,203 @@
+"""
+Materialized per-student/per-course progress.
+
+The `course_progress` collection holds one document per (user_id, course_id):
+
+    {
+        "user_id": str,
+        "course_id": str,
+        "completed_chapter_ids": [str],
+        "chapter_scores": {chapter_id: best quiz percentage},
+        "total_chapters": int,
+        "exam_attempts": int,
+        "best_exam_percentage": float,
+        "exam_passed": bool,
+        "updated_at": datetime
+    }
+
+It is updated incrementally by the quiz/exam/chapter write paths so read paths
+never have to recompute progress from raw quiz_results.
+Run `python -m server.core.progress rebuild` to backfill it from existing
+quiz_results/exam_results.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo import ReplaceOne
+
+
+def progress_percent(doc: Optional[dict]) -> float:
+    if not doc or not doc.get("total_chapters"):
+        return 0.0
+    return min(100.0, len(doc.get("completed_chapter_ids", [])) / doc["total_chapters"] * 100)
+
+
+def quiz_average(doc: Optional[dict]) -> float:
+    scores = list((doc or {}).get("chapter_scores", {}).values())
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+async def get_progress_docs(db, user_id: str, course_ids: List[str]) -> Dict[str, dict]:
+    """Returns {course_id: course_progress doc} for the given user in one query."""
+    if not course_ids:
+        return {}
+    docs = db.course_progress.find({"user_id": user_id, "course_id": {"$in": course_ids}})
+    return {d["course_id"]: d async for d in docs}
+
+
+async def compute_course_progress(db, user_id: str, course_ids: List[str]) -> Dict[str, float]:
+    """Returns {course_id: progress_percent} for every course in course_ids."""
+    docs = await get_progress_docs(db, user_id, course_ids)
+    return {cid: progress_percent(docs.get(cid)) for cid in course_ids}
+
+
+# --- Write paths ---
+
+async def record_quiz_result(db, user_id: str, course_id: str, chapter_id: str, score: int, total_questions: int):
+    percentage = (score / total_questions * 100) if total_questions > 0 else 0.0
+    await db.course_progress.update_one(
+        {"user_id": user_id, "course_id": course_id},
+        {
+            "$addToSet": {"completed_chapter_ids": chapter_id},
+            "$max": {f"chapter_scores.{chapter_id}": percentage},
+            "$set": {
+                "total_chapters": await db.chapters.count_documents({"course_id": course_id}),
+                "updated_at": datetime.utcnow()
+            },
+            "$setOnInsert": {"exam_attempts": 0, "exam_passed": False}
+        },
+        upsert=True
+    )
+
+
+async def record_exam_result(db, user_id: str, course_id: str, percentage: float, passed: bool):
+    update = {
+        "$inc": {"exam_attempts": 1},
+        "$max": {"best_exam_percentage": float(percentage)},
+        "$set": {"updated_at": datetime.utcnow()},
+        "$setOnInsert": {
+            "completed_chapter_ids": [],
+            "chapter_scores": {},
+            "total_chapters": await db.chapters.count_documents({"course_id": course_id})
+        }
+    }
+    if passed:
+        update["$set"]["exam_passed"] = True
+    else:
+        update["$setOnInsert"]["exam_passed"] = False
+    await db.course_progress.update_one({"user_id": user_id, "course_id": course_id}, update, upsert=True)
+
+
+async def sync_chapter_total(db, course_id: str):
+    """Refresh total_chapters on every progress doc of a course after chapters are added/removed."""
+    total = await db.chapters.count_documents({"course_id": course_id})
+    await db.course_progress.update_many(
+        {"course_id": course_id},
+        {"$set": {"total_chapters": total, "updated_at": datetime.utcnow()}}
+    )
+
+
+async def remove_chapter(db, course_id: str, chapter_id: str):
+    await remove_chapters(db, course_id, [chapter_id])
+
+
+async def remove_chapters(db, course_id: str, chapter_ids: List[str]):
+    await db.course_progress.update_many(
+        {"course_id": course_id},
+        {
+            "$pull": {"completed_chapter_ids": {"$in": chapter_ids}},
+            "$unset": {f"chapter_scores.{chapter_id}": "" for chapter_id in chapter_ids}
+        }
+    )
+    await sync_chapter_total(db, course_id)
+
+
+async def delete_course(db, course_id: str):
+    return await db.course_progress.delete_many({"course_id": course_id})
+
+
+# --- Backfill ---
+
+async def rebuild(db) -> int:
+    """
+    Recomputes the whole course_progress collection from quiz_results/exam_results.
+    Documents are replaced in place and the stale ones deleted afterwards, so
+    readers never see the collection empty while it runs.
+    """
+    started = datetime.utcnow()
+    totals = {}
+    chapter_courses = {}
+    async for ch in db.chapters.find({}, {"course_id": 1}):
+        totals[ch["course_id"]] = totals.get(ch["course_id"], 0) + 1
+        chapter_courses[str(ch["_id"])] = ch["course_id"]
+
+    docs = {}
+
+    def doc_for(user_id, course_id):
+        key = (user_id, course_id)
+        if key not in docs:
+            docs[key] = {
+                "user_id": user_id,
+                "course_id": course_id,
+                "completed_chapter_ids": [],
+                "chapter_scores": {},
+                "total_chapters": totals.get(course_id, 0),
+                "exam_attempts": 0,
+                "best_exam_percentage": None,
+                "exam_passed": False,
+                "updated_at": started
+            }
+        return docs[key]
+
+    async for row in await db.quiz_results.aggregate([
+        {"$group": {
+            "_id": {"user_id": "$user_id", "chapter_id": "$chapter_id"},
+            "best": {"$max": {"$cond": [
+                {"$gt": ["$total_questions", 0]},
+                {"$multiply": [{"$divide": ["$score", "$total_questions"]}, 100]},
+                0
+            ]}}
+        }}
+    ]):
+        key = row["_id"]
+        if key["chapter_id"] not in chapter_courses:
+            continue
+        # The chapter's course, not the course_id stored with the result
+        doc = doc_for(key["user_id"], chapter_courses[key["chapter_id"]])
+        doc["completed_chapter_ids"].append(key["chapter_id"])
+        doc["chapter_scores"][key["chapter_id"]] = row["best"]
+
+    async for row in await db.exam_results.aggregate([
+        {"$group": {
+            "_id": {"user_id": "$user_id", "course_id": "$course_id"},
+            "attempts": {"$sum": 1},
+            "best": {"$max": "$percentage"},
+            "passed": {"$max": "$passed"}
+        }}
+    ]):
+        doc = doc_for(row["_id"]["user_id"], row["_id"]["course_id"])
+        doc["exam_attempts"] = row["attempts"]
+        doc["best_exam_percentage"] = float(row["best"]) if row["best"] is not None else None
+        doc["exam_passed"] = bool(row["passed"])
+
+    if docs:
+        await db.course_progress.bulk_write([
+            ReplaceOne({"user_id": d["user_id"], "course_id": d["course_id"]}, d, upsert=True)
+            for d in docs.values()
+        ], ordered=False)
+    # Neither rebuilt nor written by the live write paths since the rebuild started
+    await db.course_progress.delete_many({"updated_at": {"$not": {"$gte": started}}})
+    return len(docs)
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    from server import database_mongo
+
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python -m server.core.progress rebuild")
+        sys.exit(1)
+
+    count = asyncio.run(rebuild(database_mongo.get_database()))
+    print(f"Rebuilt course_progress: {count} documents")
@@ -0,0 +1,213 @@
+"""
+LLM provider backends used by LLMService.
+
+Every backend implements the LLMProvider interface:
+
+- `complete(prompt, system_instruction, json_mode) -> (text, usage or None)`, where usage
+  is {"prompt_tokens", "completion_tokens", "total_tokens"} as reported by the provider
+- `stream(prompt, system_instruction, json_mode)`, an async iterator of text chunks
+
+and reports failures as LLMProviderError with an HTTP-like status so the
+rate limiter, retries and circuit breakers can tell throttling from outages.
+
+OpenAICompatibleProvider covers Groq and any other /chat/completions endpoint,
+e.g. the local stub in server.core.llm_stub.
+"""
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+import requests
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMProviderError(Exception):
+    """A provider call failed with an HTTP-like status (None when unknown)."""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in RETRYABLE_STATUSES
+
+
+def _retry_after(headers) -> Optional[float]:
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+Usage = Dict[str, int]
+
+
+class LLMProvider:
+    name: str = ""
+    model: str = ""
+
+    def complete(self, prompt: str, system_instruction: str, json_mode: bool = False) -> Tuple[str, Optional[Usage]]:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, system_instruction: str, json_mode: bool = False) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    def __init__(self, name: str, base_url: str, api_key: str, model: str, http: requests.Session,
+                 connect_timeout: float, read_timeout: float, pool_size: int):
+        self.name = name
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        # Shared keep-alive session: the TCP/TLS handshake is paid once per pooled connection
+        self.http = http
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        # Async client for streaming, created lazily inside the running event loop
+        self._async_http: Optional[httpx.AsyncClient] = None
+
+    def _payload(self, prompt: str, system_instruction: str, json_mode: bool, stream: bool = False) -> dict:
+        payload = {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_instruction,
+                },
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            "model": self.model,
+        }
+        if stream:
+            payload["stream"] = True
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def complete(self, prompt: str, system_instruction: str, json_mode: bool = False) -> Tuple[str, Optional[Usage]]:
+        url = f"{self.base_url}/chat/completions"
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        try:
+            response = self.http.post(url, json=self._payload(prompt, system_instruction, json_mode),
+                                      headers=headers, timeout=self.timeout)
+
+            if response.status_code != 200:
+                error_msg = f"{self.name} error: {response.status_code} - {response.text[:500]}"
+                logger.warning(error_msg, extra={"provider": self.name, "status": response.status_code})
+                raise LLMProviderError(error_msg, response.status_code, _retry_after(response.headers))
+
+            data = response.json()
+            usage = data.get("usage") or {}
+            if not usage:
+                return data["choices"][0]["message"]["content"], None
+            return data["choices"][0]["message"]["content"], {
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0)
+            }
+
+        except requests.RequestException as e:
+            error_msg = f"{self.name} request failed: {e}"
+            logger.warning(error_msg, extra={"provider": self.name})
+            # Timeouts and dropped connections are treated like a 503
+            raise LLMProviderError(error_msg, 503) from e
+
+    def _get_async_http(self) -> httpx.AsyncClient:
+        if self._async_http is None or self._async_http.is_closed:
+            self._async_http = httpx.AsyncClient(
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+            )
+        return self._async_http
+
+    async def stream(self, prompt: str, system_instruction: str, json_mode: bool = False) -> AsyncIterator[str]:
+        payload = self._payload(prompt, system_instruction, json_mode, stream=True)
+        try:
+            async with self._get_async_http().stream("POST", f"{self.base_url}/chat/completions", json=payload) as response:
+                if response.status_code != 200:
+                    body = (await response.aread()).decode("utf-8", "replace")
+                    raise LLMProviderError(f"{self.name} stream error: {response.status_code} - {body}",
+                                           response.status_code, _retry_after(response.headers))
+                async for line in response.aiter_lines():
+                    # SSE: "data: {...}" lines separated by blank lines, terminated by "data: [DONE]"
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except httpx.TransportError as e:
+            raise LLMProviderError(f"{self.name} stream transport error: {e}", 503) from e
+
+
+def _gemini_error(e: Exception) -> Exception:
+    # google.api_core exceptions carry the HTTP status in `.code`
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return LLMProviderError(f"Gemini error: {e}", code)
+    return e
+
+
+class GeminiProvider(LLMProvider):
+    def __init__(self, api_key: str, model: str):
+        import google.generativeai as genai
+        self.name = "gemini"
+        self.model = model
+        genai.configure(api_key=api_key)
+        self.gemini_model = genai.GenerativeModel(model)
+
+    def complete(self, prompt: str, system_instruction: str, json_mode: bool = False) -> Tuple[str, Optional[Usage]]:
+        try:
+            full_prompt = f"System: {system_instruction}\n\nUser: {prompt}"
+            response = self.gemini_model.generate_content(full_prompt)
+            usage = getattr(response, "usage_metadata", None)
+            if usage is None:
+                return response.text, None
+            return response.text, {
+                "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+                "completion_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+                "total_tokens": getattr(usage, "total_token_count", 0) or 0
+            }
+        except Exception as e:
+             logger.warning("Gemini SDK error: %s", e, extra={"provider": self.name})
+             raise _gemini_error(e) from e
+
+    async def stream(self, prompt: str, system_instruction: str, json_mode: bool = False) -> AsyncIterator[str]:
+        # The Gemini SDK streams through a blocking iterator, so it is drained in a worker thread
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                full_prompt = f"System: {system_instruction}\n\nUser: {prompt}"
+                for chunk in self.gemini_model.generate_content(full_prompt, stream=True):
+                    if chunk.text:
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, _gemini_error(e))
+
+        producer = loop.run_in_executor(None, produce)
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                logger.warning("Gemini SDK stream error: %s", item, extra={"provider": self.name})
+                raise item
+            yield item
+        await producer
@@ -0,0 +1,209 @@
+"""
+Client-side rate limiting for LLM providers.
+
+One ProviderLimiter per (provider, model) combines:
+
+- a requests/minute and a tokens/minute token bucket (tokens are estimated up
+  front and reconciled with the provider's reported usage afterwards)
+- an adaptive concurrency limit (AIMD): +1/limit per success, halved on a
+  429/5xx, never above `max_concurrency`
+- a cool-down honouring the provider's `retry-after`
+
+Callers queue in `acquire` (threads) or `aacquire` (asyncio) until all three
+allow the call, and report the outcome with `release` (or hand the slot back
+without an outcome with `abandon`). Both entry points share
+the same state, so sync agents and async streaming draw from one budget.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from server.core import metrics
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", os.getenv("LLM_HTTP_POOL_SIZE", "10")))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "1500"))
+
+# Defaults are the providers' free-tier limits; override per deployment
+PROVIDER_LIMITS = {
+    "groq": (int(os.getenv("GROQ_RPM", "30")), int(os.getenv("GROQ_TPM", "6000"))),
+    "gemini": (int(os.getenv("GEMINI_RPM", "15")), int(os.getenv("GEMINI_TPM", "1000000"))),
+    # Local test stub (server.core.llm_stub): effectively unlimited
+    "stub": (int(os.getenv("STUB_RPM", "100000")), int(os.getenv("STUB_TPM", "1000000000"))),
+}
+
+
+class RateLimitTimeout(Exception):
+    """The call waited LLM_QUEUE_TIMEOUT seconds without getting a slot."""
+
+
+def estimate_tokens(*texts: str) -> int:
+    # ~4 characters per token for English text, plus the expected completion
+    return sum(len(t or "") for t in texts) // 4 + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    """`capacity` units refilled continuously over one minute. Not thread-safe on its own."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # A request larger than the whole bucket would wait forever; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        self.level = min(self.capacity, self.level - delta)
+
+
+class ProviderLimiter:
+    def __init__(self, name: str, rpm: int, tpm: int, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.stats = {"granted": 0, "waited": 0, "throttled": 0, "errors": 0, "timeouts": 0}
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Grants the call and returns 0, or returns how long to wait before trying again. Caller holds the lock."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= int(self.concurrency_limit):
+            # Woken by release(); the timeout is only a safety net
+            return 1.0
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.in_flight += 1
+        self.stats["granted"] += 1
+        return 0.0
+
+    def acquire(self, tokens: int, timeout: float = LLM_QUEUE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            waited = False
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait == 0:
+                    if waited:
+                        self.stats["waited"] += 1
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise RateLimitTimeout(f"{self.name}: no capacity after {timeout:.0f}s")
+                waited = True
+                self._changed.wait(min(wait, remaining))
+
+    async def aacquire(self, tokens: int, timeout: float = LLM_QUEUE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                wait = self._try_acquire(tokens)
+                if wait == 0 and waited:
+                    self.stats["waited"] += 1
+            if wait == 0:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    self.stats["timeouts"] += 1
+                raise RateLimitTimeout(f"{self.name}: no capacity after {timeout:.0f}s")
+            waited = True
+            # Short sleeps: async waiters cannot be woken by the threading.Condition
+            await asyncio.sleep(min(wait, remaining, 0.25))
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int] = None,
+                status: Optional[int] = None, retry_after: Optional[float] = None):
+        """
+        Reports the outcome of a granted call. `status` is the HTTP status of a failed
+        call (None on success); 429 and 5xx shrink the concurrency limit.
+        """
+        with self._changed:
+            self.in_flight = max(0, self.in_flight - 1)
+            if actual_tokens is not None:
+                self.tokens.adjust(actual_tokens - estimated_tokens)
+            if status is None:
+                # Additive increase: roughly +1 after a full window of successes
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+            elif status == 429 or status >= 500:
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+                self.stats["throttled" if status == 429 else "errors"] += 1
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self._changed.notify_all()
+
+    def abandon(self, estimated_tokens: int, actual_tokens: Optional[int] = None):
+        """
+        Frees a granted slot without reporting an outcome, leaving the concurrency
+        limit alone: the call was never sent (actual_tokens=0) or its caller went
+        away mid-stream.
+        """
+        with self._changed:
+            self.in_flight = max(0, self.in_flight - 1)
+            if actual_tokens is not None:
+                self.tokens.adjust(actual_tokens - estimated_tokens)
+            if actual_tokens == 0:
+                self.requests.adjust(-1)
+            self._changed.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {
+                **self.stats,
+                "in_flight": self.in_flight,
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "requests_available": int(self.requests.level),
+                "tokens_available": int(self.tokens.level),
+                "blocked_for_seconds": round(max(0.0, self.blocked_until - now), 1)
+            }
+
+
+_limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str, model: str) -> ProviderLimiter:
+    with _limiters_lock:
+        key = (provider, model)
+        if key not in _limiters:
+            rpm, tpm = PROVIDER_LIMITS.get(provider, (60, 100000))
+            _limiters[key] = ProviderLimiter(f"{provider}:{model}", rpm, tpm)
+        return _limiters[key]
+
+
+def snapshot() -> dict:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.snapshot() for limiter in limiters}
+
+
+metrics.register("llm_rate_limits", snapshot)
@@ -0,0 +1,158 @@
+"""
+Per-render scratch directories for the media pipeline.
+
+Every `render_video` call writes its intermediate files into its own directory
+under MEDIA_SCRATCH_DIR, so concurrent renders never share file names, and
+removes it in a finally block. The default root is on tmpfs (/dev/shm) when
+that is available and writable, and otherwise in the system temp directory.
+
+Directory names carry the pid of the render process. A process that is killed
+mid-render cannot clean up after itself, so a janitor task in the API process
+sweeps, every MEDIA_SCRATCH_SWEEP_INTERVAL seconds, the directories whose
+process is gone or that are older than MEDIA_SCRATCH_MAX_AGE. It also removes
+partial files that such renders left behind in the video and narration caches.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from server.core import media_cache, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _default_root() -> str:
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return os.path.join("/dev/shm", "educore-media")
+    return os.path.join(tempfile.gettempdir(), "educore-media")
+
+
+MEDIA_SCRATCH_DIR = os.getenv("MEDIA_SCRATCH_DIR") or _default_root()
+MEDIA_SCRATCH_MAX_AGE = int(os.getenv("MEDIA_SCRATCH_MAX_AGE", str(6 * 3600)))
+MEDIA_SCRATCH_SWEEP_INTERVAL = int(os.getenv("MEDIA_SCRATCH_SWEEP_INTERVAL", "600"))
+
+_PREFIX = "job-"
+_stats = {"sweeps": 0, "removed_dirs": 0, "removed_files": 0}
+_janitor: Optional[asyncio.Task] = None
+
+
+@contextmanager
+def job_dir() -> Iterator[str]:
+    """Creates a private scratch directory for one render and removes it, whatever happens, on exit."""
+    os.makedirs(MEDIA_SCRATCH_DIR, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"{_PREFIX}{os.getpid()}-", dir=MEDIA_SCRATCH_DIR)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+
+def _owner_pid(name: str) -> Optional[int]:
+    try:
+        return int(name[len(_PREFIX):].split("-", 1)[0])
+    except ValueError:
+        return None
+
+
+def _stale_files(directory: str, cutoff: float, predicate) -> Iterator[str]:
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and predicate(entry.name) and entry.stat().st_mtime < cutoff:
+                yield entry.path
+        except FileNotFoundError:
+            continue
+
+
+def _is_leftover_video_file(name: str) -> bool:
+    # Hidden partial encodes, and segments written next to the videos before renders got scratch dirs
+    return (name.startswith(".") and name.endswith(".mp4")) or \
+        (name.startswith("temp_") and name.endswith(".mp3")) or \
+        (name.startswith("frame_") and name.endswith(".png"))
+
+
+def sweep(max_age: int = MEDIA_SCRATCH_MAX_AGE) -> dict:
+    """Removes abandoned scratch directories and partial media files. Returns what was removed."""
+    cutoff = time.time() - max_age
+    removed_dirs = 0
+    try:
+        entries = list(os.scandir(MEDIA_SCRATCH_DIR))
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        if not entry.is_dir() or not entry.name.startswith(_PREFIX):
+            continue
+        pid = _owner_pid(entry.name)
+        try:
+            expired = entry.stat().st_mtime < cutoff
+        except FileNotFoundError:
+            continue
+        if expired or pid is None or not _pid_alive(pid):
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed_dirs += 1
+
+    removed_files = 0
+    leftovers = list(_stale_files(media_cache.VIDEO_DIR, cutoff, _is_leftover_video_file)) + \
+        list(_stale_files(media_cache.TTS_DIR, cutoff, lambda name: name.endswith(".part")))
+    for path in leftovers:
+        try:
+            os.remove(path)
+            removed_files += 1
+        except OSError:
+            pass
+
+    _stats["sweeps"] += 1
+    _stats["removed_dirs"] += removed_dirs
+    _stats["removed_files"] += removed_files
+    if removed_dirs or removed_files:
+        logger.info("Swept media scratch space", extra={"dirs": removed_dirs, "files": removed_files})
+    return {"dirs": removed_dirs, "files": removed_files}
+
+
+async def _run_janitor():
+    while True:
+        try:
+            await asyncio.to_thread(sweep)
+        except Exception as e:
+            logger.error(f"Media scratch sweep failed: {e}")
+        await asyncio.sleep(MEDIA_SCRATCH_SWEEP_INTERVAL)
+
+
+def start_janitor():
+    global _janitor
+    if _janitor is None:
+        _janitor = asyncio.create_task(_run_janitor())
+
+
+async def stop_janitor():
+    global _janitor
+    if _janitor is None:
+        return
+    _janitor.cancel()
+    try:
+        await _janitor
+    except asyncio.CancelledError:
+        pass
+    _janitor = None
+
+
+metrics.register("media_scratch", lambda: {**_stats, "root": MEDIA_SCRATCH_DIR})
@@ -0,0 +1,247 @@
+"""
+Token usage and cost accounting for LLM calls.
+
+LLMService calls `record(...)` once per provider attempt. The record is
+annotated with the calling agent, the originating route and the
+user/organization of the current request or job, and is appended to an
+in-memory buffer. A background task flushes the buffer to the `llm_usage`
+collection with insert_many every LLM_USAGE_FLUSH_INTERVAL seconds, or sooner
+once LLM_USAGE_BATCH_SIZE records are waiting. A record looks like:
+
+    {
+        "ts": datetime,
+        "provider": str, "model": str, "agent": str | None,
+        "route": str | None, "user_id": str | None, "organization_id": str | None,
+        "request_id": str,
+        "prompt_tokens": int, "completion_tokens": int, "total_tokens": int,
+        "estimated": bool,           # True when the provider reported no usage
+        "cost_usd": float | None,    # from LLM_PRICES, None for unpriced models
+        "latency_ms": float, "stream": bool, "success": bool, "status": int | None
+    }
+
+The request context is opened by the HTTP middleware in server/main.py (route),
+completed by the auth dependency (user) and opened per job by server.core.jobs.
+
+LLM_PRICES is a JSON object of USD prices per million tokens:
+`{"llama-3.1-8b-instant": [0.05, 0.08]}` (input, output).
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from server.core import log, metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "5"))
+LLM_USAGE_BATCH_SIZE = int(os.getenv("LLM_USAGE_BATCH_SIZE", "500"))
+LLM_USAGE_MAX_BUFFER = int(os.getenv("LLM_USAGE_MAX_BUFFER", "20000"))
+LLM_USAGE_TTL_DAYS = int(os.getenv("LLM_USAGE_TTL_DAYS", "90"))
+LLM_PRICES = json.loads(os.getenv("LLM_PRICES", "{}"))
+
+GROUP_BY_FIELDS = ("route", "agent", "provider", "model", "user_id")
+
+# A mutable dict so the auth dependency can add the user to the context the middleware opened
+_context: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("llm_usage_context", default=None)
+
+
+def begin(**fields) -> contextvars.Token:
+    return _context.set(dict(fields))
+
+
+def end(token: contextvars.Token):
+    _context.reset(token)
+
+
+def bind(**fields):
+    """Adds fields to the context of the current request or job; a no-op outside one."""
+    context = _context.get()
+    if context is not None:
+        context.update({k: v for k, v in fields.items() if v is not None})
+
+
+def _cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    price = LLM_PRICES.get(model)
+    if not price:
+        return None
+    return round((prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000, 6)
+
+
+class UsageWriter:
+    """Thread-safe buffer of usage records, flushed to Mongo by an asyncio task."""
+
+    def __init__(self):
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "failed_flushes": 0}
+
+    def add(self, doc: dict):
+        with self._lock:
+            if len(self._buffer) >= LLM_USAGE_MAX_BUFFER:
+                # Mongo unreachable (or no writer running): keep the newest records
+                self._buffer.popleft()
+                self.stats["dropped"] += 1
+            self._buffer.append(doc)
+            self.stats["recorded"] += 1
+            full = len(self._buffer) >= LLM_USAGE_BATCH_SIZE
+        if full and self._loop is not None:
+            # LLM calls mostly run in worker threads
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self, db):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self, db):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._loop = None
+        await self.flush(db)
+
+    async def _run(self, db):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), LLM_USAGE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush(db)
+
+    async def flush(self, db):
+        with self._lock:
+            batch = list(self._buffer)
+            self._buffer.clear()
+        if not batch:
+            return
+        try:
+            await _resolve_organizations(db, batch)
+            await db.llm_usage.insert_many(batch, ordered=False)
+            self.stats["written"] += len(batch)
+        except Exception as e:
+            self.stats["failed_flushes"] += 1
+            self.stats["dropped"] += len(batch)
+            logger.error(f"Writing {len(batch)} LLM usage records failed: {e}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "buffered": len(self._buffer)}
+
+
+async def _resolve_organizations(db, batch: list):
+    """Job-originated records only know the user; look their organization up once per flush."""
+    user_ids = set()
+    for doc in batch:
+        if doc.get("user_id") and not doc.get("organization_id"):
+            try:
+                user_ids.add(ObjectId(doc["user_id"]))
+            except (InvalidId, TypeError):
+                pass
+    if not user_ids:
+        return
+    users = await db.users.find({"_id": {"$in": list(user_ids)}}, {"organization_id": 1}).to_list(None)
+    organizations = {str(u["_id"]): u.get("organization_id") for u in users}
+    for doc in batch:
+        if doc.get("user_id") and not doc.get("organization_id"):
+            doc["organization_id"] = organizations.get(doc["user_id"])
+
+
+writer = UsageWriter()
+metrics.register("llm_usage", writer.snapshot)
+
+
+def start_writer(db):
+    writer.start(db)
+
+
+async def stop_writer(db):
+    await writer.stop(db)
+
+
+def record(provider: str, model: str, agent: Optional[str], latency: float,
+           prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None,
+           total_tokens: Optional[int] = None, estimated: bool = False, stream: bool = False,
+           success: bool = True, status: Optional[int] = None):
+    prompt_tokens = prompt_tokens or 0
+    completion_tokens = completion_tokens or 0
+    context = _context.get() or {}
+    writer.add({
+        "ts": datetime.utcnow(),
+        "provider": provider,
+        "model": model,
+        "agent": agent,
+        "route": context.get("route"),
+        "user_id": context.get("user_id"),
+        "organization_id": context.get("organization_id"),
+        "request_id": log.request_id_var.get(),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens or prompt_tokens + completion_tokens,
+        "estimated": estimated,
+        "cost_usd": _cost(model, prompt_tokens, completion_tokens),
+        "latency_ms": round(latency * 1000, 1),
+        "stream": stream,
+        "success": success,
+        "status": status
+    })
+
+
+async def summarize(db, match: dict, group_by: str = "route", days: int = 30, limit: int = 100) -> dict:
+    """Token/cost totals for the records matching `match` over the last `days` days, grouped by `group_by`."""
+    if group_by not in GROUP_BY_FIELDS:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY_FIELDS)}")
+    since = datetime.utcnow() - timedelta(days=days)
+    totals = {
+        "calls": {"$sum": 1},
+        "failures": {"$sum": {"$cond": ["$success", 0, 1]}},
+        "prompt_tokens": {"$sum": "$prompt_tokens"},
+        "completion_tokens": {"$sum": "$completion_tokens"},
+        "total_tokens": {"$sum": "$total_tokens"},
+        "cost_usd": {"$sum": {"$ifNull": ["$cost_usd", 0]}},
+        "avg_latency_ms": {"$avg": "$latency_ms"}
+    }
+    cursor = await db.llm_usage.aggregate([
+        {"$match": {**match, "ts": {"$gte": since}}},
+        {"$facet": {
+            "groups": [
+                {"$group": {"_id": f"${group_by}", **totals}},
+                {"$sort": {"total_tokens": -1}},
+                {"$limit": limit}
+            ],
+            "total": [{"$group": {"_id": None, **totals}}]
+        }}
+    ])
+    result = (await cursor.to_list(1))[0]
+
+    def clean(doc: dict) -> dict:
+        doc = {k: v for k, v in doc.items() if k != "_id"}
+        doc["cost_usd"] = round(doc["cost_usd"], 4)
+        doc["avg_latency_ms"] = round(doc["avg_latency_ms"] or 0, 1)
+        return doc
+
+    return {
+        "days": days,
+        "group_by": group_by,
+        "total": clean(result["total"][0]) if result["total"] else None,
+        "groups": [{group_by: g["_id"], **clean(g)} for g in result["groups"]]
+    }
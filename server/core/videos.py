@@ -0,0 +1,141 @@
+"""
+Lecture video rendering run as a background job (see server.core.jobs).
+
+POST /generate/video enqueues a "media.video" job and returns its id right away.
+The handler writes the script with the LLM in this process, so LLM usage
+accounting and rate limits stay shared with the API, and then hands the TTS,
+frame rendering and encoding to `media.render_video` in a process pool so
+moviepy/ffmpeg work never blocks the API's event loop.
+
+- Videos are content-addressed (see server.core.media_cache): a job for content
+  already rendered with the same voice and render settings returns the cached
+  video_url without calling the LLM.
+- At most MEDIA_VIDEO_CONCURRENCY videos render at once per API process; further
+  "media.video" jobs stay queued.
+- Progress: 10% once the script exists, then TTS up to 40% and encoding up to
+  100%, published through the job's progress.
+- POST /jobs/{job_id}/cancel cancels the handler; the render process is told
+  through a shared event and stops at the next segment or encoded frame.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from server.core import jobs, log, media_cache
+from server.core.jobs import Report
+
+logger = logging.getLogger(__name__)
+
+MEDIA_VIDEO_CONCURRENCY = int(os.getenv("MEDIA_VIDEO_CONCURRENCY", "1"))
+
+# (start, end) of the job progress covered by each render stage
+_STAGE_PROGRESS = {"tts": (10, 40), "encode": (40, 100)}
+
+_video_pool: Optional[ProcessPoolExecutor] = None
+_manager = None
+
+
+def _get_video_pool() -> ProcessPoolExecutor:
+    global _video_pool
+    if _video_pool is None:
+        # Workers are forked from the API process: route their log records back to its handlers
+        _video_pool = ProcessPoolExecutor(max_workers=MEDIA_VIDEO_CONCURRENCY,
+                                          initializer=log.configure_worker_logging,
+                                          initargs=(log.worker_queue(),))
+    return _video_pool
+
+
+def _get_manager():
+    # Queues and events handed to pool workers must be manager proxies
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.Manager()
+    return _manager
+
+
+def shutdown():
+    global _video_pool, _manager
+    if _video_pool is not None:
+        _video_pool.shutdown(wait=False, cancel_futures=True)
+        _video_pool = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+
+def _drain(progress) -> Optional[int]:
+    """Maps the latest (stage, fraction) message from the render process to a job percentage."""
+    percent = None
+    while True:
+        try:
+            stage, fraction = progress.get_nowait()
+        except queue.Empty:
+            return percent
+        if stage in _STAGE_PROGRESS:
+            start, end = _STAGE_PROGRESS[stage]
+            percent = int(start + (end - start) * fraction)
+
+
+@jobs.handler("media.video", max_concurrent=MEDIA_VIDEO_CONCURRENCY)
+async def generate_video(db, payload: dict, report: Report) -> dict:
+    from server.agents.media_agent import media
+
+    key = media_cache.video_key(payload["content_markdown"], media.MEDIA_VOICE, media.RENDER_SETTINGS)
+    cached = await media_cache.lookup(db, key)
+    if cached:
+        logger.info("Video served from cache", extra={"topic": payload["topic"], "video_url": cached})
+        return {"video_url": cached, "cached": True}
+
+    agent = media.MediaAgent()
+    started = time.monotonic()
+    try:
+        texts = await asyncio.to_thread(agent.generate_segments, payload["content_markdown"])
+    except Exception:
+        media.record_video(False)
+        raise
+    script_seconds = round(time.monotonic() - started, 2)
+    await report(10)
+
+    manager = _get_manager()
+    progress = manager.Queue()
+    cancel = manager.Event()
+    loop = asyncio.get_running_loop()
+    render_started = time.time()
+    render_id = media_cache.begin_render()
+    future = loop.run_in_executor(
+        _get_video_pool(), media.render_video,
+        payload["topic"], texts, agent.output_dir, progress, cancel, media_cache.video_filename(key),
+        log.request_id_var.get()
+    )
+    last = 10
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=1)
+            percent = await asyncio.to_thread(_drain, progress)
+            if percent is not None and percent > last:
+                last = percent
+                await report(min(percent, 99))
+            if done:
+                break
+        rendered = future.result()
+    except asyncio.CancelledError:
+        # Cancelled through the jobs API (or shutdown): stop the render process too
+        cancel.set()
+        raise
+    except Exception:
+        media.record_video(False)
+        raise
+    finally:
+        # Only once the render has read its narration files
+        await asyncio.to_thread(media_cache.finish_render, render_id)
+
+    media.record_video(True, len(texts), {"script": script_seconds, **rendered["stage_seconds"]},
+                       rendered["tts_cached"])
+    await media_cache.store(db, key, rendered["video_url"], len(texts), render_started)
+    logger.info("Video job finished", extra={"topic": payload["topic"], "video_url": rendered["video_url"]})
+    return {"video_url": rendered["video_url"], "segments": len(texts), "cached": False}
@@ -1,5 +1,5 @@
 
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
 import os
 from dotenv import load_dotenv
 
@@ -7,9 +7,18 @@ load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "educore")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
 
-client = MongoClient(MONGO_URI)
+# Async client used by the FastAPI routes (PyMongo's native asyncio API)
+async_client = AsyncMongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE)
+async_db = async_client[DB_NAME]
+
+# Blocking client for scripts and code running outside the event loop
+client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE)
 db = client[DB_NAME]
 
 def get_database():
+    return async_db
+
+def get_sync_database():
     return db
@@ -2,23 +2,32 @@
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from server import auth, database_mongo, models_mongo
 from server.shared import schemas
+from server.core import analytics, chapters, indexes, jobs, log, metrics, progress, scratch, usage
+from server.core import generation  # also registers the course generation job handlers
+from server.core import videos  # registers the "media.video" job handler
 import logging
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from typing import List, Optional
 
 # Setup Logging
-logging.basicConfig(level=logging.INFO)
+log.configure_logging()
 logger = logging.getLogger(__name__)
 
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import os
+import json
 import shutil
 import uuid
 import hmac
 import hashlib
+import time
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
@@ -42,13 +51,104 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+access_logger = logging.getLogger("server.access")
+
+@app.middleware("http")
+async def request_context(request, call_next):
+    # Tag every log line written while serving this request with one id
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = log.set_request_id(request_id)
+    usage_token = usage.begin(route=f"{request.method} {request.url.path}")
+    start = time.monotonic()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        access_logger.info("%s %s %s", request.method, request.url.path, status_code, extra={
+            "method": request.method,
+            "path": request.url.path,
+            "status": status_code,
+            "duration_ms": round((time.monotonic() - start) * 1000, 1)
+        })
+        usage.end(usage_token)
+        log.reset_request_id(token)
+
 # Dependency
 get_db = database_mongo.get_database
 
+@app.on_event("startup")
+async def ensure_db_indexes():
+    if os.getenv("ENSURE_INDEXES_ON_STARTUP", "1") != "1":
+        return
+    try:
+        for collection, name, status in await indexes.ensure_indexes(database_mongo.get_database()):
+            if status != "ok":
+                logger.warning(f"Index {collection}.{name}: {status}")
+    except Exception as e:
+        # Don't block startup if Mongo is not reachable yet
+        logger.error(f"Index bootstrap failed: {e}")
+
+@app.on_event("startup")
+async def start_job_workers():
+    jobs.start_workers(database_mongo.get_database())
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await jobs.stop_workers(database_mongo.get_database())
+    videos.shutdown()
+
+@app.on_event("startup")
+async def start_scratch_janitor():
+    # Removes scratch directories and partial files of renders that died mid-way
+    scratch.start_janitor()
+
+@app.on_event("shutdown")
+async def stop_scratch_janitor():
+    await scratch.stop_janitor()
+
+@app.on_event("startup")
+async def start_usage_writer():
+    usage.start_writer(database_mongo.get_database())
+
+@app.on_event("shutdown")
+async def stop_usage_writer():
+    # Registered after the job workers, so usage of requeued jobs is flushed too
+    await usage.stop_writer(database_mongo.get_database())
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "EduCore AI Platform is Running with MongoDB"}
 
+@app.get("/metrics")
+async def get_metrics(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Role must be admin")
+    return metrics.snapshot()
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str,
+                         current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+                         db = Depends(get_db)):
+    job = await jobs.get_job(db, job_id)
+    if not job or (job["user_id"] != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.serialize(job)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str,
+                     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+                     db = Depends(get_db)):
+    # A queued job is cancelled at once; a running one stops within JOB_CANCEL_POLL_INTERVAL seconds
+    job = await jobs.get_job(db, job_id)
+    if not job or (job["user_id"] != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] not in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    return jobs.serialize(await jobs.cancel(db, job_id))
+
 # --- Auth Routes ---
 
 @app.post("/upload/video")
@@ -66,7 +166,8 @@ async def upload_video(file: UploadFile = File(...),
     # Upload to Cloudinary
     try:
         # Use resource_type='video' for mp4/webm etc.
-        upload_result = cloudinary.uploader.upload(
+        upload_result = await run_in_threadpool(
+            cloudinary.uploader.upload,
             file.file, 
             resource_type="video",
             public_id=unique_name,
@@ -81,15 +182,23 @@ async def upload_video(file: UploadFile = File(...),
     return {"video_url": video_url, "filename": file.filename}
 
 @app.post("/auth/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db = Depends(get_db)):
-    user = db.users.find_one({"username": form_data.username})
-    if not user or not auth.verify_password(form_data.password, user["hashed_password"]):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db = Depends(get_db)):
+    user = await db.users.find_one({"username": form_data.username})
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await auth.verify_and_update_password(form_data.password, user["hashed_password"])
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Transparently re-hash passwords stored with an older bcrypt cost
+    if new_hash:
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
+        auth.invalidate_user(user["username"])
+    
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user["username"]}, expires_delta=access_token_expires
@@ -97,14 +206,14 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db
     return {"access_token": access_token, "token_type": "bearer", "role": user["role"]}
 
 @app.post("/auth/register", response_model=schemas.UserResponse) # Need to create UserResponse in schemas or models? Using simple dict for now or existing Schema
-def register_user(user: schemas.UserCreate, db = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db = Depends(get_db)):
     # Check if user exists
-    if db.users.find_one({"username": user.username}):
+    if await db.users.find_one({"username": user.username}):
         raise HTTPException(status_code=400, detail="Username already registered")
-    if db.users.find_one({"email": user.email}):
+    if await db.users.find_one({"email": user.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await auth.hash_password(user.password)
     
     user_doc = {
         "username": user.username,
@@ -119,15 +228,24 @@ def register_user(user: schemas.UserCreate, db = Depends(get_db)):
     
     # If organization code provided, find org
     if user.organization_code:
-        org = db.organizations.find_one({"code": user.organization_code})
+        org = await db.organizations.find_one({"code": user.organization_code})
         if org:
             user_doc["organization_id"] = str(org["_id"])
         else:
             # For now, ignore invalid code or raise error?
             pass
 
-    result = db.users.insert_one(user_doc)
-    new_user = db.users.find_one({"_id": result.inserted_id})
+    try:
+        result = await db.users.insert_one(user_doc)
+    except DuplicateKeyError as e:
+        # A concurrent registration got past the checks above; the unique indexes catch it
+        key = (e.details or {}).get("keyPattern", {})
+        if "email" in key:
+            raise HTTPException(status_code=400, detail="Email already registered")
+        if "username" in key:
+            raise HTTPException(status_code=400, detail="Username already registered")
+        raise
+    new_user = await db.users.find_one({"_id": result.inserted_id})
     
     return {
         "id": str(new_user["_id"]),
@@ -138,15 +256,16 @@ def register_user(user: schemas.UserCreate, db = Depends(get_db)):
     }
 
 @app.get("/users/me", response_model=schemas.UserResponse)
-def read_users_me(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
+async def read_users_me(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
     
     # Check if secret_id is missing (legacy users)
     if not current_user.secret_id:
         new_secret_id = f"{current_user.username}-{str(datetime.utcnow().timestamp())[-4:]}".replace(".", "")
-        db.users.update_one(
+        await db.users.update_one(
             {"_id": ObjectId(current_user.id)},
             {"$set": {"secret_id": new_secret_id}}
         )
+        auth.invalidate_user(current_user.username)
         current_user.secret_id = new_secret_id
 
     # Convert UserModel back to response dict if needed, or Pydantic handles it
@@ -162,14 +281,14 @@ def read_users_me(current_user: models_mongo.UserModel = Depends(auth.get_curren
 # --- Parent/Child Linking Routes ---
 
 @app.post("/parent/link-request")
-def request_link(secret_id: str, 
+async def request_link(secret_id: str, 
                  current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                  db = Depends(get_db)):
     
     if current_user.role != "parent":
         raise HTTPException(status_code=403, detail="Only parents can initiate link requests")
         
-    student = db.users.find_one({"secret_id": secret_id, "role": "student"})
+    student = await db.users.find_one({"secret_id": secret_id, "role": "student"})
     if not student:
         raise HTTPException(status_code=404, detail="Student not found with this Secret ID")
         
@@ -178,15 +297,16 @@ def request_link(secret_id: str,
         
     # Add to pending requests if not already there
     if current_user.id not in student.get("pending_parent_requests", []):
-        db.users.update_one(
+        await db.users.update_one(
             {"_id": student["_id"]},
             {"$push": {"pending_parent_requests": current_user.id}}
         )
+        auth.invalidate_user(student["username"])
         
     return {"message": "Link request sent to student"}
 
 @app.get("/student/requests")
-def get_pending_requests(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+async def get_pending_requests(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                          db = Depends(get_db)):
     if current_user.role != "student":
         raise HTTPException(status_code=403, detail="Role must be student")
@@ -194,14 +314,14 @@ def get_pending_requests(current_user: models_mongo.UserModel = Depends(auth.get
     pending_ids = current_user.pending_parent_requests
     requests = []
     for pid in pending_ids:
-        parent = db.users.find_one({"_id": ObjectId(pid)})
+        parent = await db.users.find_one({"_id": ObjectId(pid)})
         if parent:
             requests.append({"id": str(parent["_id"]), "username": parent["username"], "email": parent["email"]})
             
     return requests
 
 @app.post("/student/approve-request")
-def approve_request(parent_id: str,
+async def approve_request(parent_id: str,
                     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                     db = Depends(get_db)):
     
@@ -212,13 +332,14 @@ def approve_request(parent_id: str,
          raise HTTPException(status_code=404, detail="Request not found")
          
     # Link parent and clear requests
-    db.users.update_one(
+    await db.users.update_one(
         {"_id": ObjectId(current_user.id)},
         {"$set": {
             "parent_id": parent_id,
             "pending_parent_requests": [] 
         }}
     )
+    auth.invalidate_user(current_user.username)
     
     # Also verify parent exists? Yes.
     
@@ -227,14 +348,14 @@ def approve_request(parent_id: str,
 # --- Parent Dashboard Routes ---
 
 @app.get("/parent/children")
-def get_my_children(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+async def get_my_children(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                     db = Depends(get_db)):
     if current_user.role != "parent":
         raise HTTPException(status_code=403, detail="Role must be parent")
         
     children_cursor = db.users.find({"parent_id": current_user.id})
     children = []
-    for child in children_cursor:
+    async for child in children_cursor:
         children.append({
             "id": str(child["_id"]),
             "username": child["username"],
@@ -243,23 +364,29 @@ def get_my_children(current_user: models_mongo.UserModel = Depends(auth.get_curr
     return children
 
 @app.get("/parent/child/{child_id}/progress")
-def get_child_progress(child_id: str,
+async def get_child_progress(child_id: str,
                        current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                        db = Depends(get_db)):
     
     # Verify child belongs to parent
-    child = db.users.find_one({"_id": ObjectId(child_id), "parent_id": current_user.id})
+    child = await db.users.find_one({"_id": ObjectId(child_id), "parent_id": current_user.id})
     if not child:
         raise HTTPException(status_code=404, detail="Child not found or not linked")
         
     # Fetch Courses
-    courses_cursor = db.courses.find({"user_id": child_id})
+    child_courses = await db.courses.find({"user_id": child_id}).to_list(None)
+    progress_docs = await progress.get_progress_docs(db, child_id, [str(c["_id"]) for c in child_courses])
     courses = []
-    for c in courses_cursor:
+    courses_completed = 0
+    for c in child_courses:
+        course_progress = progress.progress_percent(progress_docs.get(str(c["_id"])))
+        if course_progress >= 100:
+            courses_completed += 1
         courses.append({
             "topic": c["topic"],
             "grade_level": c["grade_level"],
-            "status": "Active" # Mock
+            "status": "Completed" if course_progress >= 100 else "Active",
+            "progress": round(course_progress, 1)
         })
         
     # Fetch Quiz Results
@@ -268,7 +395,7 @@ def get_child_progress(child_id: str,
     total_score = 0
     quiz_count = 0
     
-    for q in quizzes_cursor:
+    async for q in quizzes_cursor:
         recent_quizzes.append({
             "score": q["score"],
             "total": q["total_questions"],
@@ -276,8 +403,12 @@ def get_child_progress(child_id: str,
             # Fetch Chapter Title?
             "chapter_id": q["chapter_id"]
         })
-        total_score += (q["score"] / q["total_questions"]) * 100
-        quiz_count += 1
+        
+    # Average over every chapter score kept in course_progress
+    for doc in progress_docs.values():
+        for score in doc.get("chapter_scores", {}).values():
+            total_score += score
+            quiz_count += 1
         
     avg_score = int(total_score / quiz_count) if quiz_count > 0 else 0
     
@@ -285,13 +416,13 @@ def get_child_progress(child_id: str,
         "courses": courses,
         "recent_quizzes": recent_quizzes,
         "average_score": avg_score,
-        "courses_completed": len(courses) # Approximation
+        "courses_completed": courses_completed
     }
 
 # --- Actions (Message, etc) ---
 
-@app.post("/courses/generate-for-child")
-def generate_course_for_child(request: schemas.CourseRequest, 
+@app.post("/courses/generate-for-child", status_code=status.HTTP_202_ACCEPTED)
+async def generate_course_for_child(request: schemas.CourseRequest, 
                               child_id: str, # passed as query param or body? Let's use Query for simplicity or update schema. 
                               # Actually schema defines body. Let's add child_id to query param.
                               current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
@@ -300,47 +431,24 @@ def generate_course_for_child(request: schemas.CourseRequest,
     if current_user.role != "parent":
         raise HTTPException(status_code=403, detail="Role must be parent")
         
-    child = db.users.find_one({"_id": ObjectId(child_id), "parent_id": current_user.id})
+    child = await db.users.find_one({"_id": ObjectId(child_id), "parent_id": current_user.id})
     if not child:
         raise HTTPException(status_code=404, detail="Child not found")
         
     # Reuse generation logic but assign to child_id
-    from server.agents.planner_agent.planner import PlannerAgent
-    planner = PlannerAgent()
-    roadmap = planner.generate_roadmap(request.topic, request.grade_level, request.structure_type)
-    
-    if not roadmap:
-         raise HTTPException(status_code=500, detail="Failed to generate roadmap")
-         
-    course_doc = {
+    job_id = await jobs.enqueue(db, "course.generate", {
         "topic": request.topic,
         "grade_level": request.grade_level,
-        "roadmap_json": roadmap.dict(),
         "structure_type": request.structure_type,
-        "is_published": False,
         "user_id": child_id, # Assigned to Child
         "organization_id": child.get("organization_id")
-    }
-    
-    result = db.courses.insert_one(course_doc)
-    
-    for i, chapter in enumerate(roadmap.chapters):
-        chapter_doc = {
-            "chapter_number": chapter.chapter_number,
-            "order_index": i,
-            "title": chapter.title,
-            "description": getattr(chapter, "description", f"Chapter {chapter.chapter_number}: {chapter.title}"),
-            "content_markdown": "",
-            "quiz_json": [],
-            "course_id": str(result.inserted_id)
-        }
-        db.chapters.insert_one(chapter_doc)
+    }, user_id=current_user.id)
         
-    return {"message": "Course assigned to child", "course_id": str(result.inserted_id)}
+    return {"message": "Course generation queued", "job_id": job_id}
 
 
 @app.post("/parent/message")
-def send_message(receiver_id: str, content: str,
+async def send_message(receiver_id: str, content: str,
                  current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                  db = Depends(get_db)):
     
@@ -354,18 +462,18 @@ def send_message(receiver_id: str, content: str,
         "timestamp": datetime.utcnow(),
         "is_read": False
     }
-    db.messages.insert_one(msg)
+    await db.messages.insert_one(msg)
     return {"message": "Message sent"}
 
 @app.get("/student/messages")
-def get_my_messages(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+async def get_my_messages(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                     db = Depends(get_db)):
     
     msgs = db.messages.find({"receiver_id": current_user.id}).sort("timestamp", -1)
     result = []
-    for m in msgs:
+    async for m in msgs:
         # Get sender name
-        sender = db.users.find_one({"_id": ObjectId(m["sender_id"])})
+        sender = await db.users.find_one({"_id": ObjectId(m["sender_id"])})
         sender_name = sender["username"] if sender else "Unknown"
         
         result.append({
@@ -379,117 +487,77 @@ def get_my_messages(current_user: models_mongo.UserModel = Depends(auth.get_curr
 
 # --- Course Routes ---
 
-@app.post("/courses/generate")
-def generate_course(request: schemas.CourseRequest, 
+@app.post("/courses/generate", status_code=status.HTTP_202_ACCEPTED)
+async def generate_course(request: schemas.CourseRequest, 
+                   pregenerate: bool = False,
                    current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                    db = Depends(get_db)):
     
-    # 1. Call Planner Agent (Stubbed/integrated logic)
-    # For MVP, we just create a placeholder course
-    
-    
-    # 1. Call Planner Agent
-    from server.agents.planner_agent.planner import PlannerAgent
-    planner = PlannerAgent()
-    roadmap = planner.generate_roadmap(request.topic, request.grade_level, request.structure_type)
-    
-    if not roadmap:
-        raise HTTPException(status_code=500, detail="Failed to generate roadmap")
-
-    course_doc = {
+    # The planner runs in a job worker; poll GET /jobs/{job_id} for the course_id.
+    # pregenerate=True also writes every chapter's content in the background.
+    job_id = await jobs.enqueue(db, "course.generate", {
         "topic": request.topic,
         "grade_level": request.grade_level,
-        "roadmap_json": roadmap.dict(),
         "structure_type": request.structure_type,
-        "is_published": False,
         "user_id": current_user.id,
-        "organization_id": current_user.organization_id
-    }
-    
-    result = db.courses.insert_one(course_doc)
-    
-    # Create Chapters
-    for i, chapter in enumerate(roadmap.chapters):
-        chapter_doc = {
-            "chapter_number": chapter.chapter_number,
-            "order_index": i,
-            "title": chapter.title,
-            "description": getattr(chapter, "description", f"Chapter {chapter.chapter_number}: {chapter.title}"),
-            "content_markdown": "", # To be generated
-            "quiz_json": [],
-            "course_id": str(result.inserted_id)
-        }
-        db.chapters.insert_one(chapter_doc)
+        "organization_id": current_user.organization_id,
+        "pregenerate": pregenerate,
+        "requested_by": current_user.id
+    }, user_id=current_user.id)
 
-    return {"message": "Course generation started", "course_id": str(result.inserted_id)}
+    return {"message": "Course generation started", "job_id": job_id}
 
 @app.get("/courses", response_model=List[schemas.CourseResponse]) 
-def get_courses(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
-    # If student, return enrolled courses + public courses? 
-    # For MVP, returning all courses created by user
+async def get_courses(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
+    # Courses created by the user + enrolled org courses.
+    # Progress for all of them is computed in a fixed number of batched queries.
+    owned = await db.courses.find({"user_id": current_user.id}, {"topic": 1, "grade_level": 1}).to_list(None)
+    
+    enrolled_ids = [enr["course_id"] async for enr in db.enrollments.find({"user_id": current_user.id}, {"course_id": 1})]
+    enrolled_map = {}
+    if enrolled_ids:
+        async for ec in db.courses.find({"_id": {"$in": [ObjectId(cid) for cid in enrolled_ids]}}, {"topic": 1, "grade_level": 1}):
+            enrolled_map[str(ec["_id"])] = ec
+    
+    course_ids = [str(c["_id"]) for c in owned] + [cid for cid in enrolled_ids if cid in enrolled_map]
+    progress_map = await progress.compute_course_progress(db, current_user.id, list(dict.fromkeys(course_ids)))
     
-    courses_cursor = db.courses.find({"user_id": current_user.id})
     courses = []
-    for c in courses_cursor:
+    for c in owned:
         course_id = str(c["_id"])
-        
-        # Calculate Progress
-        total_chapters = db.chapters.count_documents({"course_id": course_id})
-        
-        # Get unique chapters completed (passed quiz)
-        completed_chapters = len(db.quiz_results.distinct("chapter_id", {
-            "course_id": course_id,
-            "user_id": current_user.id
-        }))
-        
-        progress = 0.0
-        if total_chapters > 0:
-            progress = (completed_chapters / total_chapters) * 100
-
         courses.append({
             "id": course_id,
             "topic": c["topic"],
             "grade_level": c["grade_level"],
             "status": "Ready",
-            "progress": round(progress, 1),
+            "progress": round(progress_map.get(course_id, 0.0), 1),
             "source": "self"
         })
     
-    # Also include enrolled org courses
-    enrollments = db.enrollments.find({"user_id": current_user.id})
-    for enr in enrollments:
-        ec = db.courses.find_one({"_id": ObjectId(enr["course_id"])})
+    for course_id in enrolled_ids:
+        ec = enrolled_map.get(course_id)
         if not ec:
             continue
-        course_id = str(ec["_id"])
-        total_chapters = db.chapters.count_documents({"course_id": course_id})
-        completed_chapters = len(db.quiz_results.distinct("chapter_id", {
-            "course_id": course_id,
-            "user_id": current_user.id
-        }))
-        progress = 0.0
-        if total_chapters > 0:
-            progress = (completed_chapters / total_chapters) * 100
         courses.append({
             "id": course_id,
             "topic": ec["topic"],
             "grade_level": ec["grade_level"],
             "status": "Ready",
-            "progress": round(progress, 1),
+            "progress": round(progress_map.get(course_id, 0.0), 1),
             "source": "enrolled"
         })
 
     return courses
 
 @app.get("/courses/{course_id}")
-def get_course_details(course_id: str, db = Depends(get_db)):
-    course = db.courses.find_one({"_id": ObjectId(course_id)})
+async def get_course_details(course_id: str, db = Depends(get_db)):
+    course = await db.courses.find_one({"_id": ObjectId(course_id)})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
         
     chapters_cursor = db.chapters.find({"course_id": course_id}).sort("order_index", 1)
     chapters = []
-    for ch in chapters_cursor:
+    async for ch in chapters_cursor:
         chapters.append({
             "id": str(ch["_id"]),
             "title": ch["title"],
@@ -507,12 +575,12 @@ def get_course_details(course_id: str, db = Depends(get_db)):
     }
 
 @app.delete("/courses/{course_id}")
-def delete_course(course_id: str,
+async def delete_course(course_id: str,
                   current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                   db = Depends(get_db)):
     
     # Check if course exists and belongs to user
-    course = db.courses.find_one({"_id": ObjectId(course_id)})
+    course = await db.courses.find_one({"_id": ObjectId(course_id)})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
         
@@ -520,42 +588,47 @@ def delete_course(course_id: str,
         raise HTTPException(status_code=403, detail="Not authorized to delete this course")
     
     # Cascading Delete
-    print(f"Deleting course {course_id} for user {current_user.id}")
+    logger.info("Deleting course %s for user %s", course_id, current_user.id)
     
     # 1. Delete Chapters
-    res_chapters = db.chapters.delete_many({"course_id": course_id})
-    print(f"Deleted {res_chapters.deleted_count} chapters")
+    res_chapters = await db.chapters.delete_many({"course_id": course_id})
     
     # 2. Delete Notes related to this course
-    res_notes = db.notes.delete_many({"course_id": course_id})
-    print(f"Deleted {res_notes.deleted_count} notes")
+    res_notes = await db.notes.delete_many({"course_id": course_id})
     
     # 3. Delete Quiz Results related to this course
-    res_quizzes = db.quiz_results.delete_many({"course_id": course_id})
-    print(f"Deleted {res_quizzes.deleted_count} quiz results")
+    res_quizzes = await db.quiz_results.delete_many({"course_id": course_id})
+    
+    # 3b. Delete materialized progress
+    await progress.delete_course(db, course_id)
     
     # 4. Delete the Course itself
-    res_course = db.courses.delete_one({"_id": ObjectId(course_id)})
-    print(f"Deleted {res_course.deleted_count} courses (ObjectId)")
+    res_course = await db.courses.delete_one({"_id": ObjectId(course_id)})
     
     deleted_count = res_course.deleted_count
     method = "ObjectId"
 
     if deleted_count == 0:
-        print(f"WARNING: Course {course_id} was NOT deleted from DB with ObjectId!")
+        logger.warning("Course %s was not deleted by ObjectId, retrying with string id", course_id)
         # Try string ID just in case (legacy data?)
-        res_course_str = db.courses.delete_one({"_id": course_id})
-        print(f"Deleted {res_course_str.deleted_count} courses (String ID)")
+        res_course_str = await db.courses.delete_one({"_id": course_id})
         if res_course_str.deleted_count > 0:
             deleted_count = res_course_str.deleted_count
             method = "String ID"
         else:
             # Check if it still exists
-            check = db.courses.find_one({"_id": ObjectId(course_id)})
+            check = await db.courses.find_one({"_id": ObjectId(course_id)})
             if check:
-                print(f"Course still exists: {check['_id']}")
+                logger.error("Course %s still exists after delete", course_id)
             else:
-                print("Course not found after delete_one (maybe already gone?)")
+                logger.warning("Course %s not found after delete_one (maybe already gone?)", course_id)
+    
+    logger.info("Deleted course %s", course_id, extra={
+        "deleted_chapters": res_chapters.deleted_count,
+        "deleted_notes": res_notes.deleted_count,
+        "deleted_quizzes": res_quizzes.deleted_count,
+        "deleted_course_count": deleted_count
+    })
     
     return {
         "message": "Course deletion attempted",
@@ -567,12 +640,12 @@ def delete_course(course_id: str,
     }
 
 @app.post("/courses/{course_id}/chapters/{chapter_id}/generate")
-def generate_chapter_content(course_id: str, chapter_id: str, 
+async def generate_chapter_content(course_id: str, chapter_id: str, 
                              force: bool = False,
                              current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                              db = Depends(get_db)):
     
-    chapter = db.chapters.find_one({"_id": ObjectId(chapter_id), "course_id": course_id})
+    chapter = await db.chapters.find_one({"_id": ObjectId(chapter_id), "course_id": course_id})
     if not chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
         
@@ -584,36 +657,75 @@ def generate_chapter_content(course_id: str, chapter_id: str,
              "quiz": chapter.get("quiz_json", [])
          }
 
-    from server.agents.content_agent.content import ContentAgent
-    content_agent = ContentAgent()
+    # force=True means the user wants a fresh generation, not the cached one
+    generated = await chapters.generate_chapter(db, chapter, force)
     
-    # Create simple Chapter object for agent
-    chapter_obj = schemas.Chapter(
-        chapter_number=chapter["chapter_number"],
-        title=chapter["title"],
-        description=chapter.get("description", f"Chapter {chapter['chapter_number']}")
-    )
-    
-    generated_content = content_agent.generate_chapter_content(chapter_obj)
-    
-    if not generated_content:
+    if not generated:
         raise HTTPException(status_code=500, detail="Failed to generate content")
-        
-    # Update Chapter in DB
-    quiz_data = [q.dict() for q in generated_content.quiz]
-    db.chapters.update_one(
-        {"_id": ObjectId(chapter_id)},
-        {"$set": {
-            "content_markdown": generated_content.content_markdown,
-            "quiz_json": quiz_data
-        }}
-    )
     
-    return {
-        "message": "Content generated successfully", 
-        "content_markdown": generated_content.content_markdown,
-        "quiz": quiz_data
-    }
+    return {"message": "Content generated successfully", **generated}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/courses/{course_id}/chapters/{chapter_id}/generate/stream")
+async def stream_chapter_content(course_id: str, chapter_id: str,
+                                 force: bool = False,
+                                 current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+                                 db = Depends(get_db)):
+    """
+    Server-Sent Events variant of generate_chapter_content.
+
+    Emits `token` events ({"text": ...}) as slides are written, then a single
+    `done` event ({"content_markdown", "quiz"}) once the chapter has been saved,
+    or an `error` event ({"detail": ...}).
+    """
+    chapter = await db.chapters.find_one({"_id": ObjectId(chapter_id), "course_id": course_id})
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+
+    async def events():
+        if chapter.get("content_markdown") and not force:
+            yield _sse("done", {"content_markdown": chapter["content_markdown"], "quiz": chapter.get("quiz_json", [])})
+            return
+
+        from server.agents.content_agent.content import ContentAgent
+        tokens = asyncio.Queue()
+
+        async def produce():
+            generated_content = None
+            async for kind, value in ContentAgent().stream_chapter_content(chapters.to_schema(chapter), bypass_cache=force):
+                if kind == "token":
+                    tokens.put_nowait(value)
+                else:
+                    generated_content = value
+            if not generated_content:
+                return None
+            return await chapters.save_content(db, chapter_id, generated_content)
+
+        # If this chapter is already being generated we just wait for it (no tokens).
+        # The task is not tied to this response, so a disconnecting client does not
+        # throw away a generation other callers may be sharing.
+        generation = asyncio.create_task(chapters.single_flight(db, chapter, force, produce))
+        generation.add_done_callback(lambda _: tokens.put_nowait(None))
+        while (text := await tokens.get()) is not None:
+            yield _sse("token", {"text": text})
+
+        try:
+            generated = generation.result()
+        except Exception as e:
+            logger.error(f"Streaming generation failed for chapter {chapter_id}: {e}")
+            generated = None
+
+        if not generated:
+            yield _sse("error", {"detail": "Failed to generate content"})
+            return
+
+        yield _sse("done", generated)
+
+    # X-Accel-Buffering stops nginx-style proxies from holding the stream back
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # --- Video Generation Route ---
 class VideoRequest(BaseModel):
@@ -621,36 +733,25 @@ class VideoRequest(BaseModel):
     content_markdown: str
     chapter_title: str
 
-@app.post("/generate/video")
-async def generate_video_summary(request: VideoRequest, current_user: models_mongo.UserModel = Depends(auth.get_current_active_user)):
-    try:
-        from server.agents.media_agent.media import MediaAgent
-        media_agent = MediaAgent()
-        
-        # Correctly calling the async method generate_video
-        video_path = await media_agent.generate_video(
-            topic=request.topic,
-            content_markdown=request.content_markdown
-        )
-        
-        if not video_path:
-             raise HTTPException(status_code=500, detail="Video generation failed")
-             
-        # video_path is returning a relative path like "/static/videos/..." from the agent.
-        
-        return {"video_url": video_path}
-        
-    except Exception as e:
-        print(f"Video Generation Error: {e}")
-        # import traceback
-        # traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/generate/video", status_code=status.HTTP_202_ACCEPTED)
+async def generate_video_summary(request: VideoRequest,
+                                 current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+                                 db = Depends(get_db)):
+    # Rendering runs in the video process pool; poll GET /jobs/{job_id} for the video_url
+    # (a relative path like "/static/videos/..."), or cancel with POST /jobs/{job_id}/cancel.
+    job_id = await jobs.enqueue(db, "media.video", {
+        "topic": request.topic,
+        "content_markdown": request.content_markdown,
+        "chapter_title": request.chapter_title,
+        "requested_by": current_user.id
+    }, user_id=current_user.id)
+    return {"message": "Video generation started", "job_id": job_id}
 
 
 # --- Note Routes ---
 @app.post("/notes", response_model=schemas.NoteResponse)
 @app.post("/notes", response_model=schemas.NoteResponse)
-def create_note(note: schemas.NoteRequest,
+async def create_note(note: schemas.NoteRequest,
                 current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                 db = Depends(get_db)):
     
@@ -659,12 +760,12 @@ def create_note(note: schemas.NoteRequest,
     chapter_title = ""
     
     if note.course_id:
-        course = db.courses.find_one({"_id": ObjectId(note.course_id)})
+        course = await db.courses.find_one({"_id": ObjectId(note.course_id)})
         if course:
             course_topic = course["topic"]
             
     if note.chapter_id:
-        chapter = db.chapters.find_one({"_id": ObjectId(note.chapter_id)})
+        chapter = await db.chapters.find_one({"_id": ObjectId(note.chapter_id)})
         if chapter:
             chapter_title = chapter["title"]
 
@@ -682,7 +783,7 @@ def create_note(note: schemas.NoteRequest,
         "updated_at": datetime.utcnow().isoformat()
     }
     
-    result = db.notes.insert_one(note_doc)
+    result = await db.notes.insert_one(note_doc)
     
     return {
         "id": str(result.inserted_id),
@@ -699,7 +800,7 @@ def create_note(note: schemas.NoteRequest,
     }
 
 @app.get("/notes", response_model=List[schemas.NoteResponse])
-def get_notes(course_id: Optional[str] = None,
+async def get_notes(course_id: Optional[str] = None,
               chapter_id: Optional[str] = None,
               current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
               db = Depends(get_db)):
@@ -713,7 +814,7 @@ def get_notes(course_id: Optional[str] = None,
     notes_cursor = db.notes.find(filter_query).sort("updated_at", -1)
     notes = []
     
-    for n in notes_cursor:
+    async for n in notes_cursor:
         # Backward compatibility for old notes without title/type
         notes.append({
             "id": str(n["_id"]),
@@ -732,19 +833,19 @@ def get_notes(course_id: Optional[str] = None,
     return notes
 
 @app.delete("/notes/{note_id}")
-def delete_note(note_id: str,
+async def delete_note(note_id: str,
                 current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                 db = Depends(get_db)):
     
     # Check if note exists and belongs to user
-    note = db.notes.find_one({"_id": ObjectId(note_id)})
+    note = await db.notes.find_one({"_id": ObjectId(note_id)})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
     if note["user_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this note")
         
-    db.notes.delete_one({"_id": ObjectId(note_id)})
+    await db.notes.delete_one({"_id": ObjectId(note_id)})
     
     return {"message": "Note deleted successfully"}
 
@@ -756,12 +857,12 @@ def delete_note(note_id: str,
 # --- Quiz Routes ---
 
 @app.post("/quizzes/submit", response_model=schemas.QuizResultResponse)
-def submit_quiz(submission: schemas.QuizSubmission, 
+async def submit_quiz(submission: schemas.QuizSubmission, 
                 current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                 db = Depends(get_db)):
     
     # Check if already submitted
-    existing = db.quiz_results.find_one({
+    existing = await db.quiz_results.find_one({
         "user_id": current_user.id,
         "chapter_id": submission.chapter_id
     })
@@ -770,7 +871,7 @@ def submit_quiz(submission: schemas.QuizSubmission,
         raise HTTPException(status_code=400, detail="You have already engaged in this quiz. One attempt only!")
 
     # Fetch chapter to get correct answers
-    chapter = db.chapters.find_one({"_id": ObjectId(submission.chapter_id)})
+    chapter = await db.chapters.find_one({"_id": ObjectId(submission.chapter_id)})
     if not chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
         
@@ -805,11 +906,12 @@ def submit_quiz(submission: schemas.QuizSubmission,
             "is_correct": is_correct
         })
 
-    # Create Result Record
+    # Create Result Record, attributed to the chapter's own course rather than the client's claim
+    course_id = chapter["course_id"]
     result_doc = {
         "user_id": current_user.id,
         "chapter_id": submission.chapter_id,
-        "course_id": submission.course_id,
+        "course_id": course_id,
         "score": score,
         "total_questions": total_questions,
         "answers": submission.answers,
@@ -817,7 +919,12 @@ def submit_quiz(submission: schemas.QuizSubmission,
         "timestamp": datetime.utcnow()
     }
     
-    res = db.quiz_results.insert_one(result_doc)
+    try:
+        res = await db.quiz_results.insert_one(result_doc)
+    except DuplicateKeyError:
+        # Concurrent double submit caught by the unique (user_id, chapter_id) index
+        raise HTTPException(status_code=400, detail="You have already engaged in this quiz. One attempt only!")
+    await progress.record_quiz_result(db, current_user.id, course_id, submission.chapter_id, score, total_questions)
     
     return {
         "id": str(res.inserted_id),
@@ -829,11 +936,11 @@ def submit_quiz(submission: schemas.QuizSubmission,
     }
 
 @app.get("/quizzes/{chapter_id}/result", response_model=schemas.QuizResultResponse)
-def get_quiz_result(chapter_id: str, 
+async def get_quiz_result(chapter_id: str, 
                     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                     db = Depends(get_db)):
     
-    result = db.quiz_results.find_one({
+    result = await db.quiz_results.find_one({
         "user_id": current_user.id,
         "chapter_id": chapter_id
     })
@@ -854,13 +961,13 @@ def get_quiz_result(chapter_id: str,
 # --- Organization Dashboard Routes ---
 
 @app.post("/upload/cover/{course_id}")
-def upload_cover_image(course_id: str, file: UploadFile = File(...),
+async def upload_cover_image(course_id: str, file: UploadFile = File(...),
                        current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                        db = Depends(get_db)):
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Role must be organization")
     
-    course = db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
@@ -873,7 +980,8 @@ def upload_cover_image(course_id: str, file: UploadFile = File(...),
     unique_name = f"cover_{course_id}_{uuid.uuid4().hex[:8]}"
     
     try:
-        upload_result = cloudinary.uploader.upload(
+        upload_result = await run_in_threadpool(
+            cloudinary.uploader.upload,
             file.file,
             public_id=unique_name,
             folder="educore/covers"
@@ -884,19 +992,19 @@ def upload_cover_image(course_id: str, file: UploadFile = File(...),
     finally:
         file.file.close()
     
-    db.courses.update_one({"_id": ObjectId(course_id)}, {"$set": {"thumbnail_url": url_path}})
+    await db.courses.update_one({"_id": ObjectId(course_id)}, {"$set": {"thumbnail_url": url_path}})
     
     return {"message": "Cover uploaded", "thumbnail_url": url_path}
 
 @app.get("/org/courses")
-def get_org_courses(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
+async def get_org_courses(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
     if current_user.role != "organization":
          raise HTTPException(status_code=403, detail="Role must be organization")
          
     # Fetch courses created by this org user
     courses_cursor = db.courses.find({"user_id": current_user.id})
     courses = []
-    for c in courses_cursor:
+    async for c in courses_cursor:
         courses.append({
             "id": str(c["_id"]),
             "topic": c["topic"],
@@ -909,15 +1017,12 @@ def get_org_courses(current_user: models_mongo.UserModel = Depends(auth.get_curr
     return courses
 
 @app.post("/org/courses/create")
-def create_org_course(course_data: schemas.OrgCourseCreate, 
+async def create_org_course(course_data: schemas.OrgCourseCreate, 
                       current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                       db = Depends(get_db)):
     try:
-        print(f"[CREATE_COURSE] User: {current_user.username}, Role: {current_user.role}")
-        print(f"[CREATE_COURSE] Course Data: {course_data.dict()}")
-        
         if current_user.role != "organization":
-             print(f"[CREATE_COURSE] ERROR: Role check failed. Expected 'organization', got '{current_user.role}'")
+             logger.warning("Org course creation refused for role %s", current_user.role)
              raise HTTPException(status_code=403, detail="Role must be organization")
              
         course_doc = {
@@ -933,69 +1038,99 @@ def create_org_course(course_data: schemas.OrgCourseCreate,
             "roadmap_json": {"topic": course_data.title, "chapters": []} # Empty roadmap initially
         }
         
-        print(f"[CREATE_COURSE] Inserting course doc: {course_doc}")
-        result = db.courses.insert_one(course_doc)
-        print(f"[CREATE_COURSE] Success! Course ID: {str(result.inserted_id)}")
+        result = await db.courses.insert_one(course_doc)
+        logger.info("Org course %s created by %s", result.inserted_id, current_user.username)
         return {"message": "Course created", "course_id": str(result.inserted_id)}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[CREATE_COURSE] EXCEPTION: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Org course creation failed")
         raise HTTPException(status_code=500, detail=f"Course creation failed: {str(e)}")
 
-@app.post("/org/courses/{course_id}/plan")
-def plan_org_course(course_id: str, request: schemas.CourseRequest,
+@app.post("/org/courses/batch", status_code=status.HTTP_202_ACCEPTED)
+async def create_org_courses_batch(batch: schemas.OrgCourseBatchCreate,
+                                   pregenerate: bool = False,
+                                   current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+                                   db = Depends(get_db)):
+    """
+    Creates many org courses at once and plans their roadmaps in one background job.
+    Poll GET /jobs/{job_id}: its result lists the status of every course.
+    """
+    if current_user.role != "organization":
+         raise HTTPException(status_code=403, detail="Role must be organization")
+    if not batch.courses:
+        raise HTTPException(status_code=400, detail="No courses given")
+    if len(batch.courses) > generation.ORG_BATCH_MAX_COURSES:
+        raise HTTPException(status_code=400, detail=f"At most {generation.ORG_BATCH_MAX_COURSES} courses per batch")
+
+    course_docs = [
+        {
+            "topic": course.title, # Mapping title to topic
+            "grade_level": course.grade_level,
+            "description": course.description,
+            "structure_type": course.structure_type,
+            "price": course.price,
+            "thumbnail_url": course.thumbnail_url or "",
+            "is_published": False,
+            "user_id": current_user.id,
+            "organization_id": current_user.organization_id,
+            "roadmap_json": {"topic": course.title, "chapters": []},
+            "planning_status": "queued"
+        }
+        for course in batch.courses
+    ]
+    result = await db.courses.insert_many(course_docs)
+    course_ids = [str(inserted_id) for inserted_id in result.inserted_ids]
+
+    job_id = await jobs.enqueue(db, "course.plan_batch", {
+        "courses": [
+            {
+                "course_id": course_id,
+                "topic": course.title,
+                "grade_level": course.grade_level,
+                "structure_type": course.structure_type
+            }
+            for course_id, course in zip(course_ids, batch.courses)
+        ],
+        "pregenerate": pregenerate,
+        "requested_by": current_user.id
+    }, user_id=current_user.id)
+
+    logger.info("Org course batch of %d queued", len(course_ids), extra={"job_id": job_id})
+    return {"message": "Course batch planning queued", "job_id": job_id, "course_ids": course_ids}
+
+@app.post("/org/courses/{course_id}/plan", status_code=status.HTTP_202_ACCEPTED)
+async def plan_org_course(course_id: str, request: schemas.CourseRequest,
+                    pregenerate: bool = False,
                     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                     db = Depends(get_db)):
     if current_user.role != "organization":
          raise HTTPException(status_code=403, detail="Role must be organization")
          
     # Verify ownership
-    course = db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
 
-    from server.agents.planner_agent.planner import PlannerAgent
-    planner = PlannerAgent()
-    roadmap = planner.generate_roadmap(request.topic, request.grade_level, request.structure_type)
-    
-    if not roadmap:
-         raise HTTPException(status_code=500, detail="Failed to generate roadmap")
+    job_id = await jobs.enqueue(db, "course.plan", {
+        "course_id": course_id,
+        "topic": request.topic,
+        "grade_level": request.grade_level,
+        "structure_type": request.structure_type,
+        "pregenerate": pregenerate,
+        "requested_by": current_user.id
+    }, user_id=current_user.id)
 
-    # Update Course
-    db.courses.update_one(
-        {"_id": ObjectId(course_id)},
-        {"$set": {"roadmap_json": roadmap.dict()}}
-    )
-    
-    # Create/Overwrite Chapters
-    # First delete existing (simple approach for MVP re-planning)
-    db.chapters.delete_many({"course_id": course_id})
-    
-    for i, chapter in enumerate(roadmap.chapters):
-        chapter_doc = {
-            "chapter_number": chapter.chapter_number,
-            "order_index": i,
-            "title": chapter.title,
-            "description": getattr(chapter, "description", f"Chapter {chapter.chapter_number}: {chapter.title}"),
-            "content_markdown": "",
-            "quiz_json": [],
-            "course_id": course_id
-        }
-        db.chapters.insert_one(chapter_doc)
-        
-    return roadmap.dict()
+    return {"message": "Course planning queued", "job_id": job_id}
 
 @app.get("/org/courses/{course_id}/modules/{module_id}")
-def get_module_details(course_id: str, module_id: str,
+async def get_module_details(course_id: str, module_id: str,
                        current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                        db = Depends(get_db)):
     if current_user.role != "organization":
          raise HTTPException(status_code=403, detail="Role must be organization")
          
-    chapter = db.chapters.find_one({"_id": ObjectId(module_id), "course_id": course_id})
+    chapter = await db.chapters.find_one({"_id": ObjectId(module_id), "course_id": course_id})
     if not chapter:
         raise HTTPException(status_code=404, detail="Module not found")
         
@@ -1008,7 +1143,7 @@ def get_module_details(course_id: str, module_id: str,
     }
 
 @app.put("/org/courses/{course_id}/modules/{module_id}")
-def update_module_content(course_id: str, module_id: str, update_data: schemas.ModuleContentUpdate,
+async def update_module_content(course_id: str, module_id: str, update_data: schemas.ModuleContentUpdate,
                           current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                           db = Depends(get_db)):
     if current_user.role != "organization":
@@ -1027,7 +1162,7 @@ def update_module_content(course_id: str, module_id: str, update_data: schemas.M
     if not update_fields:
         return {"message": "No changes provided"}
 
-    result = db.chapters.update_one(
+    result = await db.chapters.update_one(
         {"_id": ObjectId(module_id), "course_id": course_id},
         {"$set": update_fields}
     )
@@ -1038,14 +1173,14 @@ def update_module_content(course_id: str, module_id: str, update_data: schemas.M
     return {"message": "Module updated"}
 
 @app.post("/org/courses/{course_id}/modules")
-def add_module(course_id: str, module_data: schemas.OrgModuleCreate,
+async def add_module(course_id: str, module_data: schemas.OrgModuleCreate,
                current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                db = Depends(get_db)):
     if current_user.role != "organization":
          raise HTTPException(status_code=403, detail="Role must be organization")
          
     # Get next chapter number
-    last = db.chapters.find_one({"course_id": course_id}, sort=[("chapter_number", -1)])
+    last = await db.chapters.find_one({"course_id": course_id}, sort=[("chapter_number", -1)])
     next_num = (last["chapter_number"] + 1) if last else 1
 
     chapter_doc = {
@@ -1057,23 +1192,25 @@ def add_module(course_id: str, module_data: schemas.OrgModuleCreate,
         "quiz_json": [],
         "course_id": course_id
     }
-    db.chapters.insert_one(chapter_doc)
+    await db.chapters.insert_one(chapter_doc)
+    await progress.sync_chapter_total(db, course_id)
     return {"message": "Module added"}
 
 @app.delete("/org/courses/{course_id}/modules/{module_id}")
-def delete_module(course_id: str, module_id: str,
+async def delete_module(course_id: str, module_id: str,
                  current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                  db = Depends(get_db)):
     if current_user.role != "organization":
          raise HTTPException(status_code=403, detail="Role must be organization")
          
-    result = db.chapters.delete_one({"_id": ObjectId(module_id), "course_id": course_id})
+    result = await db.chapters.delete_one({"_id": ObjectId(module_id), "course_id": course_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Module not found")
+    await progress.remove_chapter(db, course_id, module_id)
     return {"message": "Module deleted"}
 
 @app.get("/org/students")
-def get_org_students(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+async def get_org_students(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                      db = Depends(get_db)):
     if current_user.role != "organization":
          raise HTTPException(status_code=403, detail="Role must be organization")
@@ -1090,7 +1227,7 @@ def get_org_students(current_user: models_mongo.UserModel = Depends(auth.get_cur
     students_cursor = db.users.find({"role": "student"})
     enrollments = []
     
-    for s in students_cursor:
+    async for s in students_cursor:
         # Check enrollments (mock: assume enrolled in 1 course)
         enrollments.append({
             "student_name": s["username"],
@@ -1105,14 +1242,14 @@ def get_org_students(current_user: models_mongo.UserModel = Depends(auth.get_cur
 
 # Cert logos/backgrounds directory (handled by Cloudinary)
 @app.post("/org/courses/{course_id}/certificate-template")
-def save_certificate_template(course_id: str, 
+async def save_certificate_template(course_id: str, 
                                template: schemas.CertificateTemplateUpdate,
                                current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                                db = Depends(get_db)):
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Role must be organization")
     
-    course = db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
@@ -1121,7 +1258,7 @@ def save_certificate_template(course_id: str,
     template_data["org_id"] = current_user.id
     
     # Upsert: update if exists, create if not
-    db.certificate_templates.update_one(
+    await db.certificate_templates.update_one(
         {"course_id": course_id},
         {"$set": template_data},
         upsert=True
@@ -1129,10 +1266,10 @@ def save_certificate_template(course_id: str,
     return {"message": "Certificate template saved"}
 
 @app.get("/org/courses/{course_id}/certificate-template")
-def get_certificate_template(course_id: str,
+async def get_certificate_template(course_id: str,
                               current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                               db = Depends(get_db)):
-    template = db.certificate_templates.find_one({"course_id": course_id})
+    template = await db.certificate_templates.find_one({"course_id": course_id})
     if not template:
         # Return defaults
         return {
@@ -1160,7 +1297,7 @@ def get_certificate_template(course_id: str,
     }
 
 @app.post("/upload/cert-logo/{course_id}")
-def upload_cert_logo(course_id: str, file: UploadFile = File(...),
+async def upload_cert_logo(course_id: str, file: UploadFile = File(...),
                      current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                      db = Depends(get_db)):
     if current_user.role != "organization":
@@ -1174,7 +1311,8 @@ def upload_cert_logo(course_id: str, file: UploadFile = File(...),
     unique_name = f"logo_{course_id}_{uuid.uuid4().hex[:8]}"
     
     try:
-        upload_result = cloudinary.uploader.upload(
+        upload_result = await run_in_threadpool(
+            cloudinary.uploader.upload,
             file.file,
             public_id=unique_name,
             folder="educore/cert_assets"
@@ -1185,7 +1323,7 @@ def upload_cert_logo(course_id: str, file: UploadFile = File(...),
     finally:
         file.file.close()
     
-    db.certificate_templates.update_one(
+    await db.certificate_templates.update_one(
         {"course_id": course_id},
         {"$set": {"logo_url": url_path, "course_id": course_id, "org_id": current_user.id}},
         upsert=True
@@ -1193,7 +1331,7 @@ def upload_cert_logo(course_id: str, file: UploadFile = File(...),
     return {"message": "Logo uploaded", "logo_url": url_path}
 
 @app.post("/upload/cert-template/{course_id}")
-def upload_cert_bg(course_id: str, file: UploadFile = File(...),
+async def upload_cert_bg(course_id: str, file: UploadFile = File(...),
                    current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                    db = Depends(get_db)):
     if current_user.role != "organization":
@@ -1207,7 +1345,8 @@ def upload_cert_bg(course_id: str, file: UploadFile = File(...),
     unique_name = f"certbg_{course_id}_{uuid.uuid4().hex[:8]}"
 
     try:
-        upload_result = cloudinary.uploader.upload(
+        upload_result = await run_in_threadpool(
+            cloudinary.uploader.upload,
             file.file,
             public_id=unique_name,
             folder="educore/cert_assets"
@@ -1218,7 +1357,7 @@ def upload_cert_bg(course_id: str, file: UploadFile = File(...),
     finally:
         file.file.close()
     
-    db.certificate_templates.update_one(
+    await db.certificate_templates.update_one(
         {"course_id": course_id},
         {"$set": {"custom_bg_url": url_path, "course_id": course_id, "org_id": current_user.id}},
         upsert=True
@@ -1229,19 +1368,19 @@ def upload_cert_bg(course_id: str, file: UploadFile = File(...),
 # --- Final Exam Endpoints ---
 
 @app.post("/org/courses/{course_id}/exam-config")
-def save_exam_config(course_id: str, config: schemas.ExamConfig,
+async def save_exam_config(course_id: str, config: schemas.ExamConfig,
                      current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                      db = Depends(get_db)):
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Role must be organization")
     
-    course = db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
     # Save exam config embedded in course or separate collection?
     # Separate collection is cleaner for grading logic
-    db.exams.update_one(
+    await db.exams.update_one(
         {"course_id": course_id},
         {"$set": {
             "course_id": course_id,
@@ -1253,30 +1392,30 @@ def save_exam_config(course_id: str, config: schemas.ExamConfig,
     return {"message": "Exam configuration saved"}
 
 @app.get("/org/courses/{course_id}/exam-config")
-def get_exam_config_org(course_id: str,
+async def get_exam_config_org(course_id: str,
                         current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                         db = Depends(get_db)):
     # Allow org to see full config including answers
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Role must be organization")
         
-    exam = db.exams.find_one({"course_id": course_id})
+    exam = await db.exams.find_one({"course_id": course_id})
     if not exam:
         return {"enabled": False, "questions": []}
     
     return exam["config"]
 
 @app.get("/courses/{course_id}/exam")
-def get_student_exam(course_id: str,
+async def get_student_exam(course_id: str,
                      current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                      db = Depends(get_db)):
     # For students: hide correct answers
-    exam = db.exams.find_one({"course_id": course_id})
+    exam = await db.exams.find_one({"course_id": course_id})
     if not exam or not exam["config"].get("enabled", False):
         raise HTTPException(status_code=404, detail="No final exam for this course")
         
     # Check attempts
-    attempts = db.exam_results.count_documents({
+    attempts = await db.exam_results.count_documents({
         "course_id": course_id, 
         "user_id": current_user.id
     })
@@ -1304,11 +1443,11 @@ def get_student_exam(course_id: str,
     }
 
 @app.post("/courses/{course_id}/exam/submit")
-def submit_exam(course_id: str, submission: schemas.ExamSubmission,
+async def submit_exam(course_id: str, submission: schemas.ExamSubmission,
                 current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                 db = Depends(get_db)):
     try:
-        exam = db.exams.find_one({"course_id": course_id})
+        exam = await db.exams.find_one({"course_id": course_id})
         if not exam:
             raise HTTPException(status_code=404, detail="Exam not found")
         
@@ -1317,10 +1456,10 @@ def submit_exam(course_id: str, submission: schemas.ExamSubmission,
             raise HTTPException(status_code=400, detail="Exam is disabled")
             
         # Check max attempts
-        attempts = db.exam_results.count_documents({"course_id": course_id, "user_id": current_user.id})
+        attempts = await db.exam_results.count_documents({"course_id": course_id, "user_id": current_user.id})
         
         # Check if already passed
-        passed_check = db.exam_results.find_one({"course_id": course_id, "user_id": current_user.id, "passed": True})
+        passed_check = await db.exam_results.find_one({"course_id": course_id, "user_id": current_user.id, "passed": True})
         if passed_check:
             raise HTTPException(status_code=400, detail="You have already passed this exam")
             
@@ -1399,7 +1538,8 @@ def submit_exam(course_id: str, submission: schemas.ExamSubmission,
             "timestamp": datetime.utcnow().isoformat()
         }
         
-        db.exam_results.insert_one(result_doc)
+        await db.exam_results.insert_one(result_doc)
+        await progress.record_exam_result(db, current_user.id, course_id, percentage, passed)
         
         return {
             "score": total_score,
@@ -1413,15 +1553,14 @@ def submit_exam(course_id: str, submission: schemas.ExamSubmission,
             "timestamp": result_doc["timestamp"]
         }
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Exam submission failed", extra={"course_id": course_id})
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/courses/{course_id}/exam/result")
-def get_last_exam_result(course_id: str,
+async def get_last_exam_result(course_id: str,
                          current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                          db = Depends(get_db)):
-    result = db.exam_results.find_one(
+    result = await db.exam_results.find_one(
         {"course_id": course_id, "user_id": current_user.id},
         sort=[("timestamp", -1)]
     )
@@ -1434,17 +1573,17 @@ def get_last_exam_result(course_id: str,
     return result
 
 @app.get("/courses/{course_id}/certificate/check")
-def check_certificate_eligibility(course_id: str,
+async def check_certificate_eligibility(course_id: str,
                                    current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                                    db = Depends(get_db)):
     """Check if student has completed all quizzes AND passed exam if enabled."""
-    total_chapters = db.chapters.count_documents({"course_id": course_id})
-    
-    # Quiz completion
-    completed_quizzes = len(db.quiz_results.distinct("chapter_id", {
-        "course_id": course_id,
-        "user_id": current_user.id
-    }))
+    progress_doc = await db.course_progress.find_one({"course_id": course_id, "user_id": current_user.id})
+    if progress_doc:
+        total_chapters = progress_doc.get("total_chapters", 0)
+        completed_quizzes = len(progress_doc.get("completed_chapter_ids", []))
+    else:
+        total_chapters = await db.chapters.count_documents({"course_id": course_id})
+        completed_quizzes = 0
     
     quiz_eligible = True
     if total_chapters > 0:
@@ -1452,15 +1591,10 @@ def check_certificate_eligibility(course_id: str,
         
     # check exam
     exam_eligible = True
-    exam = db.exams.find_one({"course_id": course_id})
+    exam = await db.exams.find_one({"course_id": course_id})
     if exam and exam["config"].get("enabled"):
         # Check if passed
-        passed = db.exam_results.find_one({
-            "course_id": course_id,
-            "user_id": current_user.id,
-            "passed": True
-        })
-        if not passed:
+        if not (progress_doc and progress_doc.get("exam_passed")):
             exam_eligible = False
             
     is_eligible = quiz_eligible and exam_eligible
@@ -1474,24 +1608,24 @@ def check_certificate_eligibility(course_id: str,
     }
 
 @app.get("/courses/{course_id}/certificate")
-def get_certificate(course_id: str,
+async def get_certificate(course_id: str,
                     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
                     db = Depends(get_db)):
     """Get certificate data if student is eligible."""
     # Re-use check logic
-    eligibility = check_certificate_eligibility(course_id, current_user, db)
+    eligibility = await check_certificate_eligibility(course_id, current_user, db)
     if not eligibility["eligible"]:
         detail = "Course not completed."
         if not eligibility["exam_passed"] and eligibility["exam_required"]:
             detail += " Final Exam not passed."
         raise HTTPException(status_code=400, detail=detail)
     
-    course = db.courses.find_one({"_id": ObjectId(course_id)})
+    course = await db.courses.find_one({"_id": ObjectId(course_id)})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
     # Get org name or Platform name
-    creator = db.users.find_one({"_id": ObjectId(course["user_id"])})
+    creator = await db.users.find_one({"_id": ObjectId(course["user_id"])})
     
     # If the user creating the course is an organization, use their name. 
     # Otherwise, it's an AI generated/self-generated course, so use the platform name.
@@ -1500,12 +1634,12 @@ def get_certificate(course_id: str,
     else:
         org_name = "EduCore"
     # Get template
-    template = db.certificate_templates.find_one({"course_id": course_id})
+    template = await db.certificate_templates.find_one({"course_id": course_id})
     if not template:
         template = {}
     
     # Check for existing certificate
-    existing = db.certificates.find_one({
+    existing = await db.certificates.find_one({
         "course_id": course_id,
         "user_id": current_user.id
     })
@@ -1521,7 +1655,7 @@ def get_certificate(course_id: str,
             "issued_at": datetime.utcnow().isoformat(),
             "certificate_id": f"EDUCORE-{uuid.uuid4().hex[:8].upper()}"
         }
-        db.certificates.insert_one(cert_doc)
+        await db.certificates.insert_one(cert_doc)
         existing = cert_doc
     
     return {
@@ -1546,9 +1680,9 @@ def get_certificate(course_id: str,
 # --- Certificate Verification ---
 
 @app.get("/certificates/verify/{cert_id}")
-def verify_certificate(cert_id: str, db = Depends(get_db)):
+async def verify_certificate(cert_id: str, db = Depends(get_db)):
     """Public endpoint to verify a certificate's authenticity."""
-    cert = db.certificates.find_one({"certificate_id": cert_id})
+    cert = await db.certificates.find_one({"certificate_id": cert_id})
     if not cert:
         raise HTTPException(status_code=404, detail="Invalid Certificate ID or Certificate not found.")
         
@@ -1556,22 +1690,22 @@ def verify_certificate(cert_id: str, db = Depends(get_db)):
     user_id = cert["user_id"]
     
     # 1. Course Details
-    course = db.courses.find_one({"_id": ObjectId(course_id)})
+    course = await db.courses.find_one({"_id": ObjectId(course_id)})
     if not course:
         raise HTTPException(status_code=404, detail="Associated course not found.")
         
     # Get Module Count
-    module_count = db.chapters.count_documents({"course_id": course_id})
+    module_count = await db.chapters.count_documents({"course_id": course_id})
     
     # 2. Quiz Performance (Average)
-    quizzes = list(db.quiz_results.find({"course_id": course_id, "user_id": user_id}))
+    quizzes = await db.quiz_results.find({"course_id": course_id, "user_id": user_id}).to_list(None)
     avg_quiz_score = 0
     if len(quizzes) > 0:
         total_q_score = sum((q["score"] / q["total_questions"] * 100) if q["total_questions"] > 0 else 0 for q in quizzes)
         avg_quiz_score = round(total_q_score / len(quizzes), 2)
         
     # 3. Final Exam Result
-    exam_result = db.exam_results.find_one(
+    exam_result = await db.exam_results.find_one(
         {"course_id": course_id, "user_id": user_id, "passed": True},
         sort=[("timestamp", -1)]
     )
@@ -1609,7 +1743,7 @@ def verify_certificate(cert_id: str, db = Depends(get_db)):
 # --- Marketplace Endpoints ---
 
 @app.get("/marketplace/courses")
-def get_marketplace_courses(
+async def get_marketplace_courses(
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
     """Browse all published org courses for the marketplace."""
@@ -1618,23 +1752,23 @@ def get_marketplace_courses(
     # Get user's enrolled course IDs for badge
     enrolled_ids = set()
     if current_user.role == "student":
-        for enr in db.enrollments.find({"user_id": current_user.id}):
+        async for enr in db.enrollments.find({"user_id": current_user.id}):
             enrolled_ids.add(enr["course_id"])
     
     # Also treat self-created courses as owned
-    for own in db.courses.find({"user_id": current_user.id}):
+    async for own in db.courses.find({"user_id": current_user.id}):
         enrolled_ids.add(str(own["_id"]))
     
     courses = []
-    for c in courses_cursor:
+    async for c in courses_cursor:
         course_id = str(c["_id"])
         
         # Get org/creator name
-        creator = db.users.find_one({"_id": ObjectId(c["user_id"])})
+        creator = await db.users.find_one({"_id": ObjectId(c["user_id"])})
         org_name = creator["username"] if creator else "Unknown"
         
         # Module count
-        module_count = db.chapters.count_documents({"course_id": course_id})
+        module_count = await db.chapters.count_documents({"course_id": course_id})
         
         courses.append({
             "id": course_id,
@@ -1651,7 +1785,7 @@ def get_marketplace_courses(
     return courses
 
 @app.post("/marketplace/enroll")
-def enroll_in_course(
+async def enroll_in_course(
     data: schemas.CourseEnroll,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
@@ -1660,12 +1794,12 @@ def enroll_in_course(
         raise HTTPException(status_code=403, detail="Only students can enroll")
     
     # Check course exists and is published
-    course = db.courses.find_one({"_id": ObjectId(data.course_id), "is_published": True})
+    course = await db.courses.find_one({"_id": ObjectId(data.course_id), "is_published": True})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found or not published")
     
     # Check if already enrolled
-    existing = db.enrollments.find_one({"user_id": current_user.id, "course_id": data.course_id})
+    existing = await db.enrollments.find_one({"user_id": current_user.id, "course_id": data.course_id})
     if existing:
         raise HTTPException(status_code=400, detail="Already enrolled in this course")
         
@@ -1674,14 +1808,14 @@ def enroll_in_course(
         if not data.access_key:
             raise HTTPException(status_code=400, detail="Access Key is required for paid courses.")
             
-        key_doc = db.course_keys.find_one({"course_id": data.course_id, "key": data.access_key})
+        key_doc = await db.course_keys.find_one({"course_id": data.course_id, "key": data.access_key})
         if not key_doc:
             raise HTTPException(status_code=400, detail="Invalid Access Key.")
         if key_doc.get("is_used"):
             raise HTTPException(status_code=400, detail="This Access Key has already been used.")
             
         # Burn the key
-        db.course_keys.update_one(
+        await db.course_keys.update_one(
             {"_id": key_doc["_id"]},
             {"$set": {
                 "is_used": True, 
@@ -1701,12 +1835,12 @@ def enroll_in_course(
         "enrolled_at": datetime.utcnow().isoformat(),
         "progress": 0.0
     }
-    db.enrollments.insert_one(enrollment_doc)
+    await db.enrollments.insert_one(enrollment_doc)
     
     return {"message": "Successfully enrolled", "course_id": data.course_id}
 
 @app.put("/org/courses/{course_id}/publish")
-def toggle_publish_course(
+async def toggle_publish_course(
     course_id: str,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
@@ -1714,19 +1848,19 @@ def toggle_publish_course(
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Role must be organization")
     
-    course = db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
     new_status = not course.get("is_published", False)
-    db.courses.update_one(
+    await db.courses.update_one(
         {"_id": ObjectId(course_id)},
         {"$set": {"is_published": new_status}}
     )
     return {"message": f"Course {'published' if new_status else 'unpublished'}", "is_published": new_status}
 
 @app.post("/org/courses/{course_id}/keys", response_model=List[schemas.CourseKeyResponse])
-def generate_course_keys(
+async def generate_course_keys(
     course_id: str,
     data: schemas.CourseKeyCreate,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
@@ -1735,7 +1869,7 @@ def generate_course_keys(
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Only organizations can generate keys")
     
-    course = db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found or unauthorized")
     
@@ -1750,13 +1884,13 @@ def generate_course_keys(
             "used_by_student_name": None,
             "created_at": datetime.utcnow().isoformat()
         }
-        db.course_keys.insert_one(key_doc)
+        await db.course_keys.insert_one(key_doc)
         keys.append(key_doc)
         
     return keys
 
 @app.get("/org/courses/{course_id}/keys", response_model=List[schemas.CourseKeyResponse])
-def get_course_keys(
+async def get_course_keys(
     course_id: str,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
@@ -1764,119 +1898,45 @@ def get_course_keys(
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Only organizations can get keys")
         
-    course = db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(course_id), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found or unauthorized")
         
     # Return keys without ObjectId wrapping
     keys_cursor = db.course_keys.find({"course_id": course_id}).sort("created_at", -1)
     keys = []
-    for k in keys_cursor:
+    async for k in keys_cursor:
         # Pydantic schema expects standard fields
         keys.append(schemas.CourseKeyResponse(**k))
     return keys
 
 @app.get("/org/analytics", response_model=schemas.OrgAnalyticsResponse)
-def get_org_analytics(current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
+async def get_org_analytics(refresh: bool = False,
+                      current_user: models_mongo.UserModel = Depends(auth.get_current_active_user), db = Depends(get_db)):
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Only organizations can view analytics")
-        
-    courses = list(db.courses.find({"user_id": current_user.id}))
-    course_ids = [str(c["_id"]) for c in courses]
-    
-    total_students = len(db.enrollments.distinct("user_id", {"course_id": {"$in": course_ids}}))
-    active_courses = len([c for c in courses if c.get("is_published", False)])
-    
-    course_stats = []
-    student_map = {}
-    
-    overall_progress_sum = 0
-    overall_progress_count = 0
-    
-    for c in courses:
-        cid = str(c["_id"])
-        enrollments = list(db.enrollments.find({"course_id": cid}))
-        
-        c_progress_sum = 0
-        c_score_sum = 0
-        c_score_count = 0
-        
-        exam_results = list(db.exam_results.find({"course_id": cid}))
-        total_chapters = db.chapters.count_documents({"course_id": cid})
-        
-        for e in enrollments:
-            uid = e["user_id"]
-            if uid not in student_map:
-                u_doc = db.users.find_one({"_id": ObjectId(uid)})
-                student_map[uid] = {
-                    "student_name": u_doc["username"] if u_doc else "Unknown",
-                    "enrolled_courses": 0,
-                    "progress_sum": 0,
-                    "score_sum": 0,
-                    "score_count": 0
-                }
-            
-            completed_quizzes = db.quiz_results.count_documents({"course_id": cid, "user_id": uid})
-            progress = (completed_quizzes / total_chapters * 100) if total_chapters > 0 else 0
-            progress = min(100.0, progress)
-            
-            student_exams = [xr for xr in exam_results if xr["user_id"] == uid]
-            if student_exams:
-                score = max([float(xr.get("percentage", 0)) for xr in student_exams])
-            else:
-                student_quizzes = list(db.quiz_results.find({"course_id": cid, "user_id": uid}))
-                if student_quizzes:
-                    q_scores = [(float(q.get("score", 0)) / float(q.get("total_questions", 1)) * 100) for q in student_quizzes if q.get("total_questions", 0) > 0]
-                    score = sum(q_scores) / len(q_scores) if q_scores else 0
-                else:
-                    score = 0
-                    
-            c_progress_sum += progress
-            if score > 0 or student_exams or completed_quizzes > 0:
-                c_score_sum += score
-                c_score_count += 1
-                
-                student_map[uid]["score_sum"] += score
-                student_map[uid]["score_count"] += 1
-                
-            student_map[uid]["enrolled_courses"] += 1
-            student_map[uid]["progress_sum"] += progress
-            
-            overall_progress_sum += progress
-            overall_progress_count += 1
-            
-        c_avg_progress = c_progress_sum / len(enrollments) if enrollments else 0
-        c_avg_score = c_score_sum / c_score_count if c_score_count > 0 else 0
-        
-        course_stats.append({
-            "course_id": cid,
-            "topic": c["topic"],
-            "enrolled_students": len(enrollments),
-            "avg_progress": c_avg_progress,
-            "avg_score": c_avg_score
-        })
-        
-    student_stats = []
-    for uid, data in student_map.items():
-        avg_p = data["progress_sum"] / data["enrolled_courses"] if data["enrolled_courses"] > 0 else 0
-        avg_s = data["score_sum"] / data["score_count"] if data["score_count"] > 0 else 0
-        student_stats.append({
-            "student_id": str(uid),
-            "student_name": data["student_name"],
-            "enrolled_courses": data["enrolled_courses"],
-            "avg_progress": avg_p,
-            "avg_score": avg_s
-        })
-        
-    avg_completion = overall_progress_sum / overall_progress_count if overall_progress_count > 0 else 0
     
-    return {
-        "total_students": total_students,
-        "active_courses": active_courses,
-        "avg_completion": avg_completion,
-        "course_stats": course_stats,
-        "student_stats": student_stats
-    }
+    # Aggregated in MongoDB and served from a short-lived snapshot (?refresh=true bypasses it)
+    return await analytics.get_org_analytics(db, current_user.id, refresh=refresh)
+
+@app.get("/org/llm-usage")
+async def get_org_llm_usage(days: int = 30, group_by: str = "route",
+                            current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
+                            db = Depends(get_db)):
+    """LLM token usage and cost of the organization, grouped by route, agent, provider, model or user_id."""
+    if current_user.role not in ("organization", "admin"):
+        raise HTTPException(status_code=403, detail="Only organizations can view LLM usage")
+    if group_by not in usage.GROUP_BY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(usage.GROUP_BY_FIELDS)}")
+    days = max(1, min(days, usage.LLM_USAGE_TTL_DAYS))
+
+    if current_user.role == "admin":
+        match = {}
+    elif current_user.organization_id:
+        match = {"$or": [{"organization_id": current_user.organization_id}, {"user_id": current_user.id}]}
+    else:
+        match = {"user_id": current_user.id}
+    return await usage.summarize(db, match, group_by=group_by, days=days)
 
 
 # --- Mock Payment & Secure Registration System ---
@@ -1887,7 +1947,7 @@ def get_hmac_signature(token_value: str) -> str:
     return hmac.new(secret, token_value.encode('utf-8'), hashlib.sha256).hexdigest()
 
 @app.post("/marketplace/orders/create", response_model=schemas.OrderResponse)
-def create_order(
+async def create_order(
     data: schemas.OrderCreate,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
@@ -1895,7 +1955,7 @@ def create_order(
     if current_user.role != "student":
         raise HTTPException(status_code=403, detail="Only students can create orders")
         
-    course = db.courses.find_one({"_id": ObjectId(data.course_id), "is_published": True})
+    course = await db.courses.find_one({"_id": ObjectId(data.course_id), "is_published": True})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
         
@@ -1903,7 +1963,7 @@ def create_order(
         raise HTTPException(status_code=400, detail="Course is free, enroll directly")
         
     # Check existing access
-    existing = db.enrollments.find_one({"user_id": current_user.id, "course_id": data.course_id})
+    existing = await db.enrollments.find_one({"user_id": current_user.id, "course_id": data.course_id})
     if existing:
         raise HTTPException(status_code=400, detail="Already enrolled")
         
@@ -1923,18 +1983,18 @@ def create_order(
         "ip_address": None # Capturing IP is tricky locally, skipping for prototype
     }
     
-    res = db.orders.insert_one(order_doc)
+    res = await db.orders.insert_one(order_doc)
     
     order_doc["id"] = str(res.inserted_id)
     return order_doc
 
 @app.post("/marketplace/orders/{payment_session_id}/pay")
-def simulate_payment(
+async def simulate_payment(
     payment_session_id: str,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
     """Simulate user paying on the mock gateway."""
-    order = db.orders.find_one({"payment_session_id": payment_session_id, "user_id": current_user.id})
+    order = await db.orders.find_one({"payment_session_id": payment_session_id, "user_id": current_user.id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
         
@@ -1943,7 +2003,7 @@ def simulate_payment(
         
     payment_reference_id = f"TXN_{uuid.uuid4().hex[:12].upper()}"
     
-    db.orders.update_one(
+    await db.orders.update_one(
         {"_id": order["_id"]},
         {"$set": {
             "status": "payment_submitted",
@@ -1956,22 +2016,22 @@ def simulate_payment(
 
 
 @app.get("/org/orders", response_model=List[schemas.OrderResponse])
-def get_org_orders(
+async def get_org_orders(
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
     """Get all orders for the organization's courses."""
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Only organizations can view orders")
         
-    courses = list(db.courses.find({"user_id": current_user.id}))
+    courses = await db.courses.find({"user_id": current_user.id}).to_list(None)
     course_ids = [str(c["_id"]) for c in courses]
     
-    orders = list(db.orders.find({"course_id": {"$in": course_ids}}).sort("created_at", -1))
+    orders = await db.orders.find({"course_id": {"$in": course_ids}}).sort("created_at", -1).to_list(None)
     
     # Enrich with user and course info
     for o in orders:
         o["id"] = str(o["_id"])
-        user = db.users.find_one({"_id": ObjectId(o["user_id"])})
+        user = await db.users.find_one({"_id": ObjectId(o["user_id"])})
         course = next((c for c in courses if str(c["_id"]) == o["course_id"]), None)
         o["username"] = user["username"] if user else "Unknown"
         o["course_topic"] = course["topic"] if course else "Unknown"
@@ -1980,7 +2040,7 @@ def get_org_orders(
 
 
 @app.post("/org/orders/{order_id}/verify")
-def verify_order(
+async def verify_order(
     order_id: str,
     action_data: schemas.VerificationAction,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
@@ -1989,17 +2049,17 @@ def verify_order(
     if current_user.role != "organization":
         raise HTTPException(status_code=403, detail="Unauthorized")
         
-    order = db.orders.find_one({"order_id": order_id})
+    order = await db.orders.find_one({"order_id": order_id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
         
     # Verify org owns this course
-    course = db.courses.find_one({"_id": ObjectId(order["course_id"]), "user_id": current_user.id})
+    course = await db.courses.find_one({"_id": ObjectId(order["course_id"]), "user_id": current_user.id})
     if not course:
         raise HTTPException(status_code=403, detail="Unauthorized for this course's orders")
         
     if action_data.action == "reject":
-        db.orders.update_one({"_id": order["_id"]}, {"$set": {"status": "rejected", "updated_at": datetime.utcnow().isoformat()}})
+        await db.orders.update_one({"_id": order["_id"]}, {"$set": {"status": "rejected", "updated_at": datetime.utcnow().isoformat()}})
         return {"message": "Order rejected"}
         
     if action_data.action == "approve":
@@ -2007,7 +2067,7 @@ def verify_order(
              raise HTTPException(status_code=400, detail="Order already approved")
              
         # Mark as paid
-        db.orders.update_one({"_id": order["_id"]}, {"$set": {"status": "paid", "updated_at": datetime.utcnow().isoformat()}})
+        await db.orders.update_one({"_id": order["_id"]}, {"$set": {"status": "paid", "updated_at": datetime.utcnow().isoformat()}})
         
         # Generate Secure Token
         token_value = str(uuid.uuid4()) + uuid.uuid4().hex  # 32+ char random string
@@ -2023,7 +2083,7 @@ def verify_order(
             "expiry_date": expiry_date.isoformat(),
             "created_at": datetime.utcnow().isoformat()
         }
-        db.enrollment_tokens.insert_one(token_doc)
+        await db.enrollment_tokens.insert_one(token_doc)
         
         # Simulated Email / Output
         activation_link = f"/activate?token={token_value}&signature={signature}"
@@ -2038,7 +2098,7 @@ def verify_order(
 
 
 @app.post("/marketplace/activate")
-def activate_secure_token(
+async def activate_secure_token(
     data: schemas.TokenActivateRequest,
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
@@ -2051,7 +2111,7 @@ def activate_secure_token(
     if not hmac.compare_digest(data.signature, expected_signature):
         raise HTTPException(status_code=400, detail="Invalid token signature. Token tampered.")
         
-    token_doc = db.enrollment_tokens.find_one({
+    token_doc = await db.enrollment_tokens.find_one({
         "token_value": data.token_value,
         "signature": data.signature,
         "user_id": current_user.id
@@ -2068,7 +2128,7 @@ def activate_secure_token(
         raise HTTPException(status_code=400, detail="Token has expired.")
         
     # Idempotent Atomic Update
-    res = db.enrollment_tokens.update_one(
+    res = await db.enrollment_tokens.update_one(
         {"_id": token_doc["_id"], "is_used": False},
         {"$set": {"is_used": True, "used_at": datetime.utcnow().isoformat()}}
     )
@@ -2077,7 +2137,7 @@ def activate_secure_token(
         raise HTTPException(status_code=400, detail="Failed to activate token. Possibly a duplicate request.")
         
     # Check if already enrolled
-    existing = db.enrollments.find_one({"user_id": current_user.id, "course_id": token_doc["course_id"]})
+    existing = await db.enrollments.find_one({"user_id": current_user.id, "course_id": token_doc["course_id"]})
     if existing:
         return {"message": "Successfully activated, but you were already enrolled."}
         
@@ -2088,13 +2148,13 @@ def activate_secure_token(
         "enrolled_at": datetime.utcnow().isoformat(),
         "progress": 0.0
     }
-    db.enrollments.insert_one(enrollment_doc)
+    await db.enrollments.insert_one(enrollment_doc)
     
     return {"message": "Token activated successfully. You are now enrolled.", "course_id": token_doc["course_id"]}
 
 
 @app.get("/marketplace/tokens/pending", response_model=List[schemas.PendingTokenResponse])
-def get_pending_tokens(
+async def get_pending_tokens(
     current_user: models_mongo.UserModel = Depends(auth.get_current_active_user),
     db = Depends(get_db)):
     """Get pending token activation links for a student."""
@@ -2103,15 +2163,15 @@ def get_pending_tokens(
         
     now = datetime.utcnow().isoformat()
     # Find tokens that are not used and not expired
-    tokens = list(db.enrollment_tokens.find({
+    tokens = await db.enrollment_tokens.find({
         "user_id": current_user.id,
         "is_used": False,
         "expiry_date": {"$gt": now}
-    }))
+    }).to_list(None)
     
     result = []
     for t in tokens:
-        course = db.courses.find_one({"_id": ObjectId(t["course_id"])})
+        course = await db.courses.find_one({"_id": ObjectId(t["course_id"])})
         if course:
             result.append({
                 "course_id": t["course_id"],
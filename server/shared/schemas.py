@@ -82,6 +82,9 @@ class OrgCourseCreate(BaseModel):
     price: float = 0.0  # 0 = free
     thumbnail_url: Optional[str] = None
 
+class OrgCourseBatchCreate(BaseModel):
+    courses: List[OrgCourseCreate]
+
 class CourseEnroll(BaseModel):
     course_id: str
     access_key: Optional[str] = None
@@ -0,0 +1,58 @@
+from bson import ObjectId
+from pymongo import DeleteMany, InsertOne, UpdateOne
+
+from server.core import courses
+from server.shared.schemas import Chapter, CourseRoadmap
+
+
+def _roadmap(*titles):
+    return CourseRoadmap(topic="Physics", chapters=[
+        Chapter(chapter_number=i + 1, title=title, description=f"About {title}")
+        for i, title in enumerate(titles)
+    ])
+
+
+def _existing(*titles):
+    return [{"_id": ObjectId(), "title": title} for title in titles]
+
+
+def _fields(index, title):
+    return {"chapter_number": index + 1, "order_index": index, "title": title, "description": f"About {title}"}
+
+
+def _update(chapter, index, title):
+    return UpdateOne({"_id": chapter["_id"]}, {"$set": _fields(index, title)})
+
+
+def _insert(index, title):
+    return InsertOne({**_fields(index, title), "content_markdown": "", "quiz_json": [], "course_id": "c1"})
+
+
+def test_diff_keeps_chapters_matched_by_normalized_title():
+    existing = _existing("Kinematics", "Newton's  Laws")
+    operations, removed, counts = courses._diff("c1", existing, _roadmap("newton's laws", "KINEMATICS"))
+
+    assert counts == {"kept": 2, "added": 0, "removed": 0}
+    assert removed == []
+    assert operations == [_update(existing[1], 0, "newton's laws"), _update(existing[0], 1, "KINEMATICS")]
+
+
+def test_diff_inserts_new_and_deletes_dropped_chapters():
+    existing = _existing("Kinematics", "Optics")
+    operations, removed, counts = courses._diff("c1", existing, _roadmap("Kinematics", "Thermodynamics"))
+
+    assert counts == {"kept": 1, "added": 1, "removed": 1}
+    assert removed == [str(existing[1]["_id"])]
+    assert operations == [
+        _update(existing[0], 0, "Kinematics"),
+        _insert(1, "Thermodynamics"),
+        DeleteMany({"_id": {"$in": [existing[1]["_id"]]}, "course_id": "c1"}),
+    ]
+
+
+def test_diff_matches_duplicate_titles_one_to_one():
+    existing = _existing("Review", "Review")
+    operations, removed, counts = courses._diff("c1", existing, _roadmap("Review", "Review", "Review"))
+
+    assert counts == {"kept": 2, "added": 1, "removed": 0}
+    assert operations == [_update(existing[0], 0, "Review"), _update(existing[1], 1, "Review"), _insert(2, "Review")]
@@ -0,0 +1,130 @@
+import json
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from server.core import json_repair
+
+
+class Question(BaseModel):
+    question: str
+    options: List[str]
+    correct_answer: str
+
+
+class Chapter(BaseModel):
+    title: str
+    quiz: List[Question]
+
+
+def test_valid_newline_escape_is_kept():
+    data, repaired, truncated = json_repair.loads(r'{"a": "line one\ne.g. foo"}')
+    assert data == {"a": "line one\ne.g. foo"}
+    assert not repaired and not truncated
+
+
+@pytest.mark.parametrize("text", [r"one\nuance", r"one\tonight", r"one\nothing", r"one\tan", r"one\nice"])
+def test_escapes_that_look_like_latex_outside_math_are_kept(text):
+    data, repaired, _ = json_repair.loads('{"a": "%s"}' % text)
+    assert data["a"] == text.replace(r"\n", "\n").replace(r"\t", "\t")
+    assert not repaired
+
+
+def test_frac_in_math_span_is_kept_when_repairing():
+    data, repaired, _ = json_repair.loads(r'{"a": "Half is $\frac{1}{2}$, about $\sqrt{0.25}$"}')
+    assert data == {"a": r"Half is $\frac{1}{2}$, about $\sqrt{0.25}$"}
+    assert repaired
+
+
+def test_latex_commands_in_math_spans_are_kept_when_repairing():
+    data, _, _ = json_repair.loads(r'{"a": "$$\nabla \times \beta$$ and \(\theta \neq \rho \alpha\)"}')
+    assert data["a"] == r"$$\nabla \times \beta$$ and \(\theta \neq \rho \alpha\)"
+
+
+def test_escapes_outside_math_spans_are_not_taken_for_latex():
+    data, _, _ = json_repair.loads(r'{"a": "\alpha\nabla $x$"}')
+    assert data["a"] == "\\alpha\nabla $x$"
+
+
+@pytest.mark.parametrize("math", [r"$$\ne^{i\\pi}+1=0\n$$", r"\\[\nu = 1\n\\]", r"$$\ni \\in I\n$$"])
+def test_valid_json_with_newline_before_math_is_unchanged(math):
+    text = '{"a": "Euler:\\n%s"}' % math
+    data, repaired, truncated = json_repair.loads(text)
+    assert data == json.loads(text)
+    assert not repaired and not truncated
+
+
+def test_newline_escape_before_e_in_math_stays_a_newline_when_repairing():
+    data, repaired, _ = json_repair.loads(r'{"a": "$$\ne^{x}$$ \alpha"}')
+    assert data["a"] == "$$\ne^{x}$$ \\alpha"
+    assert repaired
+
+
+def test_valid_json_is_not_rewritten_inside_math():
+    data, repaired, _ = json_repair.loads(r'{"a": "$\frac{1}{2}$"}')
+    assert data == {"a": "$\x0crac{1}{2}$"}
+    assert not repaired
+
+
+def test_invalid_escapes_are_doubled_without_touching_valid_ones():
+    data, repaired, truncated = json_repair.loads(r'{"a": "\alpha\nnext line"}')
+    assert data == {"a": "\\alpha\nnext line"}
+    assert repaired and not truncated
+
+
+def test_raw_newline_inside_string():
+    data, repaired, _ = json_repair.loads('{"a": "two\nlines"}')
+    assert data == {"a": "two\nlines"}
+    assert repaired
+
+
+def test_extracts_json_from_fences_and_prose():
+    data, _, _ = json_repair.loads('Here you go:\n```json\n[1, {"b": "]"}]\n```\nEnjoy!')
+    assert data == [1, {"b": "]"}]
+
+
+def test_truncated_document_keeps_complete_values():
+    data, repaired, truncated = json_repair.loads('{"items": [{"a": 1}, {"a": 2}, {"a": 3, "b": "cut o')
+    assert truncated and repaired
+    assert data["items"][:2] == [{"a": 1}, {"a": 2}]
+
+
+def test_complete_truncated_cuts_back_to_last_comma():
+    assert json_repair.complete_truncated('[1, 2, {"x": tr') == [1, 2]
+
+
+def test_complete_truncated_raises_when_nothing_parses():
+    with pytest.raises(ValueError):
+        json_repair.complete_truncated("{:")
+
+
+def test_loads_raises_without_json():
+    with pytest.raises(ValueError):
+        json_repair.loads("no json here")
+
+
+def test_fix_escapes_leaves_valid_json_unchanged():
+    text = r'{"a": "x\ny\t\"z\" \\ \u00e9 \frac"}'
+    assert json_repair.fix_escapes(text) == text
+
+
+def test_parse_drops_invalid_list_items():
+    text = ('{"title": "T", "quiz": [{"question": "q", "options": ["a"], "correct_answer": "a"}, '
+            '{"question": "half"}]}')
+    result = json_repair.parse(text, Chapter)
+    assert result.ok
+    assert result.dropped_items == 1
+    assert len(result.value.quiz) == 1
+
+
+def test_parse_reports_invalid_fields():
+    result = json_repair.parse('{"quiz": []}', Chapter)
+    assert not result.ok
+    assert result.invalid_fields == ["title"]
+
+
+def test_parse_applies_prepare():
+    result = json_repair.parse('{"chapter": {"title": "T", "quiz": []}}', Chapter,
+                               prepare=lambda data: data["chapter"])
+    assert result.ok and result.value.title == "T"
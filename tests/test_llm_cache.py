@@ -0,0 +1,27 @@
+from server.core import llm_cache
+
+MODELS = [("groq", "llama-3.1-8b-instant"), ("gemini", "gemini-1.5-flash")]
+
+
+def _cache(tmp_path):
+    return llm_cache.LLMCache(llm_cache.FileCacheBackend(str(tmp_path), ttl=3600, max_entries=10))
+
+
+def test_key_ignores_provider_order():
+    assert llm_cache.make_key(MODELS, "sys", "prompt", True) == \
+        llm_cache.make_key(list(reversed(MODELS)), "sys", "prompt", True)
+
+
+def test_model_change_misses_the_cache(tmp_path):
+    cache = _cache(tmp_path)
+    cache.set(llm_cache.make_key(MODELS, "sys", "prompt", True), "old answer")
+
+    upgraded = [("groq", "llama-3.3-70b-versatile"), ("gemini", "gemini-1.5-flash")]
+    assert cache.get(llm_cache.make_key(upgraded, "sys", "prompt", True)) is None
+    assert cache.get(llm_cache.make_key(MODELS, "sys", "prompt", True)) == "old answer"
+
+
+def test_provider_set_change_misses_the_cache(tmp_path):
+    cache = _cache(tmp_path)
+    cache.set(llm_cache.make_key(MODELS, "sys", "prompt", False), "answer")
+    assert cache.get(llm_cache.make_key(MODELS[:1], "sys", "prompt", False)) is None
@@ -0,0 +1,93 @@
+import pytest
+
+from server.core import llm_router
+
+
+@pytest.fixture(autouse=True)
+def no_exploration(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_ROUTER_EXPLORE", 0.0)
+
+
+def _open(router, name):
+    for _ in range(llm_router.LLM_BREAKER_FAILURES):
+        assert router.begin(name)
+        router.record(name, False)
+
+
+def _cool_down(router, name):
+    router.health[name].opened_at -= llm_router.LLM_BREAKER_COOLDOWN
+
+
+def test_unmeasured_providers_keep_configured_order():
+    router = llm_router.Router(["groq", "gemini"])
+    assert router.candidates() == ["groq", "gemini"]
+
+
+def test_measured_providers_are_ranked_by_p50_latency():
+    router = llm_router.Router(["groq", "gemini", "stub"])
+    for _ in range(llm_router.LLM_ROUTER_MIN_SAMPLES):
+        router.record("groq", True, latency=2.0)
+        router.record("gemini", True, latency=0.5)
+    assert router.candidates() == ["gemini", "groq", "stub"]
+
+
+def test_consecutive_failures_open_the_breaker():
+    router = llm_router.Router(["groq", "gemini"])
+    _open(router, "groq")
+    assert router.health["groq"].state == llm_router.OPEN
+    assert router.candidates() == ["gemini"]
+    assert not router.begin("groq")
+
+
+def test_error_rate_opens_the_breaker():
+    router = llm_router.Router(["groq"])
+    for i in range(2 * llm_router.LLM_ROUTER_MIN_SAMPLES):
+        router.record("groq", i % 2 == 0, latency=0.1)
+    assert router.health["groq"].state == llm_router.OPEN
+
+
+def test_half_open_lets_a_single_probe_through():
+    router = llm_router.Router(["groq"])
+    _open(router, "groq")
+    _cool_down(router, "groq")
+
+    assert router.candidates() == ["groq"]
+    assert router.begin("groq")
+    assert router.health["groq"].state == llm_router.HALF_OPEN
+    assert not router.begin("groq")
+    assert router.candidates() == []
+
+
+def test_successful_probe_closes_the_breaker():
+    router = llm_router.Router(["groq"])
+    _open(router, "groq")
+    _cool_down(router, "groq")
+    router.begin("groq")
+    router.record("groq", True, latency=0.1)
+
+    health = router.health["groq"]
+    assert health.state == llm_router.CLOSED
+    assert list(health.outcomes) == []
+    assert router.begin("groq")
+
+
+def test_failed_probe_reopens_the_breaker():
+    router = llm_router.Router(["groq"])
+    _open(router, "groq")
+    _cool_down(router, "groq")
+    router.begin("groq")
+    router.record("groq", False)
+
+    assert router.health["groq"].state == llm_router.OPEN
+    assert router.candidates() == []
+
+
+def test_abandoned_probe_lets_the_next_one_through():
+    router = llm_router.Router(["groq"])
+    _open(router, "groq")
+    _cool_down(router, "groq")
+    router.begin("groq")
+    router.abandon("groq")
+
+    assert router.health["groq"].state == llm_router.HALF_OPEN
+    assert router.begin("groq")
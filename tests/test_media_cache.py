@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+
+from server.core import media_cache
+
+
+def _write(directory, name, size, mtime):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    now = time.time()
+    for i in range(4):
+        _write(tmp_path, f"video_{i}.mp4", 100, now - 100 + i)
+    _write(tmp_path, ".partial_video.mp4", 1000, now - 500)
+
+    removed = media_cache.evict(str(tmp_path), 250, "video_", ".mp4")
+
+    assert removed == ["video_0.mp4", "video_1.mp4"]
+    assert sorted(os.listdir(tmp_path)) == [".partial_video.mp4", "video_2.mp4", "video_3.mp4"]
+
+
+def test_evict_keeps_files_used_after_cutoff(tmp_path):
+    now = time.time()
+    _write(tmp_path, "old.mp3", 100, now - 100)
+    _write(tmp_path, "in_use.mp3", 100, now - 10)
+
+    removed = media_cache.evict(str(tmp_path), 0, suffix=".mp3", keep_after=now - 50)
+
+    assert removed == ["old.mp3"]
+    assert os.listdir(tmp_path) == ["in_use.mp3"]
+
+
+def test_finish_render_protects_running_renders(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_cache, "TTS_DIR", str(tmp_path))
+    monkeypatch.setattr(media_cache, "MEDIA_TTS_CACHE_MAX_BYTES", 0)
+    running = media_cache.begin_render()
+    finished = media_cache.begin_render()
+    hit = _write(tmp_path, "hit.mp3", 100, time.time())
+    _write(tmp_path, "stale.mp3", 100, time.time() - 3600)
+
+    media_cache.finish_render(finished)
+    assert os.listdir(tmp_path) == ["hit.mp3"]
+
+    media_cache.finish_render(running)
+    later = media_cache.begin_render()
+    media_cache.finish_render(later)
+    assert not os.path.exists(hit)
+
+
+def test_video_key_depends_on_content_voice_and_settings():
+    key = media_cache.video_key("text", "voice", {"fps": 24})
+    assert key == media_cache.video_key("text", "voice", {"fps": 24})
+    assert key != media_cache.video_key("text2", "voice", {"fps": 24})
+    assert key != media_cache.video_key("text", "voice2", {"fps": 24})
+    assert key != media_cache.video_key("text", "voice", {"fps": 30})
+
+
+class _Collection:
+    def __init__(self):
+        self.docs = {}
+        self.deleted = []
+
+    async def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = doc
+
+    async def delete_many(self, query):
+        self.deleted.append(query)
+
+
+class _Db:
+    def __init__(self):
+        self.video_cache = _Collection()
+
+
+def test_store_keeps_new_video_over_the_size_bound(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_cache, "VIDEO_DIR", str(tmp_path))
+    monkeypatch.setattr(media_cache, "MEDIA_VIDEO_CACHE_MAX_BYTES", 100)
+    old = _write(tmp_path, "video_old.mp4", 100, time.time() - 3600)
+    render_started = time.time() - 60
+    new = _write(tmp_path, "video_new.mp4", 500, time.time())
+
+    db = _Db()
+    asyncio.run(media_cache.store(db, "key", "/static/videos/video_new.mp4", 3, render_started))
+
+    assert os.path.exists(new)
+    assert not os.path.exists(old)
+    assert db.video_cache.deleted == [{"video_url": {"$in": ["/static/videos/video_old.mp4"]}}]
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from server.core import ratelimit
+
+
+def _limiter(max_concurrency=4, rpm=1000, tpm=100000):
+    return ratelimit.ProviderLimiter("test:model", rpm, tpm, max_concurrency=max_concurrency)
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = ratelimit.TokenBucket(60)
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1) == pytest.approx(0.0)
+
+
+def test_token_bucket_oversized_request_drains_whole_bucket():
+    bucket = ratelimit.TokenBucket(60)
+    now = bucket.updated
+    assert bucket.wait_time(1000, now) == 0
+    bucket.take(1000)
+    assert bucket.level == 0
+
+
+def test_token_bucket_adjust_refunds_up_to_capacity():
+    bucket = ratelimit.TokenBucket(60)
+    bucket.take(30)
+    bucket.adjust(-10)
+    assert bucket.level == pytest.approx(40, abs=0.1)
+    bucket.adjust(-1000)
+    assert bucket.level == 60
+
+
+def test_concurrency_limit_is_additive_increase_multiplicative_decrease():
+    limiter = _limiter(max_concurrency=4)
+    limiter.acquire(10)
+    limiter.release(10, status=429)
+    assert limiter.concurrency_limit == 2.0
+    assert limiter.stats["throttled"] == 1
+
+    limiter.acquire(10)
+    limiter.release(10)
+    assert limiter.concurrency_limit == 2.5
+
+    for _ in range(20):
+        limiter.acquire(10)
+        limiter.release(10)
+    assert limiter.concurrency_limit == 4
+
+
+def test_server_errors_shrink_limit_but_client_errors_do_not():
+    limiter = _limiter(max_concurrency=4)
+    limiter.acquire(10)
+    limiter.release(10, status=400)
+    assert limiter.concurrency_limit == 4
+    limiter.acquire(10)
+    limiter.release(10, status=503)
+    assert limiter.concurrency_limit == 2
+    assert limiter.stats["errors"] == 1
+
+
+def test_acquire_times_out_when_saturated():
+    limiter = _limiter(max_concurrency=1)
+    limiter.acquire(10)
+    with pytest.raises(ratelimit.RateLimitTimeout):
+        limiter.acquire(10, timeout=0.05)
+    assert limiter.stats["timeouts"] == 1
+
+    limiter.release(10)
+    limiter.acquire(10, timeout=0.05)
+    assert limiter.in_flight == 1
+
+
+def test_aacquire_times_out_during_retry_after():
+    limiter = _limiter()
+    limiter.acquire(10)
+    limiter.release(10, status=429, retry_after=60)
+    with pytest.raises(ratelimit.RateLimitTimeout):
+        asyncio.run(limiter.aacquire(10, timeout=0.05))
+
+
+def test_release_reconciles_estimated_tokens():
+    limiter = _limiter(tpm=1000)
+    limiter.acquire(600)
+    limiter.release(600, actual_tokens=100)
+    assert limiter.tokens.level == pytest.approx(900, abs=1)
+
+
+def test_abandon_frees_slot_without_counting_an_outcome():
+    limiter = _limiter(max_concurrency=4, rpm=10, tpm=1000)
+    limiter.acquire(600)
+    limiter.abandon(600, actual_tokens=0)
+
+    assert limiter.in_flight == 0
+    assert limiter.concurrency_limit == 4
+    assert limiter.tokens.level == pytest.approx(1000, abs=1)
+    assert limiter.requests.level == pytest.approx(10, abs=0.1)
+
+
+def test_abandon_after_cancelled_stream_keeps_the_charge():
+    limiter = _limiter(max_concurrency=2, tpm=1000)
+    limiter.acquire(600)
+    limiter.abandon(600)
+
+    assert limiter.in_flight == 0
+    assert limiter.concurrency_limit == 2
+    assert limiter.tokens.level == pytest.approx(400, abs=1)
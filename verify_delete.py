@@ -1,6 +1,8 @@
 import requests
 import sys
 
+from client.job_polling import wait_for_job
+
 API_URL = "http://localhost:8000"
 
 def test_delete_flow():
@@ -46,7 +48,7 @@ def test_delete_flow():
     # Let's check schemas.CourseRequest from previous file view...
     # schemas not fully viewed, but main.py uses request.structure_type
     
-    if course_res.status_code != 200:
+    if course_res.status_code != 202:
         # Maybe schema validation error?
         # Let's try with minimal payload if defaulting, or check error.
         print(f"Course creation failed: {course_res.text}")
@@ -58,11 +60,15 @@ def test_delete_flow():
             "structure_type": "Academic" 
         })
         
-    if course_res.status_code != 200:
+    if course_res.status_code != 202:
          print(f"Course creation failed retry: {course_res.text}")
          return
 
-    course_id = course_res.json()["course_id"]
+    job = wait_for_job(API_URL, course_res.json()["job_id"], headers)
+    if job["status"] != "succeeded":
+         print(f"Course generation job failed: {job.get('error')}")
+         return
+    course_id = job["result"]["course_id"]
     print(f"Course created: {course_id}")
     
     # 3. Create Note
@@ -1,6 +1,8 @@
 import requests
 import time
 
+from client.job_polling import wait_for_job
+
 API_URL = "http://localhost:8000"
 
 def test_parental_flow():
@@ -85,7 +87,7 @@ def test_parental_flow():
     print("Parent assigning course...")
     course_payload = {"topic": "Parental Math", "grade_level": "Grade 8"}
     res = requests.post(f"{API_URL}/courses/generate-for-child", params={"child_id": child_id}, json=course_payload, headers=headers_p)
-    if res.status_code == 200:
+    if res.status_code == 202 and wait_for_job(API_URL, res.json()["job_id"], headers_p)["status"] == "succeeded":
         print("Course assigned.")
     else:
         print(f"Assign failed: {res.text}")
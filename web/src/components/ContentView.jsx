@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { Loader2, BookOpen, Video, PenTool, ChevronLeft, ChevronRight } from 'lucide-react';
 import ChapterNotes from './ChapterNotes';
+import { waitForJob } from '../utils/jobs';
 
 import ReactMarkdown from 'react-markdown';
 import remarkMath from 'remark-math';
@@ -40,8 +41,40 @@ const ContentView = ({ courseId, chapterId, chapter }) => {
     const fetchContent = async () => {
         setLoading(true);
         try {
-            const res = await axios.post(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/courses/${courseId}/chapters/${chapterId}/generate`);
-            setContent(res.data);
+            // Stream slides over SSE so the first one renders while the rest are still being written
+            const res = await fetch(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/courses/${courseId}/chapters/${chapterId}/generate/stream`, {
+                method: 'POST',
+                headers: { Authorization: `Bearer ${localStorage.getItem('token')}` }
+            });
+            if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let markdown = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // SSE events are separated by a blank line
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                for (const raw of events) {
+                    const event = raw.match(/^event: (.*)$/m)?.[1];
+                    const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+                    if (event === 'token') {
+                        markdown += data.text;
+                        setContent({ content_markdown: markdown, quiz: [] });
+                        setLoading(false);
+                    } else if (event === 'done') {
+                        setContent({ content_markdown: data.content_markdown, quiz: data.quiz });
+                    } else if (event === 'error') {
+                        throw new Error(data.detail);
+                    }
+                }
+            }
         } catch (err) {
             console.error("Failed to load content", err);
         } finally {
@@ -193,7 +226,9 @@ const VideoPlayer = ({ topic, content }) => {
                 content_markdown: content, // sending full markdown
                 chapter_title: topic
             });
-            setVideoUrl(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}` + res.data.video_url);
+            // Rendering runs as a background job; poll it for the video URL
+            const result = await waitForJob(res.data.job_id, { interval: 5000, timeout: 1800000 });
+            setVideoUrl(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}` + result.video_url);
         } catch (err) {
             alert("Video generation failed");
         } finally {
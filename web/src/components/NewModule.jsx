@@ -1,6 +1,7 @@
 import { useState } from 'react';
 import axios from 'axios';
 import { Sparkles, Loader2, ArrowRight } from 'lucide-react';
+import { waitForJob } from '../utils/jobs';
 
 const NewModule = ({ onCourseCreated }) => {
     const [topic, setTopic] = useState("Quantum Physics");
@@ -12,10 +13,11 @@ const NewModule = ({ onCourseCreated }) => {
         try {
             const payload = { topic, grade_level: grade };
             const res = await axios.post(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/courses/generate`, payload);
+            const result = await waitForJob(res.data.job_id);
 
             // Notify parent to refresh list and select new course
-            if (res.data.course_id) {
-                onCourseCreated(res.data.course_id);
+            if (result.course_id) {
+                onCourseCreated(result.course_id);
             }
         } catch (err) {
             alert("Failed to generate couse: " + err.message);
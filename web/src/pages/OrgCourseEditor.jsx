@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { ChevronLeft, Plus, Save, Trash2, Rocket, Loader2, GripVertical, PenLine, X, CheckCircle, Sparkles, Upload, ImagePlus, Award, Palette, Settings, FileText, Check, AlertTriangle, Key } from 'lucide-react';
+import { waitForJob } from '../utils/jobs';
 
 const OrgCourseEditor = () => {
     const { courseId } = useParams();
@@ -209,11 +210,12 @@ const OrgCourseEditor = () => {
 
         setGenerating(true);
         try {
-            await axios.post(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/org/courses/${courseId}/plan`, {
+            const res = await axios.post(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/org/courses/${courseId}/plan`, {
                 topic: course.topic,
                 grade_level: course.grade_level || "General",
                 structure_type: course.structure_type || "week"
             });
+            await waitForJob(res.data.job_id);
             setSelectedChapterId(null);
             await fetchCourseDetails();
         } catch (err) {
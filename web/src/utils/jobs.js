@@ -0,0 +1,17 @@
+import axios from 'axios';
+
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+// Polls a background job (see GET /jobs/{id}) until it finishes and resolves with its result.
+export const waitForJob = async (jobId, { interval = 2000, timeout = 300000 } = {}) => {
+    const deadline = Date.now() + timeout;
+    while (Date.now() < deadline) {
+        const res = await axios.get(`${API_URL}/jobs/${jobId}`);
+        if (res.data.status === 'succeeded') return res.data.result;
+        if (res.data.status === 'failed' || res.data.status === 'cancelled') {
+            throw new Error(res.data.error || `Job ${res.data.status}`);
+        }
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+    throw new Error('Timed out waiting for the job to finish');
+};